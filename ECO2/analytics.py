@@ -0,0 +1,182 @@
+"""
+Activity analytics for EcoLearn.
+
+Completions are rolled up per hour and per day into ActivityRollup rows,
+one per school, kind (lesson or challenge), category and item. Each row
+holds the number of completions, the sum of their quiz scores, and the
+points awarded. The completion paths update the rollups in the same
+transaction (``record``), so trend queries over months read a few
+thousand pre-aggregated rows instead of scanning raw progress.
+
+The rollups describe the current state of the raw rows. A retaken quiz
+moves its completion and score to the new bucket. Points stay in the
+bucket of the completion that earned them, which is also the time the
+points ledger records (the client's time for offline sync). This means
+``rebuild_rollups`` always reproduces what incremental updates produce.
+"""
+
+from datetime import timedelta
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+import archive
+from models import db, ActivityRollup, Challenge, Lesson, PointsEvent, User, UserChallenge, UserProgress
+
+PERIODS = ('hour', 'day')
+KINDS = ('lesson', 'challenge')
+GROUPS = ('category', 'item', 'kind')
+
+# Longest range one query may cover, per period
+MAX_RANGE = {'hour': timedelta(days=31), 'day': timedelta(days=3 * 366)}
+
+_KEY = ['period', 'school', 'bucket', 'kind', 'category', 'item_id']
+
+
+def truncate(moment, period):
+    if period == 'hour':
+        return moment.replace(minute=0, second=0, microsecond=0)
+    return moment.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def _upsert(values):
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(ActivityRollup).values(**values)
+        statement = statement.on_conflict_do_update(index_elements=_KEY, set_={
+            'completions': ActivityRollup.completions + statement.excluded.completions,
+            'score_sum': ActivityRollup.score_sum + statement.excluded.score_sum,
+            'points': ActivityRollup.points + statement.excluded.points
+        })
+        db.session.execute(statement)
+        return
+
+    updated = ActivityRollup.query.filter_by(**{name: values[name] for name in _KEY}).update({
+        ActivityRollup.completions: ActivityRollup.completions + values['completions'],
+        ActivityRollup.score_sum: ActivityRollup.score_sum + values['score_sum'],
+        ActivityRollup.points: ActivityRollup.points + values['points']
+    }, synchronize_session=False)
+    if not updated:
+        db.session.add(ActivityRollup(**values))
+
+
+def record(kind, school, category, item_id, at, completions=0, score=0, points=0, previous_at=None,
+           previous_score=0):
+    """Add to the hourly and daily rollups containing ``at``; the caller commits.
+
+    ``previous_at`` moves an earlier completion (with ``previous_score``) out
+    of its bucket, e.g. for a retaken quiz.
+    """
+    for period in PERIODS:
+        deltas = {truncate(at, period): [completions, score, points]}
+        if previous_at is not None:
+            old = deltas.setdefault(truncate(previous_at, period), [0, 0, 0])
+            old[0] -= 1
+            old[1] -= previous_score
+        for bucket, (count, score_sum, points_sum) in deltas.items():
+            if count or score_sum or points_sum:
+                _upsert({
+                    'period': period, 'school': school or '', 'bucket': bucket, 'kind': kind,
+                    'category': category or '', 'item_id': item_id,
+                    'completions': count, 'score_sum': score_sum, 'points': points_sum
+                })
+
+
+def rebuild_rollups(since=None, chunk_size=10000):
+    """Recompute rollups from raw and archived rows, for buckets from ``since`` on (default: all); returns rows written.
+
+    Completions recorded while this runs may be counted twice or not at all,
+    so run it when the site is quiet.
+    """
+    totals = {}
+
+    def add(kind, school, category, item_id, at, completions=0, score=0, points=0):
+        for period in PERIODS:
+            key = (period, school or '', truncate(at, period), kind, category or '', item_id)
+            row = totals.setdefault(key, [0, 0, 0])
+            row[0] += completions
+            row[1] += score
+            row[2] += points
+
+    start = truncate(since, 'day') if since else None
+
+    lessons = db.session.query(UserProgress.completed_at, UserProgress.score, UserProgress.lesson_id,
+                               Lesson.category, User.school) \
+        .join(Lesson, Lesson.id == UserProgress.lesson_id).join(User, User.id == UserProgress.user_id) \
+        .filter(UserProgress.completed == True, UserProgress.completed_at.isnot(None))
+    challenges = db.session.query(UserChallenge.completed_at, UserChallenge.challenge_id, Challenge.category,
+                                  User.school) \
+        .join(Challenge, Challenge.id == UserChallenge.challenge_id).join(User, User.id == UserChallenge.user_id) \
+        .filter(UserChallenge.status == 'completed', UserChallenge.completed_at.isnot(None))
+    awards = db.session.query(PointsEvent.created_at, PointsEvent.amount, PointsEvent.reason, PointsEvent.source_id,
+                              db.func.coalesce(Lesson.category, Challenge.category), User.school) \
+        .outerjoin(Lesson, db.and_(PointsEvent.reason == 'lesson', Lesson.id == PointsEvent.source_id)) \
+        .outerjoin(Challenge, db.and_(PointsEvent.reason == 'challenge', Challenge.id == PointsEvent.source_id)) \
+        .join(User, User.id == PointsEvent.user_id) \
+        .filter(PointsEvent.reason.in_(KINDS), PointsEvent.amount != 0)
+    if start:
+        lessons = lessons.filter(UserProgress.completed_at >= start)
+        challenges = challenges.filter(UserChallenge.completed_at >= start)
+        awards = awards.filter(PointsEvent.created_at >= start)
+
+    for at, score, lesson_id, category, school in lessons.yield_per(chunk_size):
+        add('lesson', school, category, lesson_id, at, completions=1, score=score or 0)
+    categories = {('lesson', item_id): category for item_id, category in db.session.query(Lesson.id, Lesson.category)}
+    categories.update((('challenge', item_id), category)
+                      for item_id, category in db.session.query(Challenge.id, Challenge.category))
+    for kind, school, item_id, at, score in archive.iter_records(start):
+        if (kind, item_id) in categories:
+            add(kind, school, categories[(kind, item_id)], item_id, at, completions=1, score=score)
+    for at, challenge_id, category, school in challenges.yield_per(chunk_size):
+        add('challenge', school, category, challenge_id, at, completions=1)
+    for at, amount, reason, source_id, category, school in awards.yield_per(chunk_size):
+        add(reason, school, category, source_id, at, points=amount)
+
+    stale = ActivityRollup.query
+    if start:
+        stale = stale.filter(ActivityRollup.bucket >= start)
+    stale.delete(synchronize_session=False)
+    rows = [dict(zip(_KEY, key), completions=c, score_sum=s, points=p) for key, (c, s, p) in totals.items()]
+    for offset in range(0, len(rows), chunk_size):
+        db.session.execute(db.insert(ActivityRollup), rows[offset:offset + chunk_size])
+    db.session.commit()
+    return len(rows)
+
+
+def series(period, start, end, school, kind=None, category=None, group_by='category'):
+    """Totals per bucket in [start, end) for one school, split by ``group_by``."""
+    if period not in PERIODS:
+        raise ValueError(f"period must be one of {', '.join(PERIODS)}")
+    if group_by not in GROUPS:
+        raise ValueError(f"group_by must be one of {', '.join(GROUPS)}")
+    if end <= start:
+        raise ValueError("end must be after start")
+    if end - start > MAX_RANGE[period]:
+        raise ValueError(f"range too long for period '{period}' (max {MAX_RANGE[period].days} days)")
+
+    group = {'category': ActivityRollup.category, 'item': ActivityRollup.item_id, 'kind': ActivityRollup.kind}[group_by]
+    # Only lessons have scores, so average over lesson completions
+    scored = db.func.sum(db.case((ActivityRollup.kind == 'lesson', ActivityRollup.completions), else_=0))
+    query = db.session.query(
+        ActivityRollup.bucket, group.label('group'),
+        db.func.sum(ActivityRollup.completions), scored, db.func.sum(ActivityRollup.score_sum),
+        db.func.sum(ActivityRollup.points)
+    ).filter(
+        ActivityRollup.period == period,
+        ActivityRollup.school == (school or ''),
+        ActivityRollup.bucket >= truncate(start, period),
+        ActivityRollup.bucket < end
+    )
+    if kind:
+        query = query.filter(ActivityRollup.kind == kind)
+    if category:
+        query = query.filter(ActivityRollup.category == category)
+    rows = query.group_by(ActivityRollup.bucket, group).order_by(ActivityRollup.bucket, group).all()
+
+    return [{
+        'bucket': bucket.isoformat(),
+        group_by: value,
+        'completions': completions,
+        'average_score': round(score_sum / scored, 2) if scored else None,
+        'points': points
+    } for bucket, value, completions, scored, score_sum, points in rows]
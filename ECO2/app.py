@@ -1,112 +1,702 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, session, flash
-from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from flask import Flask, Blueprint, current_app, render_template, request, jsonify, redirect, url_for, session, flash, abort
+from markupsafe import Markup
+from sqlalchemy import event, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session, object_session
+from datetime import datetime, timedelta
 import json
-import os
+import sqlite3
+import threading
+import click
 from config import Config
+from models import db, ArchivedHistory, Job, User, Lesson, Quiz, Challenge, UserProgress, UserChallenge, Badge, \
+    UserBadge, UserStats, UserRecommendation, CacheVersion, PointsEvent
+from leaderboard import Leaderboard
+from grading import AnswerKeyCache, grade, parse_answers
+from content_cache import ContentCache, SharedVersion
+from notifications import ProgressNotifier
+from points import award_points, rebuild_points, lesson_key, challenge_key
+from pagination import ApiError, compact_json, decode_cursor, encode_cursor, keyset_page, parse_fields, parse_limit, \
+    serialize
+import analytics
+import archive
+import recommendations
+import sync
+from search import KINDS as SEARCH_KINDS, SearchIndex, strip_html
+import jobs
+from jobs import enqueue, task
+import db_routing
+from db_routing import primary, read_only
+import sessions
+from sessions import UserSnapshot, forget_user, forget_all_users, revoke_user, snapshot_generation
+from http_cache import response_cache, cache_key
+import http_cache
+from credentials import PasswordHasher, RateLimiter
+from roster import import_roster, read_rows, detect_format, text_stream, synthetic_rows
+from badges import BadgeEngine, UserFacts, LESSON_COMPLETED, CHALLENGE_COMPLETED
+from database.migrations import check_query_plans
+import instrumentation
+from database.init_db import init_db, init_sample_data
+
+main = Blueprint('main', __name__, cli_group=None)
+
+ranking = Leaderboard()
+answer_keys = AnswerKeyCache()
+lesson_content = ContentCache()
+# Bumped in the database whenever a lesson or quiz changes
+content_version = SharedVersion()
+search_index = SearchIndex()
+catalog_totals = {}
+# challenge id -> card fields for active challenges
+challenge_cards = {}
+progress_events = ProgressNotifier()
+badge_engine = BadgeEngine()
+password_hasher = PasswordHasher()
+login_limiter = RateLimiter()
+client_limiter = RateLimiter()
+
+def points_changed(user_id):
+    """After committing points: reload the user's snapshot, and show the points in this process's ranks now."""
+    forget_user(user_id)
+    ranking.catch_up_soon()
+
+# Ledger ids below the newest one checked for not being committed yet when the leaderboard loads
+LEADERBOARD_GAP_WINDOW = 1000
+
+def get_leaderboard():
+    # Load rankings from the primary, then catch up with students and points committed by any process
+    if ranking.is_stale():
+        load_leaderboard()
+    elif not ranking.needs_catch_up():
+        return ranking
+
+    # Catching up only adds what has committed, so a read-only view can read it from its replica.
+    # Events first: the students they belong to are then visible to the second query
+    events = db.session.query(PointsEvent.id, PointsEvent.user_id, PointsEvent.amount) \
+        .filter(PointsEvent.id > ranking.catch_up_after()).order_by(PointsEvent.id).all()
+    students = db.session.query(User.id, User.username, User.school) \
+        .filter(User.user_type == 'student', User.id > ranking.last_user_id).all()
+    ranking.catch_up(students, events)
+    return ranking
+
+@primary()
+def load_leaderboard():
+    last_event_id = db.session.query(db.func.max(PointsEvent.id)).scalar() or 0
+    present = {event_id for (event_id,) in db.session.query(PointsEvent.id).filter(
+        PointsEvent.id > last_event_id - LEADERBOARD_GAP_WINDOW)}
+    gaps = [event_id for event_id in range(max(last_event_id - LEADERBOARD_GAP_WINDOW, 0) + 1, last_event_id + 1)
+            if event_id not in present]
+    # Points from events after last_event_id or in a gap are left to the catch-up. One statement,
+    # so an event committing meanwhile is either in both totals or in neither
+    pending = db.session.query(PointsEvent.user_id, db.func.sum(PointsEvent.amount).label('amount')) \
+        .filter(db.or_(PointsEvent.id > last_event_id, PointsEvent.id.in_(gaps))) \
+        .group_by(PointsEvent.user_id).subquery()
+    rows = db.session.query(User.id, User.username, User.school,
+                            db.func.coalesce(User.points, 0) - db.func.coalesce(pending.c.amount, 0)) \
+        .outerjoin(pending, pending.c.user_id == User.id).filter(User.user_type == 'student').all()
+    ranking.load(rows, last_event_id, gaps)
+
+def load_search_documents(lesson_ids=None, challenge_ids=None):
+    """(kind, id, document) for lessons and active challenges, all of them by default.
+
+    Requested ids that no longer exist, or are inactive challenges, come back
+    with a document of None so they are dropped from the index.
+    """
+    documents = []
+    if lesson_ids is None or lesson_ids:
+        lessons = db.session.query(Lesson.id, Lesson.title, Lesson.description, Lesson.content, Lesson.category,
+                                   Lesson.difficulty)
+        quizzes = db.session.query(Quiz.lesson_id, Quiz.question, Quiz.explanation)
+        if lesson_ids is not None:
+            lessons = lessons.filter(Lesson.id.in_(lesson_ids))
+            quizzes = quizzes.filter(Quiz.lesson_id.in_(lesson_ids))
+        questions = {}
+        for lesson_id, question, explanation in quizzes:
+            questions.setdefault(lesson_id, []).extend(text for text in (question, explanation) if text)
+        found = set()
+        for lesson in lessons:
+            found.add(lesson.id)
+            documents.append(('lesson', lesson.id, {
+                'title': lesson.title, 'category': lesson.category, 'difficulty': lesson.difficulty,
+                'description': lesson.description, 'body': strip_html(lesson.content),
+                'questions': ' '.join(questions.get(lesson.id, ()))
+            }))
+        documents += [('lesson', lesson_id, None) for lesson_id in set(lesson_ids or ()) - found]
+
+    if challenge_ids is None or challenge_ids:
+        challenges = db.session.query(Challenge.id, Challenge.title, Challenge.description, Challenge.category) \
+            .filter(Challenge.is_active == True)
+        if challenge_ids is not None:
+            challenges = challenges.filter(Challenge.id.in_(challenge_ids))
+        found = set()
+        for challenge in challenges:
+            found.add(challenge.id)
+            documents.append(('challenge', challenge.id, {
+                'title': challenge.title, 'category': challenge.category, 'difficulty': None,
+                'description': challenge.description
+            }))
+        documents += [('challenge', challenge_id, None) for challenge_id in set(challenge_ids or ()) - found]
+    return documents
+
+@primary()
+def get_search_index():
+    # Build the index once, then reindex only what committed transactions changed
+    dirty = search_index.take_dirty()
+    if search_index.is_stale():
+        search_index.load(load_search_documents())
+    elif dirty:
+        for kind, item_id, document in load_search_documents([i for k, i in dirty if k == 'lesson'],
+                                                             [i for k, i in dirty if k == 'challenge']):
+            search_index.update(kind, item_id, document)
+    return search_index
+
+def current_user():
+    """The logged-in user's snapshot, loaded from the database once per session."""
+    user_id = session.get('user_id')
+    if user_id is None:
+        return None
+    snapshot = session.user_snapshot
+    if snapshot is None or snapshot.id != user_id:
+        # Read first: if the user changes while this loads, the session does not keep the stale copy
+        generation = snapshot_generation(user_id)
+        # Snapshots outlive the request, so they are loaded from the primary
+        with primary():
+            row = db.session.query(User.id, User.username, User.user_type, User.school, User.points,
+                                   UserRecommendation.items.label('recommended')) \
+                .outerjoin(UserRecommendation, UserRecommendation.user_id == User.id).filter(User.id == user_id).first()
+        if row is None:
+            return None
+        snapshot = UserSnapshot(**row._asdict())
+        session.user_snapshot = snapshot
+        session.snapshot_generation = generation
+    return snapshot
+
+def get_user_stats(user_id, commit=False):
+    """Return the user's counter row, building it from history if it is missing."""
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        stats = rebuild_user_stats(user_id)
+        if commit:
+            db.session.commit()
+    return stats
+
+@primary()
+def rebuild_user_stats(user_id):
+    # Counters are stored, so they are built from the primary's history
+    lessons = db.session.query(
+        db.func.count(UserProgress.id),
+        db.func.coalesce(db.func.sum(UserProgress.score), 0)
+    ).filter_by(user_id=user_id, completed=True).one()
+    challenges = UserChallenge.query.filter_by(user_id=user_id, status='completed').count()
+
+    stats = db.session.get(UserStats, user_id)
+    if stats is None:
+        stats = UserStats(user_id=user_id)
+        db.session.add(stats)
+    archived = archive.archived_totals([user_id]).get(user_id, {})
+    stats.completed_lessons = lessons[0] + archived.get('lesson', (0, 0))[0]
+    stats.score_sum = lessons[1] + archived.get('lesson', (0, 0))[1]
+    stats.completed_challenges = challenges + archived.get('challenge', (0, 0))[0]
+    db.session.flush()
+    return stats
+
+@primary()
+def ensure_user_stats(user_ids, chunk_size=500):
+    """Build missing counter rows for these users with grouped queries; the caller commits.
+
+    Archiving moves history the counters are built from, so it builds any missing counters first.
+    """
+    user_ids = list(user_ids)
+    for start in range(0, len(user_ids), chunk_size):
+        chunk = user_ids[start:start + chunk_size]
+        existing = {user_id for (user_id,) in db.session.query(UserStats.user_id).filter(UserStats.user_id.in_(chunk))}
+        missing = [user_id for user_id in chunk if user_id not in existing]
+        if not missing:
+            continue
+        lessons = {user_id: (count, score_sum) for user_id, count, score_sum in db.session.query(
+            UserProgress.user_id, db.func.count(UserProgress.id), db.func.coalesce(db.func.sum(UserProgress.score), 0)
+        ).filter(UserProgress.user_id.in_(missing), UserProgress.completed == True).group_by(UserProgress.user_id)}
+        challenges = dict(db.session.query(UserChallenge.user_id, db.func.count(UserChallenge.id))
+                          .filter(UserChallenge.user_id.in_(missing), UserChallenge.status == 'completed')
+                          .group_by(UserChallenge.user_id))
+        archived = archive.archived_totals(missing)
+        for user_id in missing:
+            done, score_sum = lessons.get(user_id, (0, 0))
+            stored = archived.get(user_id, {})
+            db.session.add(UserStats(user_id=user_id,
+                                     completed_lessons=done + stored.get('lesson', (0, 0))[0],
+                                     score_sum=score_sum + stored.get('lesson', (0, 0))[1],
+                                     completed_challenges=challenges.get(user_id, 0) + stored.get('challenge', (0, 0))[0]))
+        db.session.flush()
+
+def bump_user_stats(user_id, **deltas):
+    # Atomic SQL increments, committed with the change that caused them
+    get_user_stats(user_id)
+    UserStats.query.filter_by(user_id=user_id).update(
+        {getattr(UserStats, name): getattr(UserStats, name) + delta for name, delta in deltas.items()})
+
+@primary()
+def get_challenge_cards():
+    if not challenge_cards:
+        rows = db.session.query(Challenge.id, Challenge.title, Challenge.description, Challenge.category,
+                                Challenge.points_reward).filter_by(is_active=True)
+        challenge_cards.update((row.id, row._asdict()) for row in rows)
+    return challenge_cards
+
+def recommended_items(user):
+    """The user's precomputed lessons and challenges, from their session snapshot and cached content."""
+    lessons, challenges = [], []
+    for kind, item_id in recommendations.parse_items(user.recommended):
+        if kind == 'lesson':
+            entry = get_lesson_content(item_id)
+            if entry is not None:
+                lessons.append(entry['lesson'])
+        elif item_id in get_challenge_cards():
+            challenges.append(challenge_cards[item_id])
+    return lessons, challenges
+
+@primary()
+def get_catalog_totals():
+    if not catalog_totals:
+        catalog_totals['lessons'] = Lesson.query.count()
+        catalog_totals['challenges'] = Challenge.query.filter_by(is_active=True).count()
+    return catalog_totals
+
+@primary()
+def read_content_version():
+    return db.session.query(CacheVersion.version).filter_by(name='content').scalar() or 0
+
+def current_content_version():
+    return content_version.get(read_content_version)
+
+def get_lesson_content(lesson_id):
+    return lesson_content.get(lesson_id, load_lesson_content, current_content_version())
+
+@primary()
+def load_answer_key(lesson_id):
+    # One query for the lesson's reward and every correct answer
+    rows = db.session.query(Lesson.points_reward, Quiz.id, Quiz.correct_answer) \
+        .outerjoin(Quiz, Quiz.lesson_id == Lesson.id) \
+        .filter(Lesson.id == lesson_id).all()
+    if not rows:
+        return None
+    return rows[0].points_reward, {row.id: row.correct_answer for row in rows if row.id is not None}
+
+def record_quiz_result(user, lesson_id, answers, progress=None, at=None):
+    """Grade answers and update progress and points; ``at`` defaults to now. The caller commits."""
+    key = answer_keys.get(lesson_id, load_answer_key, current_content_version())
+    if key is None:
+        return None
+    points_reward, correct_answers = key
+    score, total = grade(correct_answers, answers)
 
-app = Flask(__name__)
-app.config.from_object(Config)
-db = SQLAlchemy(app)
-
-# Database Models
-class User(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    username = db.Column(db.String(80), unique=True, nullable=False)
-    email = db.Column(db.String(120), unique=True, nullable=False)
-    password = db.Column(db.String(120), nullable=False)
-    user_type = db.Column(db.String(20), nullable=False)  # 'student' or 'teacher'
-    school = db.Column(db.String(120))
-    points = db.Column(db.Integer, default=0)
-    created_at = db.Column(db.DateTime, default=datetime.utcnow)
-
-    # Relationships
-    progress = db.relationship('UserProgress', backref='user', lazy=True)
-    challenges = db.relationship('UserChallenge', backref='user', lazy=True)
-    badges = db.relationship('UserBadge', backref='user', lazy=True)
-
-class Lesson(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
-    content = db.Column(db.Text)
-    category = db.Column(db.String(50))  # climate, waste, biodiversity, etc.
-    difficulty = db.Column(db.String(20))  # beginner, intermediate, advanced
-    points_reward = db.Column(db.Integer, default=10)
-
-    # Relationships
-    quizzes = db.relationship('Quiz', backref='lesson', lazy=True)
-
-class Quiz(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
-    question = db.Column(db.Text, nullable=False)
-    options = db.Column(db.Text)  # JSON string of options
-    correct_answer = db.Column(db.Integer, nullable=False)  # index of correct option
-    explanation = db.Column(db.Text)
-
-class Challenge(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    title = db.Column(db.String(200), nullable=False)
-    description = db.Column(db.Text)
-    category = db.Column(db.String(50))
-    points_reward = db.Column(db.Integer, default=50)
-    duration_days = db.Column(db.Integer, default=7)
-    is_active = db.Column(db.Boolean, default=True)
-
-class UserProgress(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
-    completed = db.Column(db.Boolean, default=False)
-    score = db.Column(db.Integer, default=0)
-    completed_at = db.Column(db.DateTime)
-
-class UserChallenge(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    challenge_id = db.Column(db.Integer, db.ForeignKey('challenge.id'), nullable=False)
-    status = db.Column(db.String(20), default='in_progress')  # in_progress, completed, failed
-    started_at = db.Column(db.DateTime, default=datetime.utcnow)
-    completed_at = db.Column(db.DateTime)
-
-class Badge(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    name = db.Column(db.String(100), nullable=False)
-    description = db.Column(db.Text)
-    image_url = db.Column(db.String(200))
-    criteria = db.Column(db.String(100))  # points_threshold, challenges_completed, etc.
-
-class UserBadge(db.Model):
-    id = db.Column(db.Integer, primary_key=True)
-    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
-    badge_id = db.Column(db.Integer, db.ForeignKey('badge.id'), nullable=False)
-    earned_at = db.Column(db.DateTime, default=datetime.utcnow)
+    # Update user progress
+    if not progress:
+        progress = UserProgress(user_id=user.id, lesson_id=lesson_id)
+        db.session.add(progress)
+
+    # A retake moves the earlier completion, and its score, to the new time bucket
+    previous_at, previous_score = (progress.completed_at, progress.score or 0) if progress.completed else (None, 0)
+    if progress.completed:
+        bump_user_stats(user.id, score_sum=score - (progress.score or 0))
+    else:
+        bump_user_stats(user.id, completed_lessons=1, score_sum=score)
+
+    progress.completed = True
+    progress.score = score
+    progress.completed_at = at or datetime.utcnow()
+
+    # Award points once per lesson, however often the quiz is retaken
+    points_earned = award_points(user, points_reward, lesson_key(user.id, lesson_id), 'lesson', lesson_id,
+                                 at=progress.completed_at)
+
+    category = get_lesson_content(lesson_id)['lesson']['category']
+    analytics.record('lesson', user.school, category, lesson_id, progress.completed_at, completions=1, score=score,
+                     points=points_earned, previous_at=previous_at, previous_score=previous_score)
+    enqueue_badge_check(user.id, LESSON_COMPLETED, category)
+    enqueue_recommendations_refresh(user)
+
+    return {
+        'lesson_id': lesson_id,
+        'score': score,
+        'total': total,
+        'points_earned': points_earned,
+        'progress': progress
+    }
+
+def get_badge_engine():
+    if not badge_engine.is_loaded():
+        badge_engine.load(db.session.query(Badge.id, Badge.name, Badge.criteria).all())
+    return badge_engine
+
+def category_progress(user_id, category):
+    completed = db.session.query(db.func.count(UserProgress.id)) \
+        .join(Lesson, Lesson.id == UserProgress.lesson_id) \
+        .filter(UserProgress.user_id == user_id, UserProgress.completed == True, Lesson.category == category) \
+        .scalar()
+    archived = archive.archived_items(user_id)['lesson']
+    if archived:
+        completed += Lesson.query.filter(Lesson.category == category, Lesson.id.in_(archived)).count()
+    return completed, Lesson.query.filter_by(category=category).count()
+
+def award_badges(user_id, event):
+    """Evaluate only the badge rules affected by ``event`` and add any newly earned badges."""
+    engine = get_badge_engine()
+    if not engine.has_rules(event['type']):
+        return []
+
+    earned = {row.badge_id for row in db.session.query(UserBadge.badge_id).filter_by(user_id=user_id)}
+    facts = UserFacts(
+        points=lambda: db.session.query(User.points).filter_by(id=user_id).scalar(),
+        completed_challenges=lambda: get_user_stats(user_id).completed_challenges,
+        completed_lessons=lambda: get_user_stats(user_id).completed_lessons,
+        category_progress=lambda category: category_progress(user_id, category)
+    )
+
+    new_badge_ids = engine.evaluate_event(event, facts, earned)
+    for badge_id in new_badge_ids:
+        db.session.add(UserBadge(user_id=user_id, badge_id=badge_id))
+
+    return [engine.names[badge_id] for badge_id in new_badge_ids]
+
+def enqueue_badge_check(user_id, event_type, category):
+    """Queue badge evaluation in the caller's transaction; repeats before it runs are merged."""
+    enqueue('award_badges', dedupe_key=f'badges:{user_id}:{event_type}:{category}',
+            user_id=user_id, event={'type': event_type, 'category': category})
+
+@task('award_badges')
+def award_badges_task(user_id, event):
+    award_badges(user_id, event)
+
+def enqueue_recommendations_refresh(user):
+    """Queue rescoring a student's recommendations in the caller's transaction."""
+    if user.user_type == 'student':
+        enqueue('refresh_recommendations', dedupe_key=f'recommendations:{user.id}', user_id=user.id)
+
+@task('refresh_recommendations')
+def refresh_recommendations_task(user_id):
+    recommendations.refresh_user(user_id)
+    db.session.commit()
+    # Sessions reload the snapshot, and with it the new list, once it is committed
+    forget_user(user_id)
+
+@task('build_recommendations')
+def build_recommendations_task():
+    recommendations.build_recommendations()
+    forget_all_users()
+
+def backfill_badges(chunk_size=500):
+    """Evaluate every badge rule for all users, one chunk of users at a time."""
+    engine = get_badge_engine()
+    category_totals = dict(db.session.query(Lesson.category, db.func.count(Lesson.id)).group_by(Lesson.category).all())
+    lesson_categories = dict(db.session.query(Lesson.id, Lesson.category))
+    awarded = 0
+    last_id = 0
+
+    while True:
+        users = db.session.query(User.id, User.points).filter(User.id > last_id).order_by(User.id).limit(chunk_size).all()
+        if not users:
+            break
+        user_ids = [u.id for u in users]
+        last_id = user_ids[-1]
+
+        # Grouped counts for the whole chunk instead of queries per user
+        challenges = dict(db.session.query(UserChallenge.user_id, db.func.count(UserChallenge.id))
+                          .filter(UserChallenge.user_id.in_(user_ids), UserChallenge.status == 'completed')
+                          .group_by(UserChallenge.user_id).all())
+        lessons = {}
+        by_category = {}
+        for user_id, category, count in db.session.query(UserProgress.user_id, Lesson.category, db.func.count(UserProgress.id)) \
+                .join(Lesson, Lesson.id == UserProgress.lesson_id) \
+                .filter(UserProgress.user_id.in_(user_ids), UserProgress.completed == True) \
+                .group_by(UserProgress.user_id, Lesson.category).all():
+            lessons[user_id] = lessons.get(user_id, 0) + count
+            by_category[(user_id, category)] = count
+        for user_id, kind, item_ids in db.session.query(ArchivedHistory.user_id, ArchivedHistory.kind,
+                                                         ArchivedHistory.item_ids) \
+                .filter(ArchivedHistory.user_id.in_(user_ids)):
+            item_ids = [int(item_id) for item_id in item_ids.split(',') if item_id]
+            if kind == 'challenge':
+                challenges[user_id] = challenges.get(user_id, 0) + len(item_ids)
+                continue
+            for lesson_id in item_ids:
+                if lesson_id in lesson_categories:
+                    category = lesson_categories[lesson_id]
+                    lessons[user_id] = lessons.get(user_id, 0) + 1
+                    by_category[(user_id, category)] = by_category.get((user_id, category), 0) + 1
+        earned = {}
+        for user_id, badge_id in db.session.query(UserBadge.user_id, UserBadge.badge_id).filter(UserBadge.user_id.in_(user_ids)):
+            earned.setdefault(user_id, set()).add(badge_id)
+
+        rows = []
+        for u in users:
+            facts = UserFacts(
+                points=lambda u=u: u.points or 0,
+                completed_challenges=lambda u=u: challenges.get(u.id, 0),
+                completed_lessons=lambda u=u: lessons.get(u.id, 0),
+                category_progress=lambda category, u=u: (by_category.get((u.id, category), 0), category_totals.get(category, 0))
+            )
+            for badge_id in engine.evaluate_all(facts, earned.get(u.id, set())):
+                rows.append({'user_id': u.id, 'badge_id': badge_id, 'earned_at': datetime.utcnow()})
+
+        if rows:
+            db.session.bulk_insert_mappings(UserBadge, rows)
+        db.session.commit()
+        awarded += len(rows)
+
+    return awarded
+
+@primary()
+def load_lesson_content(lesson_id):
+    lesson = Lesson.query.get(lesson_id)
+    if lesson is None:
+        return None
+
+    lesson_data = {
+        'id': lesson.id,
+        'title': lesson.title,
+        'description': lesson.description,
+        'content': lesson.content,
+        'category': lesson.category,
+        'difficulty': lesson.difficulty,
+        'points_reward': lesson.points_reward
+    }
+    # Decode quiz options once here rather than on every render
+    questions = [{
+        'id': quiz.id,
+        'question': quiz.question,
+        'options': json.loads(quiz.options) if quiz.options else [],
+        'correct_answer': quiz.correct_answer,
+        'explanation': quiz.explanation
+    } for quiz in Quiz.query.filter_by(lesson_id=lesson_id).order_by(Quiz.id).all()]
+
+    return lesson_data, questions
+
+def note_content_change(connection, target, lesson_id):
+    # Bump the shared version in the same transaction, once per transaction;
+    # this process drops its own copies when the transaction commits
+    session = object_session(target)
+    dirty = session.info.setdefault('content_dirty', set()) if session is not None else None
+    if not dirty:
+        table = CacheVersion.__table__
+        bumped = connection.execute(table.update().where(table.c.name == 'content')
+                                    .values(version=table.c.version + 1)).rowcount
+        if not bumped:
+            connection.execute(table.insert().values(name='content', version=1))
+    if dirty is not None:
+        dirty.add(lesson_id)
+
+@event.listens_for(Lesson, 'after_insert')
+@event.listens_for(Lesson, 'after_update')
+@event.listens_for(Lesson, 'after_delete')
+def invalidate_lesson_caches(mapper, connection, target):
+    note_content_change(connection, target, target.id)
+
+@event.listens_for(Quiz, 'after_insert')
+@event.listens_for(Quiz, 'after_update')
+@event.listens_for(Quiz, 'after_delete')
+def invalidate_quiz_caches(mapper, connection, target):
+    note_content_change(connection, target, target.lesson_id)
+
+@event.listens_for(Badge, 'after_insert')
+@event.listens_for(Badge, 'after_update')
+@event.listens_for(Badge, 'after_delete')
+def invalidate_badge_rules(mapper, connection, target):
+    badge_engine.invalidate()
+
+@event.listens_for(Lesson, 'after_insert')
+@event.listens_for(Lesson, 'after_delete')
+@event.listens_for(Challenge, 'after_insert')
+@event.listens_for(Challenge, 'after_update')
+@event.listens_for(Challenge, 'after_delete')
+def invalidate_catalog_totals(mapper, connection, target):
+    catalog_totals.clear()
+    challenge_cards.clear()
+
+@event.listens_for(Lesson, 'after_insert')
+@event.listens_for(Lesson, 'after_update')
+@event.listens_for(Lesson, 'after_delete')
+@event.listens_for(Quiz, 'after_insert')
+@event.listens_for(Quiz, 'after_update')
+@event.listens_for(Quiz, 'after_delete')
+@event.listens_for(Challenge, 'after_insert')
+@event.listens_for(Challenge, 'after_update')
+@event.listens_for(Challenge, 'after_delete')
+def queue_search_reindex(mapper, connection, target):
+    # Held until the transaction commits, so rolled back edits never reach the search index
+    if isinstance(target, Challenge):
+        key = ('challenge', target.id)
+    else:
+        key = ('lesson', target.lesson_id if isinstance(target, Quiz) else target.id)
+    session = object_session(target)
+    if session is not None:
+        session.info.setdefault('search_dirty', set()).add(key)
+
+@event.listens_for(Session, 'after_commit')
+def reindex_committed_content(session):
+    dirty = session.info.pop('search_dirty', None)
+    if dirty:
+        search_index.mark_dirty(dirty)
+
+@event.listens_for(Session, 'after_commit')
+def forget_committed_content(session):
+    dirty = session.info.pop('content_dirty', None)
+    if dirty:
+        for lesson_id in dirty:
+            answer_keys.invalidate(lesson_id)
+            lesson_content.invalidate(lesson_id)
+        content_version.expire()
+
+@event.listens_for(Session, 'after_rollback')
+def discard_uncommitted_content(session):
+    session.info.pop('search_dirty', None)
+    session.info.pop('content_dirty', None)
+
+SEARCH_PAGE_SIZE = 50
+
+ROSTER_SORT_KEYS = ('username', 'points', 'completed_lessons', 'completed_challenges')
+
+def teacher_roster(school, sort='points', order='desc', page=1, per_page=50):
+    """Per-student totals for a school, read from the students' counter rows.
+
+    Totals for the whole school come from window aggregates on the same
+    query as the page, so a page costs one pass over the school's students.
+    """
+    with primary():
+        missing = [user_id for (user_id,) in db.session.query(User.id)
+                   .outerjoin(UserStats, UserStats.user_id == User.id)
+                   .filter(User.user_type == 'student', User.school == school, UserStats.user_id.is_(None))]
+        if missing:
+            # Built once per student; the write path keeps them current after that
+            ensure_user_stats(missing)
+            try:
+                db.session.commit()
+            except IntegrityError:
+                # Another request built them first
+                db.session.rollback()
+
+    completed_lessons = db.func.coalesce(UserStats.completed_lessons, 0)
+    completed_challenges = db.func.coalesce(UserStats.completed_challenges, 0)
+    roster = db.session.query(
+        User.id,
+        User.username,
+        User.points,
+        completed_lessons.label('completed_lessons'),
+        completed_challenges.label('completed_challenges'),
+        db.func.count().over().label('total_students'),
+        db.func.coalesce(db.func.sum(User.points).over(), 0).label('total_points'),
+        db.func.sum(completed_lessons).over().label('total_lessons'),
+        db.func.sum(completed_challenges).over().label('total_challenges')
+    ).outerjoin(UserStats, UserStats.user_id == User.id) \
+     .filter(User.user_type == 'student', User.school == school)
+
+    if sort not in ROSTER_SORT_KEYS:
+        sort = 'points'
+    column = {
+        'username': User.username,
+        'points': User.points,
+        'completed_lessons': completed_lessons,
+        'completed_challenges': completed_challenges
+    }[sort]
+    column = column.asc() if order == 'asc' else column.desc()
+
+    page = max(page, 1)
+    rows = roster.order_by(column, User.id).limit(per_page).offset((page - 1) * per_page).all()
+    if rows:
+        totals = (rows[0].total_students, rows[0].total_points, rows[0].total_lessons, rows[0].total_challenges)
+    else:
+        # Past the last page, or no students: the totals still come from one aggregate
+        totals_sq = roster.subquery()
+        totals = db.session.query(
+            db.func.count(totals_sq.c.id),
+            db.func.coalesce(db.func.sum(totals_sq.c.points), 0),
+            db.func.coalesce(db.func.sum(totals_sq.c.completed_lessons), 0),
+            db.func.coalesce(db.func.sum(totals_sq.c.completed_challenges), 0)
+        ).one()
+    summary = {
+        'total_students': totals[0],
+        'average_points': totals[1] / totals[0] if totals[0] else 0,
+        'completed_lessons': totals[2] or 0,
+        'completed_challenges': totals[3] or 0
+    }
+
+    student_data = [{
+        'id': row.id,
+        'username': row.username,
+        'points': row.points,
+        'completed_lessons': row.completed_lessons,
+        'completed_challenges': row.completed_challenges
+    } for row in rows]
+
+    return summary, student_data
+
+def record_challenge_join(user, challenge_id, at=None):
+    """Add the user to a challenge, started at ``at`` (default now); the caller commits."""
+    user_challenge = UserChallenge(user_id=user.id, challenge_id=challenge_id, started_at=at or datetime.utcnow())
+    db.session.add(user_challenge)
+    enqueue_recommendations_refresh(user)
+    return user_challenge
+
+def record_challenge_completion(user, user_challenge, challenge, at=None):
+    """Mark a joined challenge completed and award its points once; returns the points earned. The caller commits."""
+    previous_at = user_challenge.completed_at if user_challenge.status == 'completed' else None
+    if user_challenge.status != 'completed':
+        bump_user_stats(user.id, completed_challenges=1)
+
+    user_challenge.status = 'completed'
+    user_challenge.completed_at = at or datetime.utcnow()
+
+    # Award points once per challenge
+    points_earned = award_points(user, challenge.points_reward, challenge_key(user.id, challenge.id), 'challenge',
+                                 challenge.id, at=user_challenge.completed_at)
+
+    analytics.record('challenge', user.school, challenge.category, challenge.id, user_challenge.completed_at,
+                     completions=1, points=points_earned, previous_at=previous_at)
+    enqueue_badge_check(user.id, CHALLENGE_COMPLETED, challenge.category)
+    enqueue_recommendations_refresh(user)
+    return points_earned
 
 # Routes
-@app.route('/')
+@main.route('/')
+@read_only
 def index():
-    return render_template('index.html')
+    # Only the navigation bar differs between visitors
+    return response_cache.respond(cache_key(session.get('username')), lambda: render_template('index.html'))
 
-@app.route('/login', methods=['GET', 'POST'])
+@main.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
         username = request.form['username']
         password = request.form['password']
 
-        user = User.query.filter_by(username=username, password=password).first()
-        if user:
+        # Turn away brute-force attempts before spending CPU on hashing
+        retry_after = max(login_limiter.consume(username.lower()), client_limiter.consume(request.remote_addr or ''))
+        if retry_after:
+            flash('Too many login attempts. Please wait a moment and try again.', 'error')
+            return render_template('login.html'), 429, {'Retry-After': str(int(retry_after) + 1)}
+
+        user = User.query.filter_by(username=username).first()
+        if user and password_hasher.verify(user.password, password):
+            if password_hasher.needs_rehash(user.password):
+                # Upgrade legacy plaintext or older-cost hashes while we have the password
+                user.password = password_hasher.hash(password)
+                db.session.commit()
+            # A fresh session id on login, so an id issued before login cannot be reused
+            session.rotate()
             session['user_id'] = user.id
             session['username'] = user.username
             session['user_type'] = user.user_type
+            recommended = db.session.query(UserRecommendation.items).filter_by(user_id=user.id).scalar()
+            session.user_snapshot = UserSnapshot(id=user.id, username=user.username, user_type=user.user_type,
+                                                 school=user.school, points=user.points, recommended=recommended)
             flash('Login successful!', 'success')
-            return redirect(url_for('index'))
+            return redirect(url_for('main.index'))
         else:
             flash('Invalid credentials. Please try again.', 'error')
 
     return render_template('login.html')
 
-@app.route('/register', methods=['GET', 'POST'])
+@main.route('/register', methods=['GET', 'POST'])
 def register():
     if request.method == 'POST':
         username = request.form['username']
@@ -115,12 +705,13 @@ def register():
         user_type = request.form['user_type']
         school = request.form.get('school', '')
 
-        # Check if user already exists
-        if User.query.filter_by(username=username).first():
+        # Check if user already exists, with one lookup for both fields
+        existing = User.query.filter(db.or_(User.username == username, User.email == email)).first()
+        if existing and existing.username == username:
             flash('Username already exists. Please choose another.', 'error')
             return render_template('register.html')
 
-        if User.query.filter_by(email=email).first():
+        if existing:
             flash('Email already registered. Please use another email.', 'error')
             return render_template('register.html')
 
@@ -128,118 +719,257 @@ def register():
         new_user = User(
             username=username,
             email=email,
-            password=password,
+            password=password_hasher.hash(password),
             user_type=user_type,
             school=school
         )
 
         db.session.add(new_user)
+        db.session.flush()
+        # Nothing completed yet; creating the counters now keeps progress reads to a primary-key lookup
+        db.session.add(UserStats(user_id=new_user.id))
         db.session.commit()
 
         flash('Registration successful! Please login.', 'success')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     return render_template('register.html')
 
-@app.route('/logout')
+@main.route('/logout')
 def logout():
     session.clear()
     flash('You have been logged out.', 'info')
-    return redirect(url_for('index'))
+    return redirect(url_for('main.index'))
 
-@app.route('/lessons')
+@main.route('/lessons')
+@read_only
 def lessons():
     if 'user_id' not in session:
         flash('Please login to access lessons.', 'warning')
-        return redirect(url_for('login'))
-
-    lessons = Lesson.query.all()
-    user_progress = {}
-    if 'user_id' in session:
-        progress = UserProgress.query.filter_by(user_id=session['user_id']).all()
-        user_progress = {p.lesson_id: p.completed for p in progress}
-
-    return render_template('lessons.html', lessons=lessons, user_progress=user_progress)
-
-@app.route('/lesson/<int:lesson_id>')
+        return redirect(url_for('main.login'))
+
+    progress = db.session.query(UserProgress.lesson_id, UserProgress.completed).filter_by(
+        user_id=session['user_id']).all()
+    user_progress = {lesson_id: completed for lesson_id, completed in progress}
+    user_progress.update(dict.fromkeys(archive.archived_items(session['user_id'])['lesson'], True))
+    completed = sorted(lesson_id for lesson_id, done in user_progress.items() if done)
+
+    recommended = [item_id for kind, item_id in recommendations.parse_items(current_user().recommended)
+                   if kind == 'lesson' and not user_progress.get(item_id)]
+
+    def render():
+        lessons = Lesson.query.all()
+        by_id = {lesson.id: lesson for lesson in lessons}
+        return render_template('lessons.html', lessons=lessons, user_progress=user_progress,
+                               recommended=[by_id[item_id] for item_id in recommended if item_id in by_id])
+
+    # The catalog is shared; the page only varies by which lessons the user completed and is recommended
+    key = cache_key(current_content_version(), session.get('username'), ','.join(map(str, completed)),
+                    ','.join(map(str, recommended)))
+    return response_cache.respond(key, render)
+
+@main.route('/lesson/<int:lesson_id>')
+@read_only
 def lesson_detail(lesson_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
+
+    entry = get_lesson_content(lesson_id)
+    if entry is None:
+        abort(404)
 
-    lesson = Lesson.query.get_or_404(lesson_id)
-    return render_template('lesson_detail.html', lesson=lesson)
+    body = lesson_content.fragment(entry, 'lesson_body', lambda e: Markup(
+        render_template('partials/lesson_body.html', lesson=e['lesson'])))
+    return render_template('lesson_detail.html', lesson=entry['lesson'], body=body)
 
-@app.route('/quiz/<int:lesson_id>')
+@main.route('/quiz/<int:lesson_id>')
+@read_only
 def quiz(lesson_id):
     if 'user_id' not in session:
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
-    lesson = Lesson.query.get_or_404(lesson_id)
-    quizzes = Quiz.query.filter_by(lesson_id=lesson_id).all()
+    entry = get_lesson_content(lesson_id)
+    if entry is None:
+        abort(404)
 
-    # Convert options from JSON string to list
-    for quiz in quizzes:
-        quiz.options = json.loads(quiz.options)
+    body = lesson_content.fragment(entry, 'quiz_body', lambda e: Markup(
+        render_template('partials/quiz_body.html', lesson=e['lesson'], quizzes=e['questions'])))
+    return render_template('quiz.html', lesson=entry['lesson'], quizzes=entry['questions'], body=body)
 
-    return render_template('quiz.html', lesson=lesson, quizzes=quizzes)
+def commit_or_retry(apply):
+    """Run ``apply()`` and commit, returning its result.
+
+    A double-submit can insert the same UserProgress row from two requests at
+    once; the loser rolls back and runs ``apply`` again, now as a retake of
+    the winner's row (points are awarded once either way).
+    """
+    try:
+        result = apply()
+        db.session.commit()
+    except IntegrityError:
+        db.session.rollback()
+        result = apply()
+        db.session.commit()
+    return result
 
-@app.route('/submit_quiz/<int:lesson_id>', methods=['POST'])
+@main.route('/submit_quiz/<int:lesson_id>', methods=['POST'])
 def submit_quiz(lesson_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Please login'})
 
     user_id = session['user_id']
-    data = request.json
-    answers = data.get('answers', {})
-
-    # Calculate score
-    score = 0
-    total = len(answers)
+    data = request.get_json(silent=True) or {}
+    try:
+        answers = parse_answers(data.get('answers', {}))
+    except ValueError as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
 
-    for quiz_id, answer in answers.items():
-        quiz = Quiz.query.get(int(quiz_id))
-        if quiz and int(answer) == quiz.correct_answer:
-            score += 1
+    user = current_user()
 
-    # Update user progress
-    progress = UserProgress.query.filter_by(user_id=user_id, lesson_id=lesson_id).first()
-    if not progress:
-        progress = UserProgress(user_id=user_id, lesson_id=lesson_id)
-        db.session.add(progress)
+    def apply():
+        progress = UserProgress.query.filter_by(user_id=user_id, lesson_id=lesson_id).first() \
+            or archive.restore(user_id, 'lesson', lesson_id)
+        return record_quiz_result(user, lesson_id, answers, progress)
 
-    progress.completed = True
-    progress.score = score
-    progress.completed_at = datetime.utcnow()
+    result = commit_or_retry(apply)
+    if result is None:
+        return jsonify({'success': False, 'message': 'Lesson not found'}), 404
 
-    # Award points
-    user = User.query.get(user_id)
-    lesson = Lesson.query.get(lesson_id)
-    user.points += lesson.points_reward
-
-    db.session.commit()
+    if result['points_earned']:
+        points_changed(user_id)
+    progress_events.notify(user_id)
 
     return jsonify({
         'success': True,
-        'score': score,
-        'total': total,
-        'points_earned': lesson.points_reward
+        'score': result['score'],
+        'total': result['total'],
+        'points_earned': result['points_earned']
     })
 
-@app.route('/challenges')
+@main.route('/api/submit_quizzes', methods=['POST'])
+def submit_quizzes():
+    """Grade a batch of quiz submissions, e.g. from a device that was offline."""
+    if 'user_id' not in session:
+        return jsonify({'success': False, 'message': 'Please login'}), 401
+
+    user_id = session['user_id']
+    data = request.get_json(silent=True) or {}
+    submissions = data.get('submissions', [])
+    if not isinstance(submissions, list):
+        return jsonify({'success': False, 'message': 'submissions must be a list'}), 400
+
+    # Malformed submissions get an error result; the rest are still graded
+    parsed = []
+    for submission in submissions:
+        if not isinstance(submission, dict):
+            parsed.append((None, None, 'Each submission must be an object'))
+            continue
+        lesson_id = submission.get('lesson_id')
+        try:
+            if isinstance(lesson_id, bool):
+                raise ValueError
+            lesson_id = int(lesson_id)
+        except (TypeError, ValueError):
+            parsed.append((lesson_id, None, 'lesson_id must be an integer'))
+            continue
+        try:
+            parsed.append((lesson_id, parse_answers(submission.get('answers', {})), None))
+        except ValueError as e:
+            parsed.append((lesson_id, None, str(e)))
+
+    user = current_user()
+    lesson_ids = {lesson_id for lesson_id, _, error in parsed if error is None}
+
+    def apply():
+        progress_rows = UserProgress.query.filter(
+            UserProgress.user_id == user_id,
+            UserProgress.lesson_id.in_(lesson_ids)
+        ).all() if lesson_ids else []
+        progress_by_lesson = {p.lesson_id: p for p in progress_rows}
+        # Retakes of archived lessons continue from the archived record
+        archived = archive.archived_items(user_id)['lesson'] & (lesson_ids - set(progress_by_lesson))
+        for lesson_id in archived:
+            progress_by_lesson[lesson_id] = archive.restore(user_id, 'lesson', lesson_id)
+
+        results = []
+        points_earned = 0
+        for lesson_id, answers, error in parsed:
+            if error is not None:
+                results.append({'lesson_id': lesson_id, 'success': False, 'message': error})
+                continue
+            result = record_quiz_result(user, lesson_id, answers, progress_by_lesson.get(lesson_id))
+            if result is None:
+                results.append({'lesson_id': lesson_id, 'success': False, 'message': 'Lesson not found'})
+                continue
+            progress_by_lesson[lesson_id] = result.pop('progress')
+            points_earned += result['points_earned']
+            results.append(dict(result, success=True))
+        return results, points_earned
+
+    results, points_earned = commit_or_retry(apply)
+
+    if points_earned:
+        points_changed(user_id)
+    progress_events.notify(user_id)
+
+    return jsonify({'success': True, 'results': results, 'points_earned': points_earned})
+
+@main.route('/challenges')
+@read_only
 def challenges():
     if 'user_id' not in session:
         flash('Please login to access challenges.', 'warning')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     challenges = Challenge.query.filter_by(is_active=True).all()
     user_challenges = {}
     if 'user_id' in session:
         user_challenges_data = UserChallenge.query.filter_by(user_id=session['user_id']).all()
         user_challenges = {uc.challenge_id: uc.status for uc in user_challenges_data}
+        user_challenges.update(dict.fromkeys(archive.archived_items(session['user_id'])['challenge'], 'completed'))
 
     return render_template('challenges.html', challenges=challenges, user_challenges=user_challenges)
 
-@app.route('/join_challenge/<int:challenge_id>')
+def search_hits(args):
+    """Run ?q= with the ?kind=, ?category= and ?difficulty= filters; returns (index, hits)."""
+    kind = args.get('kind') or None
+    if kind and kind not in SEARCH_KINDS:
+        raise ApiError(f"kind must be one of {', '.join(SEARCH_KINDS)}")
+    index = get_search_index()
+    return index, index.search(args.get('q', ''), kind=kind, category=args.get('category') or None,
+                               difficulty=args.get('difficulty') or None)
+
+def search_results(index, hits, query):
+    """Describe each hit, skipping items deleted since the search ran."""
+    results = []
+    for score, kind, item_id in hits:
+        result = index.describe(kind, item_id, query)
+        if result is None:
+            continue
+        result.update(kind=kind, id=item_id, score=score, url=url_for(
+            'main.lesson_detail', lesson_id=item_id) if kind == 'lesson' else url_for('main.challenges'))
+        results.append(result)
+    return results
+
+@main.route('/search')
+@read_only
+def search():
+    if 'user_id' not in session:
+        flash('Please login to search.', 'warning')
+        return redirect(url_for('main.login'))
+
+    query = request.args.get('q', '').strip()
+    try:
+        index, hits = search_hits(request.args)
+    except ApiError as e:
+        flash(str(e), 'error')
+        index, hits = get_search_index(), []
+    results = search_results(index, hits[:SEARCH_PAGE_SIZE], query)
+    return render_template('search.html', query=query, results=results, total=len(hits), args=request.args,
+                           kinds=SEARCH_KINDS, categories=index.values('category'),
+                           difficulties=index.values('difficulty'))
+
+@main.route('/join_challenge/<int:challenge_id>')
 def join_challenge(challenge_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Please login'})
@@ -248,17 +978,21 @@ def join_challenge(challenge_id):
 
     # Check if already joined
     existing = UserChallenge.query.filter_by(user_id=user_id, challenge_id=challenge_id).first()
-    if existing:
+    if existing or challenge_id in archive.archived_items(user_id)['challenge']:
         return jsonify({'success': False, 'message': 'Already joined this challenge'})
 
     # Join challenge
-    user_challenge = UserChallenge(user_id=user_id, challenge_id=challenge_id)
-    db.session.add(user_challenge)
-    db.session.commit()
+    record_challenge_join(current_user(), challenge_id)
+    try:
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request joined first
+        db.session.rollback()
+        return jsonify({'success': False, 'message': 'Already joined this challenge'})
 
     return jsonify({'success': True, 'message': 'Challenge joined successfully!'})
 
-@app.route('/complete_challenge/<int:challenge_id>', methods=['POST'])
+@main.route('/complete_challenge/<int:challenge_id>', methods=['POST'])
 def complete_challenge(challenge_id):
     if 'user_id' not in session:
         return jsonify({'success': False, 'message': 'Please login'})
@@ -266,132 +1000,792 @@ def complete_challenge(challenge_id):
     user_id = session['user_id']
 
     # Update challenge status
-    user_challenge = UserChallenge.query.filter_by(user_id=user_id, challenge_id=challenge_id).first()
+    user_challenge = UserChallenge.query.filter_by(user_id=user_id, challenge_id=challenge_id).first() \
+        or archive.restore(user_id, 'challenge', challenge_id)
     if not user_challenge:
         return jsonify({'success': False, 'message': 'Challenge not found'})
 
-    user_challenge.status = 'completed'
-    user_challenge.completed_at = datetime.utcnow()
-
-    # Award points
     challenge = Challenge.query.get(challenge_id)
-    user = User.query.get(user_id)
-    user.points += challenge.points_reward
+    user = current_user()
+    points_earned = record_challenge_completion(user, user_challenge, challenge)
 
     db.session.commit()
 
+    if points_earned:
+        points_changed(user_id)
+    progress_events.notify(user_id)
+
     return jsonify({
         'success': True,
         'message': 'Challenge completed!',
-        'points_earned': challenge.points_reward
+        'points_earned': points_earned
     })
 
-@app.route('/leaderboard')
+@main.route('/leaderboard')
+@read_only
 def leaderboard():
-    # Get top users by points
-    top_users = User.query.filter_by(user_type='student').order_by(User.points.desc()).limit(20).all()
+    board = get_leaderboard()
 
-    # Get school rankings
-    school_rankings = db.session.query(
-        User.school,
-        db.func.sum(User.points).label('total_points')
-    ).filter(User.user_type == 'student', User.school != '').group_by(User.school).order_by(db.desc('total_points')).all()
+    my_rank = None
+    if 'user_id' in session:
+        my_rank = board.rank(session['user_id'])
 
-    return render_template('leaderboard.html', top_users=top_users, school_rankings=school_rankings)
+    key = cache_key(board.loaded_at, board.version, session.get('username'), my_rank)
+    return response_cache.respond(key, lambda: render_template(
+        'leaderboard.html', top_users=board.top_students(20), school_rankings=board.top_schools(), my_rank=my_rank))
 
-@app.route('/rewards')
+@main.route('/rewards')
+@read_only
 def rewards():
     if 'user_id' not in session:
         flash('Please login to view rewards.', 'warning')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     user_id = session['user_id']
     badges = Badge.query.all()
     user_badges = UserBadge.query.filter_by(user_id=user_id).all()
     user_badge_ids = [ub.badge_id for ub in user_badges]
 
-    user = User.query.get(user_id)
+    user = current_user()
 
     return render_template('rewards.html', badges=badges, user_badge_ids=user_badge_ids, user=user)
 
-@app.route('/dashboard')
+@main.route('/dashboard')
+@read_only
 def dashboard():
     if 'user_id' not in session:
         flash('Please login to access dashboard.', 'warning')
-        return redirect(url_for('login'))
+        return redirect(url_for('main.login'))
 
     user_id = session['user_id']
-    user = User.query.get(user_id)
+    user = current_user()
 
     if user.user_type == 'teacher':
         # Teacher dashboard
-        students = User.query.filter_by(user_type='student', school=user.school).all()
-
-        # Get student progress data
-        student_data = []
-        for student in students:
-            completed_lessons = UserProgress.query.filter_by(user_id=student.id, completed=True).count()
-            completed_challenges = UserChallenge.query.filter_by(user_id=student.id, status='completed').count()
-            student_data.append({
-                'student': student,
-                'completed_lessons': completed_lessons,
-                'completed_challenges': completed_challenges,
-                'points': student.points
-            })
-
-        return render_template('dashboard.html', user=user, student_data=student_data, is_teacher=True)
+        sort = request.args.get('sort', 'points')
+        order = request.args.get('order', 'desc')
+        page = request.args.get('page', 1, type=int)
+        per_page = min(request.args.get('per_page', 50, type=int), 200)
+
+        summary, student_data = teacher_roster(user.school, sort, order, page, per_page)
+        pages = max((summary['total_students'] + per_page - 1) // per_page, 1)
+
+        return render_template('dashboard.html',
+                             user=user,
+                             summary=summary,
+                             student_data=student_data,
+                             total_lessons=get_catalog_totals()['lessons'],
+                             sort=sort,
+                             order=order,
+                             page=page,
+                             pages=pages,
+                             per_page=per_page,
+                             is_teacher=True)
     else:
         # Student dashboard
-        completed_lessons = UserProgress.query.filter_by(user_id=user_id, completed=True).count()
-        total_lessons = Lesson.query.count()
-        completed_challenges = UserChallenge.query.filter_by(user_id=user_id, status='completed').count()
-        total_challenges = Challenge.query.filter_by(is_active=True).count()
+        stats = get_user_stats(user_id, commit=True)
+        totals = get_catalog_totals()
+        completed_lessons = stats.completed_lessons
+        total_lessons = totals['lessons']
+        completed_challenges = stats.completed_challenges
+        total_challenges = totals['challenges']
 
         # Recent activity
-        recent_lessons = UserProgress.query.filter_by(user_id=user_id, completed=True).order_by(UserProgress.completed_at.desc()).limit(5).all()
-        recent_challenges = UserChallenge.query.filter_by(user_id=user_id).order_by(UserChallenge.started_at.desc()).limit(5).all()
+        recent_lessons = UserProgress.query.options(db.joinedload(UserProgress.lesson)).filter_by(user_id=user_id, completed=True).order_by(UserProgress.completed_at.desc()).limit(5).all()
+        recent_challenges = UserChallenge.query.options(db.joinedload(UserChallenge.challenge)).filter_by(user_id=user_id).order_by(UserChallenge.started_at.desc()).limit(5).all()
+
+        board = get_leaderboard()
+        recommended_lessons, recommended_challenges = recommended_items(user)
 
         return render_template('dashboard.html',
                              user=user,
+                             school_rank=board.school_rank(user_id),
+                             overall_rank=board.rank(user_id),
                              completed_lessons=completed_lessons,
                              total_lessons=total_lessons,
                              completed_challenges=completed_challenges,
                              total_challenges=total_challenges,
                              recent_lessons=recent_lessons,
                              recent_challenges=recent_challenges,
+                             recommended_lessons=recommended_lessons,
+                             recommended_challenges=recommended_challenges,
                              is_teacher=False)
 
 # API endpoints
-@app.route('/api/user_progress')
+def user_progress_payload(user_id, points):
+    """Progress counters from the user's UserStats row; ``points`` comes from their session snapshot."""
+    stats = get_user_stats(user_id, commit=True)
+    totals = get_catalog_totals()
+
+    return {
+        'completed_lessons': stats.completed_lessons,
+        'total_lessons': totals['lessons'],
+        'average_score': stats.score_sum / stats.completed_lessons if stats.completed_lessons else 0,
+        'completed_challenges': stats.completed_challenges,
+        'total_challenges': totals['challenges'],
+        'points': points,
+        'rank': get_leaderboard().rank(user_id)
+    }
+
+def progress_etag(data):
+    return '{points}-{completed_lessons}-{completed_challenges}-{average_score}-{total_lessons}-{total_challenges}-{rank}'.format(**data)
+
+@main.route('/api/user_progress')
+@read_only
 def api_user_progress():
+    """Progress data; with ``?wait=1`` and a matching If-None-Match, long-polls for a change."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    user_id = session['user_id']
+    seen = progress_events.counter(user_id)
+    data = user_progress_payload(user_id, current_user().points)
+    etag = progress_etag(data)
+
+    if request.args.get('wait') and request.if_none_match.contains(etag):
+        # Give the connection back while waiting; the request itself holds a worker thread,
+        # so only PROGRESS_WAIT_MAX_WAITERS requests per process wait and the rest get a 304 now
+        db.session.remove()
+        changed = progress_events.wait(user_id, seen, current_app.config['PROGRESS_WAIT_SECONDS'])
+        if changed is not None:
+            # Woken by a write in this process, or timed out: a write in another worker process only
+            # shows in the database, so read again from the primary, points included, before answering
+            with primary():
+                points = db.session.query(User.points).filter_by(id=user_id).scalar()
+                data = user_progress_payload(user_id, points)
+            etag = progress_etag(data)
+
+    # Let polling clients skip the body when nothing changed
+    if request.if_none_match.contains(etag):
+        return '', 304, {'ETag': '"%s"' % etag, 'Cache-Control': 'private, no-cache'}
+
+    response = jsonify(data)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+@main.route('/api/teacher/roster')
+@read_only
+def api_teacher_roster():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    user = current_user()
+    if user.user_type != 'teacher':
+        return jsonify({'error': 'Forbidden'}), 403
+
+    page = request.args.get('page', 1, type=int)
+    per_page = min(request.args.get('per_page', 50, type=int), 200)
+    summary, students = teacher_roster(user.school,
+                                       request.args.get('sort', 'points'),
+                                       request.args.get('order', 'desc'),
+                                       page,
+                                       per_page)
+
+    return jsonify({'summary': summary, 'students': students, 'page': page, 'per_page': per_page})
+
+@main.route('/api/teacher/roster/import', methods=['POST'])
+def api_teacher_roster_import():
+    """Import a CSV or JSONL class list as students of the teacher's school."""
+    if 'user_id' not in session:
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    user = current_user()
+    if user.user_type != 'teacher':
+        return jsonify({'error': 'Forbidden'}), 403
+
+    upload = request.files.get('file')
+    if upload:
+        stream, fmt = text_stream(upload.stream), detect_format(upload.filename)
+    else:
+        fmt = 'jsonl' if 'ndjson' in (request.content_type or '') or 'jsonl' in (request.content_type or '') else 'csv'
+        stream = text_stream(request.stream)
+    fmt = request.args.get('format', fmt)
+
+    report = import_roster(read_rows(stream, fmt), school=user.school, user_type='student',
+                           batch_size=current_app.config['ROSTER_IMPORT_BATCH_SIZE'],
+                           hash_passwords=password_hasher.hash_many)
+
+    if report['inserted']:
+        ranking.invalidate()
+
+    if 'error' in report:
+        # Batches before the unreadable row are already saved
+        return jsonify(report), 400
+
+    return jsonify(report)
+
+@main.route('/api/my_rank')
+@read_only
+def api_my_rank():
     if 'user_id' not in session:
         return jsonify({'error': 'Unauthorized'}), 401
 
     user_id = session['user_id']
-    progress = UserProgress.query.filter_by(user_id=user_id).all()
+    board = get_leaderboard()
 
-    data = {
-        'completed_lessons': len([p for p in progress if p.completed]),
-        'total_lessons': Lesson.query.count(),
-        'average_score': sum([p.score for p in progress if p.completed]) / len([p for p in progress if p.completed]) if [p for p in progress if p.completed] else 0
+    return jsonify({
+        'rank': board.rank(user_id),
+        'school_rank': board.school_rank(user_id),
+        'total_students': len(board)
+    })
+
+# Versioned JSON API: keyset pagination (?cursor=, ?limit=) and sparse fields (?fields=)
+@main.errorhandler(ApiError)
+def api_error(error):
+    return compact_json({'error': str(error)}, 400)
+
+def api_page(columns, default_fields, key, **options):
+    fields = parse_fields(request.args.get('fields'), columns, default_fields)
+    data, next_cursor = keyset_page(db.session, columns, fields, key, request.args.get('cursor'),
+                                    parse_limit(request.args.get('limit')), **options)
+    return compact_json({'data': data, 'next_cursor': next_cursor})
+
+@main.route('/api/v1/lessons')
+@read_only
+def api_v1_lessons():
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
+
+    completed = db.exists().where(UserProgress.user_id == session['user_id'], UserProgress.lesson_id == Lesson.id,
+                                  UserProgress.completed == True)
+    archived = archive.archived_items(session['user_id'])['lesson']
+    if archived:
+        completed = db.or_(completed, Lesson.id.in_(archived))
+    columns = {
+        'id': Lesson.id, 'title': Lesson.title, 'description': Lesson.description, 'content': Lesson.content,
+        'category': Lesson.category, 'difficulty': Lesson.difficulty, 'points_reward': Lesson.points_reward,
+        'completed': completed
+    }
+    filters = [Lesson.category == request.args['category']] if request.args.get('category') else []
+    return api_page(columns, ['id', 'title', 'category', 'difficulty', 'points_reward', 'completed'], Lesson.id,
+                    filters=filters)
+
+@main.route('/api/v1/challenges')
+@read_only
+def api_v1_challenges():
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
+
+    status = db.select(UserChallenge.status).where(
+        UserChallenge.user_id == session['user_id'], UserChallenge.challenge_id == Challenge.id).scalar_subquery()
+    archived = archive.archived_items(session['user_id'])['challenge']
+    if archived:
+        status = db.case((Challenge.id.in_(archived), 'completed'), else_=status)
+    columns = {
+        'id': Challenge.id, 'title': Challenge.title, 'description': Challenge.description,
+        'category': Challenge.category, 'points_reward': Challenge.points_reward,
+        'duration_days': Challenge.duration_days, 'status': status
     }
+    return api_page(columns, ['id', 'title', 'category', 'points_reward', 'duration_days', 'status'], Challenge.id,
+                    filters=[Challenge.is_active == True])
 
-    return jsonify(data)
+@main.route('/api/v1/badges')
+@read_only
+def api_v1_badges():
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
 
-# Initialize database
-def init_db():
-    with app.app_context():
-        db.create_all()
+    earned_at = db.select(UserBadge.earned_at).where(
+        UserBadge.user_id == session['user_id'], UserBadge.badge_id == Badge.id).scalar_subquery()
+    columns = {
+        'id': Badge.id, 'name': Badge.name, 'description': Badge.description, 'image_url': Badge.image_url,
+        'criteria': Badge.criteria, 'earned_at': earned_at
+    }
+    filters = [earned_at.isnot(None)] if request.args.get('earned') in ('1', 'true') else []
+    return api_page(columns, ['id', 'name', 'description', 'image_url', 'earned_at'], Badge.id, filters=filters)
 
-        # Import and run sample data initialization
+@main.route('/api/v1/progress')
+@read_only
+def api_v1_progress():
+    """The current user's completed lessons, most recent first."""
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
+
+    columns = {
+        'lesson_id': UserProgress.lesson_id, 'title': Lesson.title, 'category': Lesson.category,
+        'score': UserProgress.score, 'completed_at': UserProgress.completed_at
+    }
+    fields = parse_fields(request.args.get('fields'), columns, list(columns))
+    limit = parse_limit(request.args.get('limit'))
+    after = decode_cursor(request.args.get('cursor'))
+    if after is not None:
         try:
-            from database.init_db import init_sample_data
-            init_sample_data()
-        except ImportError:
-            print("Warning: Could not import sample data initialization. Database created without sample data.")
+            # Retaking a lesson moves it up, so rows are ordered by (completed_at, id), not id alone
+            last = (datetime.fromisoformat(after[0]), int(after[1]))
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise ApiError('Invalid cursor')
+
+    query = db.session.query(UserProgress.id.label('_id'), UserProgress.completed_at.label('_at'),
+                             *[columns[name].label(name) for name in fields]) \
+        .join(Lesson).filter(UserProgress.user_id == session['user_id'], UserProgress.completed == True)
+    if after is not None:
+        query = query.filter(db.tuple_(UserProgress.completed_at, UserProgress.id) < last)
+    rows = query.order_by(UserProgress.completed_at.desc(), UserProgress.id.desc()).limit(limit + 1).all()
+
+    next_cursor = encode_cursor([rows[limit - 1]._at.isoformat(), rows[limit - 1]._id]) if len(rows) > limit else None
+    data = [{name: serialize(getattr(row, name)) for name in fields} for row in rows[:limit]]
+    return compact_json({'data': data, 'next_cursor': next_cursor})
+
+@main.route('/api/v1/history')
+@read_only
+def api_v1_history():
+    """Archived lessons and challenges, newest first; a teacher may pass ?user_id= of a student at their school."""
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
 
-# Initialize database on startup
-init_db()
+    user_id = session['user_id']
+    if request.args.get('user_id'):
+        user = current_user()
+        student = db.session.get(User, request.args.get('user_id', type=int) or 0)
+        if user.user_type != 'teacher' or student is None or student.school != user.school:
+            return compact_json({'error': 'Forbidden'}, 403)
+        user_id = student.id
+    kind = request.args.get('kind') or None
+    if kind and kind not in archive.KINDS:
+        raise ApiError(f"kind must be one of {', '.join(archive.KINDS)}")
+
+    available = ['kind', 'item_id', 'title', 'category', 'term', 'score', 'started_at', 'completed_at']
+    fields = parse_fields(request.args.get('fields'), available, available)
+    limit = parse_limit(request.args.get('limit'))
+    after = decode_cursor(request.args.get('cursor'))
+    if after is not None:
+        try:
+            # Records are ordered by (completed_at, kind, item_id), descending
+            last = (datetime.fromisoformat(after[0]), after[1], after[2])
+        except (TypeError, ValueError, KeyError, IndexError):
+            raise ApiError('Invalid cursor')
+
+    records = archive.history(user_id, kind=kind, term=request.args.get('term') or None)
+    if after is not None:
+        records = [r for r in records if (r['completed_at'], r['kind'], r['item_id']) < last]
+    next_cursor = None
+    if len(records) > limit:
+        last_record = records[limit - 1]
+        next_cursor = encode_cursor([last_record['completed_at'].isoformat(), last_record['kind'],
+                                     last_record['item_id']])
+    records = records[:limit]
+
+    # Titles and categories for this page only
+    items = {}
+    for kind_name, model in (('lesson', Lesson), ('challenge', Challenge)):
+        item_ids = {r['item_id'] for r in records if r['kind'] == kind_name}
+        if item_ids:
+            for item_id, title, category in db.session.query(model.id, model.title, model.category) \
+                    .filter(model.id.in_(item_ids)):
+                items[(kind_name, item_id)] = {'title': title, 'category': category}
+    data = [{name: serialize(dict(r, **items.get((r['kind'], r['item_id']), {})).get(name)) for name in fields}
+            for r in records]
+    return compact_json({'data': data, 'next_cursor': next_cursor})
+
+@main.route('/api/v1/leaderboard')
+@read_only
+def api_v1_leaderboard():
+    """Students by points, from the in-process leaderboard; ?school= ranks within a school."""
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
+
+    available = ['id', 'username', 'school', 'points', 'rank']
+    fields = parse_fields(request.args.get('fields'), available, available)
+    limit = parse_limit(request.args.get('limit'))
+    after = decode_cursor(request.args.get('cursor'))
+    if after is not None and not (isinstance(after, list) and len(after) == 2
+                                  and all(isinstance(value, int) for value in after)):
+        raise ApiError('Invalid cursor')
+
+    entries = get_leaderboard().page(after, limit + 1, school=request.args.get('school'))
+    next_cursor = encode_cursor([entries[limit - 1]['points'], entries[limit - 1]['id']]) if len(entries) > limit else None
+    data = [{name: entry[name] for name in fields} for entry in entries[:limit]]
+    return compact_json({'data': data, 'next_cursor': next_cursor})
+
+@main.route('/api/v1/search')
+@read_only
+def api_v1_search():
+    """Lessons and challenges matching ?q=, best first, from the in-process search index."""
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
+    if not request.args.get('q', '').strip():
+        raise ApiError('q is required')
+
+    available = ['kind', 'id', 'title', 'category', 'difficulty', 'snippet', 'score', 'url']
+    fields = parse_fields(request.args.get('fields'), available, available)
+    limit = parse_limit(request.args.get('limit'))
+    after = decode_cursor(request.args.get('cursor'))
+    if after is not None and not (isinstance(after, list) and len(after) == 3 and isinstance(after[0], (int, float))
+                                  and after[1] in SEARCH_KINDS and isinstance(after[2], int)):
+        raise ApiError('Invalid cursor')
+
+    index, hits = search_hits(request.args)
+    if after is not None:
+        # Hits are ordered by (-score, kind, id); resume after the last one returned
+        last = (-after[0], after[1], after[2])
+        hits = [hit for hit in hits if (-hit[0], hit[1], hit[2]) > last]
+    next_cursor = encode_cursor(list(hits[limit - 1])) if len(hits) > limit else None
+    data = [{name: result[name] for name in fields}
+            for result in search_results(index, hits[:limit], request.args['q'])]
+    return compact_json({'data': data, 'next_cursor': next_cursor})
+
+@main.route('/api/v1/analytics/activity')
+@read_only
+def api_v1_analytics_activity():
+    """Completions, average scores and points over time for the teacher's school, from the rollups."""
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
+
+    user = current_user()
+    if user.user_type != 'teacher':
+        return compact_json({'error': 'Forbidden'}, 403)
+
+    period = request.args.get('period', 'day')
+    try:
+        end = datetime.fromisoformat(request.args['end']) if request.args.get('end') else datetime.utcnow()
+        start = datetime.fromisoformat(request.args['start']) if request.args.get('start') \
+            else end - timedelta(days=30 if period == 'day' else 1)
+        data = analytics.series(period, start, end, user.school, kind=request.args.get('kind'),
+                                category=request.args.get('category'),
+                                group_by=request.args.get('group_by', 'category'))
+    except ValueError as e:
+        raise ApiError(str(e))
+
+    return compact_json({'period': period, 'start': start.isoformat(), 'end': end.isoformat(), 'data': data})
+
+@task('rebuild_rollups')
+def rebuild_rollups_task(since=None):
+    analytics.rebuild_rollups(datetime.fromisoformat(since) if since else None)
+
+@main.route('/api/v1/sync', methods=['POST'])
+def api_v1_sync():
+    """Apply a batch of queued offline actions in one transaction; returns per-action results and changes since ``since``."""
+    if 'user_id' not in session:
+        return compact_json({'error': 'Unauthorized'}, 401)
+
+    data = request.get_json(silent=True) or {}
+    now = datetime.utcnow()
+    since = sync.read_token(data.get('since'))
+    actions = sync.parse_actions(data.get('actions', []), current_app.config['SYNC_MAX_ACTIONS'], now)
+
+    user = current_user()
+    user_id = user.id
+    lesson_ids = {a['item_id'] for a in actions if a['type'] == 'quiz' and 'error' not in a}
+    challenge_ids = {a['item_id'] for a in actions if a['type'] != 'quiz' and 'error' not in a}
+    progress_by_lesson = {p.lesson_id: p for p in UserProgress.query.filter(
+        UserProgress.user_id == user_id, UserProgress.lesson_id.in_(lesson_ids))} if lesson_ids else {}
+    joined = {uc.challenge_id: uc for uc in UserChallenge.query.filter(
+        UserChallenge.user_id == user_id, UserChallenge.challenge_id.in_(challenge_ids))} if challenge_ids else {}
+    challenges = {c.id: c for c in Challenge.query.filter(Challenge.id.in_(challenge_ids))} if challenge_ids else {}
+    archived = archive.archived_items(user_id) if actions else None
+
+    results = []
+    applied = 0
+    points_earned = 0
+    try:
+        for action in actions:
+            result = {'id': action['id']}
+            results.append(result)
+            if 'error' in action:
+                result.update(status='error', message=action['error'])
+                continue
+            item_id, at = action['item_id'], action['at']
+
+            if action['type'] == 'quiz':
+                progress = progress_by_lesson.get(item_id)
+                if progress is None and item_id in archived['lesson']:
+                    progress = progress_by_lesson[item_id] = archive.restore(user_id, 'lesson', item_id)
+                if progress is not None and progress.completed and progress.completed_at and progress.completed_at >= at:
+                    result['status'] = 'duplicate' if progress.completed_at == at else 'stale'
+                    continue
+                outcome = record_quiz_result(user, item_id, action['answers'], progress, at=at)
+                if outcome is None:
+                    result.update(status='error', message='Lesson not found')
+                    continue
+                progress_by_lesson[item_id] = outcome['progress']
+                points_earned += outcome['points_earned']
+                result.update(status='applied', score=outcome['score'], total=outcome['total'],
+                              points_earned=outcome['points_earned'])
+            elif action['type'] == 'join':
+                if item_id in joined or item_id in archived['challenge']:
+                    result['status'] = 'duplicate'
+                elif item_id not in get_challenge_cards():
+                    # Only active challenges can be joined
+                    result.update(status='error', message='Challenge not found')
+                else:
+                    joined[item_id] = record_challenge_join(user, item_id, at=at)
+                    result['status'] = 'applied'
+            else:
+                user_challenge = joined.get(item_id)
+                if user_challenge is None and item_id in archived['challenge']:
+                    user_challenge = joined[item_id] = archive.restore(user_id, 'challenge', item_id)
+                challenge = challenges.get(item_id)
+                if user_challenge is None or challenge is None:
+                    result.update(status='error', message='Join the challenge first' if challenge else 'Challenge not found')
+                elif user_challenge.status == 'completed' and user_challenge.completed_at >= at:
+                    result['status'] = 'duplicate' if user_challenge.completed_at == at else 'stale'
+                else:
+                    earned = record_challenge_completion(user, user_challenge, challenge, at=at)
+                    points_earned += earned
+                    result.update(status='applied', points_earned=earned)
+            applied += result['status'] == 'applied'
+
+        db.session.commit()
+    except IntegrityError:
+        # A concurrent request (e.g. another tab flushing the same queue) wrote the same rows first. Autoflush
+        # raises this inside the loop as well as at commit; the client resends and gets duplicates
+        db.session.rollback()
+        return compact_json({'error': 'Conflict, please retry'}, 409)
+
+    if points_earned:
+        points_changed(user_id)
+    if applied:
+        progress_events.notify(user_id)
+
+    return compact_json(dict(sync.changes(user_id, since), results=results, token=sync.make_token(now),
+                             state=user_progress_payload(user_id, current_user().points)))
+
+def run_archive(compact=True):
+    """Archive history older than ARCHIVE_AFTER_DAYS, then optionally compact; returns (moved, statements)."""
+    config = current_app.config
+    cutoff = datetime.utcnow() - timedelta(days=config['ARCHIVE_AFTER_DAYS'])
+    moved = archive.archive_history(cutoff, config['ARCHIVE_TERM_START_MONTHS'], config['ARCHIVE_BATCH_SIZE'],
+                                    prepare=ensure_user_stats)
+    statements = []
+    if compact:
+        # End this session's transaction, so it does not hold locks VACUUM needs
+        db.session.commit()
+        statements = archive.compact(db.engine)
+    return moved, statements
+
+@task('archive_history')
+def archive_history_task(compact=True, every_hours=None):
+    run_archive(compact)
+    if every_hours:
+        # Scheduled runs queue their next run
+        enqueue('archive_history', dedupe_key='archive_history', delay=every_hours * 3600, compact=compact,
+                every_hours=every_hours)
+
+@main.cli.command('archive-history')
+@click.option('--compact/--no-compact', default=True, help='Run VACUUM/ANALYZE afterwards (default: yes).')
+@click.option('--queue', is_flag=True, help='Queue the run for a job worker instead of running it now.')
+@click.option('--every', 'every_hours', type=int, help='Queue it to repeat every this many hours.')
+def archive_history_command(compact, queue, every_hours):
+    """Move completions older than ARCHIVE_AFTER_DAYS into the archive and compact the database."""
+    if queue or every_hours:
+        enqueue('archive_history', dedupe_key='archive_history', compact=compact, every_hours=every_hours)
+        db.session.commit()
+        print("Queued archiving" + (f", repeating every {every_hours} hours." if every_hours else "."))
+        return
+    moved, statements = run_archive(compact)
+    print(f"Archived {moved['lesson']} lesson and {moved['challenge']} challenge completions.")
+    if statements:
+        print("Ran " + ', '.join(statements) + ".")
+
+@main.cli.command('build-recommendations')
+@click.option('--queue', is_flag=True, help='Queue the build for a job worker instead of running it now.')
+def build_recommendations_command(queue):
+    """Recount co-completions across all students and rebuild every student's recommendations."""
+    if queue:
+        enqueue('build_recommendations', dedupe_key='build_recommendations')
+        db.session.commit()
+        print("Queued a recommendations build.")
+        return
+    pairs, students = recommendations.build_recommendations()
+    forget_all_users()
+    print(f"Stored {pairs} item pairs and recommendations for {students} students.")
+
+@main.cli.command('rebuild-rollups')
+@click.option('--since', type=click.DateTime(), help='Only rebuild buckets from this date on.')
+@click.option('--queue', is_flag=True, help='Queue the rebuild for a job worker instead of running it now.')
+def rebuild_rollups_command(since, queue):
+    """Recompute the analytics rollups from raw progress, challenge and points rows."""
+    if queue:
+        enqueue('rebuild_rollups', dedupe_key='rebuild_rollups', since=since.isoformat() if since else None)
+        db.session.commit()
+        print("Queued a rollup rebuild.")
+        return
+    print(f"Wrote {analytics.rebuild_rollups(since)} rollup rows.")
+
+@main.cli.command('backfill-badges')
+@click.option('--chunk-size', default=500, help='Users evaluated per batch.')
+def backfill_badges_command(chunk_size):
+    """Award every badge users already qualify for."""
+    awarded = backfill_badges(chunk_size)
+    print(f"Awarded {awarded} badges.")
+
+@main.cli.command('import-roster')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'fmt', type=click.Choice(['csv', 'jsonl']), help='Defaults to the file extension.')
+@click.option('--school', help='Assign every imported user to this school.')
+@click.option('--user-type', type=click.Choice(['student', 'teacher']), help='Override user_type for every row.')
+@click.option('--batch-size', default=5000, help='Users inserted per batch.')
+def import_roster_command(path, fmt, school, user_type, batch_size):
+    """Bulk import users from a CSV or JSONL roster file."""
+    with open(path, encoding='utf-8-sig', newline='') as f:
+        report = import_roster(read_rows(f, fmt or detect_format(path)), school=school, user_type=user_type,
+                               batch_size=batch_size, progress=print_import_progress,
+                               hash_passwords=password_hasher.hash_many)
+    print_import_report(report)
+
+@main.cli.command('seed-synthetic')
+@click.option('--users', default=10000, help='Users to generate.')
+@click.option('--schools', default=50, help='Schools to spread them across.')
+@click.option('--max-points', default=5000, help='Students get random points up to this value.')
+@click.option('--seed', default=42, help='Random seed.')
+@click.option('--batch-size', default=5000, help='Users inserted per batch.')
+def seed_synthetic_command(users, schools, max_points, seed, batch_size):
+    """Generate a large synthetic roster through the bulk import pipeline."""
+    # Every synthetic user shares one hash of 'password' so seeding stays fast
+    rows = synthetic_rows(users, schools=schools, max_points=max_points, seed=seed,
+                          password=password_hasher.hash('password'))
+    report = import_roster(rows, batch_size=batch_size, progress=print_import_progress, keep_points=True)
+    print_import_report(report)
+
+def print_import_progress(report):
+    print(f"  processed {report['processed']}, inserted {report['inserted']}, skipped {report['skipped']}")
+
+def print_import_report(report):
+    print(f"Imported {report['inserted']} users, skipped {report['skipped']}.")
+    for error in report['errors']:
+        print(f"  row {error['row']}: {error['error']}")
+    if 'error' in report:
+        print(f"Stopped early: {report['error']}")
+
+@main.cli.command('hash-passwords')
+@click.option('--batch-size', default=1000, help='Users hashed and updated per batch.')
+def hash_passwords_command(batch_size):
+    """Hash legacy plaintext passwords in batches."""
+    hashed = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(User.id, User.password).filter(
+            User.id > last_id,
+            ~User.password.like('pbkdf2:%'),
+            ~User.password.like('scrypt:%')
+        ).order_by(User.id).limit(batch_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        hashes = password_hasher.hash_many([row.password for row in rows])
+        db.session.execute(update(User), [{'id': row.id, 'password': h} for row, h in zip(rows, hashes)])
+        db.session.commit()
+        hashed += len(rows)
+        print(f"  hashed {hashed}")
+    print(f"Hashed {hashed} plaintext passwords.")
+
+@main.cli.command('rebuild-points')
+@click.option('--user-id', type=int, help='Only rebuild this user.')
+def rebuild_points_command(user_id):
+    """Recompute User.points from the points ledger."""
+    updated = rebuild_points(user_id)
+    if user_id is not None:
+        forget_user(user_id)
+    elif updated:
+        forget_all_users()
+    print(f"Corrected points for {updated} users.")
+
+@main.cli.command('run-jobs')
+@click.option('--threads', type=int, help='Worker threads (default: JOB_WORKER_THREADS).')
+@click.option('--drain', is_flag=True, help='Exit once no jobs are due instead of polling.')
+def run_jobs_command(threads, drain):
+    """Run background jobs until interrupted."""
+    config = current_app.config
+    jobs.run_workers(current_app._get_current_object(),
+                     threads=threads or config['JOB_WORKER_THREADS'],
+                     poll_seconds=config['JOB_POLL_SECONDS'],
+                     batch_size=config['JOB_BATCH_SIZE'],
+                     lock_timeout=config['JOB_LOCK_TIMEOUT_SECONDS'],
+                     drain_only=drain)
+    failed = Job.query.filter_by(status='failed').count()
+    if failed:
+        print(f"{failed} jobs have failed; see the job table's last_error column.")
+
+@main.cli.command('revoke-sessions')
+@click.argument('username')
+def revoke_sessions_command(username):
+    """Log a user out everywhere by deleting all of their sessions."""
+    user = User.query.filter_by(username=username).first()
+    if user is None:
+        raise click.ClickException(f"No user named {username}")
+    print(f"Revoked {revoke_user(user.id)} sessions.")
+
+@main.cli.command('init-db')
+def init_db_command():
+    """Create missing tables and apply pending schema migrations."""
+    applied = init_db()
+    print("Applied migrations: " + (', '.join(applied) if applied else 'none'))
+
+@main.cli.command('sync-replicas')
+def sync_replicas_command():
+    """Copy a SQLite primary over the SQLite replica files, to try replica routing locally."""
+    if not db_routing.replicas.engines:
+        print("No replicas configured; set DATABASE_REPLICA_URLS.")
+        return
+    for path in db_routing.sync_sqlite_replicas(db.engine, db_routing.replicas.engines):
+        print(f"Copied the primary to {path}")
+    print("Replica health: " + ', '.join(f"{name}={'ok' if db_routing.replicas.is_healthy(name) else 'down'}"
+                                         for name in sorted(db_routing.replicas.engines)))
+
+@main.cli.command('seed')
+def seed_command():
+    """Load the sample lessons, quizzes, challenges and badges."""
+    init_sample_data()
+
+@main.cli.command('db-check-plans')
+def db_check_plans_command():
+    """Verify that the hot lookup queries use their indexes (SQLite only)."""
+    if db.engine.dialect.name != 'sqlite':
+        print("Query plan checks only support SQLite.")
+        return
+    failed = 0
+    for query, index, plan, ok in check_query_plans(db.engine):
+        print(f"{'OK  ' if ok else 'FAIL'} {query}\n     {plan}")
+        failed += not ok
+    if failed:
+        raise click.ClickException(f"{failed} queries do not use their expected index.")
+
+def set_sqlite_pragmas(app):
+    # WAL lets readers run alongside a writer; busy_timeout makes workers wait for locks
+    def on_connect(dbapi_connection, connection_record):
+        if isinstance(dbapi_connection, sqlite3.Connection):
+            cursor = dbapi_connection.cursor()
+            cursor.execute('PRAGMA journal_mode=WAL')
+            cursor.execute('PRAGMA busy_timeout=%d' % app.config['SQLITE_BUSY_TIMEOUT_MS'])
+            cursor.execute('PRAGMA synchronous=%s' % app.config['SQLITE_SYNCHRONOUS'])
+            cursor.close()
+
+    for engine in db.engines.values():
+        event.listen(engine, 'connect', on_connect)
+
+def create_app(config_class=Config):
+    """Build the application. Creating tables and seeding data are separate CLI steps."""
+    app = Flask(__name__)
+    app.config.from_object(config_class)
+
+    db.init_app(app)
+    with app.app_context():
+        set_sqlite_pragmas(app)
+    db_routing.init_app(app, db)
+    sessions.init_app(app)
+    instrumentation.init_app(app, db)
+    http_cache.init_app(app)
+
+    ranking.refresh_seconds = app.config['LEADERBOARD_REFRESH_SECONDS']
+    ranking.catch_up_seconds = app.config['LEADERBOARD_CATCH_UP_SECONDS']
+    search_index.refresh_seconds = app.config['SEARCH_INDEX_REFRESH_SECONDS']
+    progress_events.max_waiters = app.config['PROGRESS_WAIT_MAX_WAITERS']
+    content_version.check_seconds = app.config['CONTENT_VERSION_CHECK_SECONDS']
+    password_hasher.configure(app.config['PASSWORD_HASH_METHOD'], app.config['PASSWORD_HASH_THREADS'])
+    login_limiter.burst = app.config['LOGIN_RATE_LIMIT_BURST']
+    login_limiter.per_minute = app.config['LOGIN_RATE_LIMIT_PER_MINUTE']
+    client_limiter.burst = app.config['LOGIN_CLIENT_RATE_LIMIT_BURST']
+    client_limiter.per_minute = app.config['LOGIN_CLIENT_RATE_LIMIT_PER_MINUTE']
+    app.register_blueprint(main)
+
+    return app
 
 if __name__ == '__main__':
+    app = create_app()
+    with app.app_context():
+        init_db()
+        init_sample_data()
+    # Run background jobs alongside the development server
+    threading.Thread(target=jobs.run_workers, args=(app,), kwargs={'threads': 1}, daemon=True).start()
     app.run(debug=True)
@@ -0,0 +1,242 @@
+"""
+Data retention for EcoLearn.
+
+Completed lessons and challenges older than a cutoff are moved out of
+UserProgress and UserChallenge into ArchivedHistory, one row per student,
+school term and kind. Each row keeps the archived item ids and totals as
+plain columns, so "has this student done it" checks and counter rebuilds
+stay cheap. The individual records (scores and timestamps) are stored as
+a zlib-compressed columnar blob, decoded only when someone asks for the
+history.
+
+Summaries stay in the hot tables: UserStats, points and the points
+ledger, badges and the analytics rollups are not touched, so dashboards,
+rankings and trends look the same after archiving. Code that rebuilds
+them from raw rows also reads the archive. A student who retakes an
+archived lesson, or completes an archived challenge again, first gets the
+record back in the hot table (``restore``). The retake then works just as
+it did before the record was archived.
+"""
+
+from datetime import datetime, timedelta
+import json
+import zlib
+
+from sqlalchemy import text
+
+from models import db, ArchivedHistory, User, UserChallenge, UserProgress
+
+KINDS = ('lesson', 'challenge')
+
+# Columns stored per kind; timestamps are whole seconds since the epoch
+FIELDS = {
+    'lesson': ('item_id', 'score', 'completed_at'),
+    'challenge': ('item_id', 'started_at', 'completed_at')
+}
+TIMESTAMPS = ('started_at', 'completed_at')
+
+# Tables whose space and statistics change when history is archived
+COMPACT_TABLES = ('user_progress', 'user_challenge', 'archived_history')
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+def term_of(moment, start_months=(1, 8)):
+    """The term a moment falls in, named after the month the term starts, e.g. '2025-08'."""
+    months = sorted(start_months)
+    started = [month for month in months if month <= moment.month]
+    if started:
+        return f'{moment.year:04d}-{started[-1]:02d}'
+    return f'{moment.year - 1:04d}-{months[-1]:02d}'
+
+
+def encode(kind, records):
+    """Compress records (dicts with the kind's FIELDS) into one blob, a list per column."""
+    columns = {}
+    for field in FIELDS[kind]:
+        values = [record.get(field) for record in records]
+        if field in TIMESTAMPS:
+            values = [int((value - _EPOCH).total_seconds()) if value else None for value in values]
+        columns[field] = values
+    return zlib.compress(json.dumps(columns, separators=(',', ':')).encode(), 9)
+
+
+def decode(kind, blob):
+    """The records stored by ``encode``."""
+    columns = json.loads(zlib.decompress(blob))
+    for field in TIMESTAMPS:
+        if field in columns:
+            columns[field] = [_EPOCH + timedelta(seconds=value) if value is not None else None
+                              for value in columns[field]]
+    fields = FIELDS[kind]
+    return [dict(zip(fields, values)) for values in zip(*(columns[field] for field in fields))]
+
+
+def _store(entry, records):
+    records.sort(key=lambda record: (record['completed_at'], record['item_id']))
+    entry.item_ids = ','.join(str(item_id) for item_id in sorted({record['item_id'] for record in records}))
+    entry.completions = len(records)
+    entry.score_sum = sum(record.get('score') or 0 for record in records)
+    entry.first_at = records[0]['completed_at']
+    entry.last_at = records[-1]['completed_at']
+    entry.records = encode(entry.kind, records)
+    entry.archived_at = datetime.utcnow()
+
+
+def _merge(groups):
+    """Add {(user_id, term, kind): [records]} to the archive, merging into existing rows."""
+    user_ids = {user_id for user_id, _, _ in groups}
+    existing = {(entry.user_id, entry.term, entry.kind): entry
+                for entry in ArchivedHistory.query.filter(ArchivedHistory.user_id.in_(user_ids))}
+    for (user_id, term, kind), records in groups.items():
+        entry = existing.get((user_id, term, kind))
+        if entry is None:
+            entry = ArchivedHistory(user_id=user_id, term=term, kind=kind)
+            db.session.add(entry)
+        else:
+            records = decode(kind, entry.records) + records
+        _store(entry, records)
+
+
+def archive_history(cutoff, start_months=(1, 8), chunk_size=500, prepare=None):
+    """Move completions from before ``cutoff`` into the archive; returns {kind: records moved}.
+
+    Works through users ``chunk_size`` at a time and commits per chunk.
+    ``prepare(user_ids)`` is called before a chunk's rows move, while they are
+    still in the hot tables, e.g. to build missing UserStats from them.
+    """
+    moved = dict.fromkeys(KINDS, 0)
+    last_id = 0
+    while True:
+        user_ids = [user_id for (user_id,) in db.session.query(User.id).filter(User.id > last_id)
+                    .order_by(User.id).limit(chunk_size)]
+        if not user_ids:
+            break
+        last_id = user_ids[-1]
+
+        lessons = db.session.query(UserProgress.id, UserProgress.user_id, UserProgress.lesson_id,
+                                   UserProgress.score, UserProgress.completed_at) \
+            .filter(UserProgress.user_id.in_(user_ids), UserProgress.completed == True,
+                    UserProgress.completed_at < cutoff).all()
+        challenges = db.session.query(UserChallenge.id, UserChallenge.user_id, UserChallenge.challenge_id,
+                                      UserChallenge.started_at, UserChallenge.completed_at) \
+            .filter(UserChallenge.user_id.in_(user_ids), UserChallenge.status == 'completed',
+                    UserChallenge.completed_at < cutoff).all()
+        if not lessons and not challenges:
+            continue
+        if prepare is not None:
+            prepare(sorted({row.user_id for row in lessons} | {row.user_id for row in challenges}))
+
+        groups = {}
+        for row in lessons:
+            groups.setdefault((row.user_id, term_of(row.completed_at, start_months), 'lesson'), []).append(
+                {'item_id': row.lesson_id, 'score': row.score or 0, 'completed_at': row.completed_at})
+        for row in challenges:
+            groups.setdefault((row.user_id, term_of(row.completed_at, start_months), 'challenge'), []).append(
+                {'item_id': row.challenge_id, 'started_at': row.started_at, 'completed_at': row.completed_at})
+        _merge(groups)
+
+        if lessons:
+            UserProgress.query.filter(UserProgress.id.in_([row.id for row in lessons])) \
+                .delete(synchronize_session=False)
+        if challenges:
+            UserChallenge.query.filter(UserChallenge.id.in_([row.id for row in challenges])) \
+                .delete(synchronize_session=False)
+        db.session.commit()
+        moved['lesson'] += len(lessons)
+        moved['challenge'] += len(challenges)
+    return moved
+
+
+def archived_items(user_id):
+    """{kind: set of archived item ids} for one student."""
+    items = {kind: set() for kind in KINDS}
+    for kind, item_ids in db.session.query(ArchivedHistory.kind, ArchivedHistory.item_ids).filter_by(user_id=user_id):
+        items[kind].update(int(item_id) for item_id in item_ids.split(',') if item_id)
+    return items
+
+
+def archived_totals(user_ids):
+    """{user_id: {kind: (completions, score_sum)}} for the students that have archived history."""
+    totals = {}
+    rows = db.session.query(ArchivedHistory.user_id, ArchivedHistory.kind, db.func.sum(ArchivedHistory.completions),
+                            db.func.sum(ArchivedHistory.score_sum)) \
+        .filter(ArchivedHistory.user_id.in_(user_ids)) \
+        .group_by(ArchivedHistory.user_id, ArchivedHistory.kind)
+    for user_id, kind, completions, score_sum in rows:
+        totals.setdefault(user_id, {})[kind] = (completions or 0, score_sum or 0)
+    return totals
+
+
+def restore(user_id, kind, item_id):
+    """Move one archived completion back to the hot table; returns the new pending row, or None.
+
+    The caller commits.
+    """
+    token = str(item_id)
+    for entry in ArchivedHistory.query.filter_by(user_id=user_id, kind=kind):
+        if token not in entry.item_ids.split(','):
+            continue
+        records = decode(kind, entry.records)
+        record = next(record for record in records if record['item_id'] == item_id)
+        records.remove(record)
+        if records:
+            _store(entry, records)
+        else:
+            db.session.delete(entry)
+
+        if kind == 'lesson':
+            row = UserProgress(user_id=user_id, lesson_id=item_id, completed=True, score=record['score'],
+                               completed_at=record['completed_at'])
+        else:
+            row = UserChallenge(user_id=user_id, challenge_id=item_id, status='completed',
+                                started_at=record['started_at'], completed_at=record['completed_at'])
+        db.session.add(row)
+        return row
+    return None
+
+
+def history(user_id, kind=None, term=None):
+    """A student's archived records, newest first, each with its ``kind`` and ``term``."""
+    entries = ArchivedHistory.query.filter_by(user_id=user_id)
+    if kind:
+        entries = entries.filter_by(kind=kind)
+    if term:
+        entries = entries.filter_by(term=term)
+    records = []
+    for entry in entries:
+        records.extend(dict(record, kind=entry.kind, term=entry.term) for record in decode(entry.kind, entry.records))
+    records.sort(key=lambda record: (record['completed_at'], record['kind'], record['item_id']), reverse=True)
+    return records
+
+
+def iter_records(since=None, chunk_size=1000):
+    """Every archived completion as (kind, school, item_id, completed_at, score), optionally from ``since`` on."""
+    entries = db.session.query(ArchivedHistory.kind, ArchivedHistory.records, User.school) \
+        .join(User, User.id == ArchivedHistory.user_id)
+    if since is not None:
+        entries = entries.filter(ArchivedHistory.last_at >= since)
+    for kind, blob, school in entries.yield_per(chunk_size):
+        for record in decode(kind, blob):
+            if since is None or record['completed_at'] >= since:
+                yield kind, school, record['item_id'], record['completed_at'], record.get('score') or 0
+
+
+def compact(engine):
+    """Reclaim the space freed by archiving and refresh planner statistics; returns the statements run.
+
+    SQLite rewrites the whole file (VACUUM), so run it when the site is quiet.
+    PostgreSQL vacuums and analyzes just the affected tables.
+    """
+    if engine.dialect.name == 'sqlite':
+        statements = ['VACUUM', 'ANALYZE']
+    elif engine.dialect.name == 'postgresql':
+        quote = engine.dialect.identifier_preparer.quote
+        statements = [f'VACUUM ANALYZE {quote(table)}' for table in COMPACT_TABLES]
+    else:
+        statements = []
+    # VACUUM cannot run inside a transaction
+    with engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for statement in statements:
+            conn.execute(text(statement))
+    return statements
@@ -0,0 +1,138 @@
+"""
+Badge evaluation for EcoLearn.
+
+``Badge.criteria`` strings are compiled into rules once and indexed by
+the events that can change their outcome, so a completion only checks
+the handful of rules it could possibly satisfy.
+
+Supported criteria:
+
+    points_threshold:<n>       user has at least n points
+    challenges_completed:<n>   user has completed at least n challenges
+    lessons_completed:<n>      user has completed at least n lessons
+    lessons_completed:<cat>    user has completed every lesson in category cat
+"""
+
+import threading
+
+LESSON_COMPLETED = 'lesson_completed'
+CHALLENGE_COMPLETED = 'challenge_completed'
+
+
+class Rule:
+    def __init__(self, badge_id, kind, target, events, category=None):
+        self.badge_id = badge_id
+        self.kind = kind
+        self.target = target
+        self.events = events
+        self.category = category
+
+    def applies_to(self, event):
+        # Category rules only care about lessons from their own category
+        if self.category is not None:
+            return event.get('category') == self.category
+        return True
+
+    def check(self, facts):
+        if self.kind == 'points_threshold':
+            return facts.points() >= self.target
+        if self.kind == 'challenges_completed':
+            return facts.completed_challenges() >= self.target
+        if self.kind == 'lessons_completed':
+            return facts.completed_lessons() >= self.target
+        completed, total = facts.category_progress(self.category)
+        return total > 0 and completed >= total
+
+
+def compile_rule(badge_id, criteria):
+    """Compile a criteria string, returning None if it is not understood."""
+    kind, _, argument = (criteria or '').partition(':')
+    kind = kind.strip()
+    argument = argument.strip()
+
+    if kind == 'points_threshold' and argument.isdigit():
+        return Rule(badge_id, kind, int(argument), (LESSON_COMPLETED, CHALLENGE_COMPLETED))
+    if kind == 'challenges_completed' and argument.isdigit():
+        return Rule(badge_id, kind, int(argument), (CHALLENGE_COMPLETED,))
+    if kind == 'lessons_completed' and argument.isdigit():
+        return Rule(badge_id, kind, int(argument), (LESSON_COMPLETED,))
+    if kind == 'lessons_completed' and argument:
+        return Rule(badge_id, 'category_completed', None, (LESSON_COMPLETED,), category=argument)
+    return None
+
+
+class UserFacts:
+    """Lazily computed, memoized facts about one user.
+
+    Each argument is a callable so a rule only pays for the facts it reads.
+    """
+
+    def __init__(self, points, completed_challenges, completed_lessons, category_progress):
+        self._loaders = {
+            'points': points,
+            'completed_challenges': completed_challenges,
+            'completed_lessons': completed_lessons
+        }
+        self._category_progress = category_progress
+        self._values = {}
+
+    def _get(self, name):
+        if name not in self._values:
+            self._values[name] = self._loaders[name]()
+        return self._values[name]
+
+    def points(self):
+        return self._get('points')
+
+    def completed_challenges(self):
+        return self._get('completed_challenges')
+
+    def completed_lessons(self):
+        return self._get('completed_lessons')
+
+    def category_progress(self, category):
+        key = ('category', category)
+        if key not in self._values:
+            self._values[key] = self._category_progress(category)
+        return self._values[key]
+
+
+class BadgeEngine:
+    def __init__(self):
+        self.names = {}
+        self._rules = None
+        self._by_event = {}
+        self._lock = threading.Lock()
+
+    def load(self, badges):
+        """Compile rules from (badge_id, name, criteria) rows."""
+        rules = [rule for rule in (compile_rule(badge_id, criteria) for badge_id, _, criteria in badges) if rule]
+        by_event = {}
+        for rule in rules:
+            for event in rule.events:
+                by_event.setdefault(event, []).append(rule)
+        with self._lock:
+            self.names = {badge_id: name for badge_id, name, _ in badges}
+            self._rules = rules
+            self._by_event = by_event
+
+    def is_loaded(self):
+        return self._rules is not None
+
+    def invalidate(self):
+        with self._lock:
+            self._rules = None
+            self._by_event = {}
+
+    def has_rules(self, event_type):
+        return bool(self._by_event.get(event_type))
+
+    def evaluate_event(self, event, facts, earned):
+        """Badge ids newly earned because of ``event``; ``earned`` is the set already held."""
+        return [rule.badge_id for rule in self._by_event.get(event['type'], ())
+                if rule.badge_id not in earned and rule.applies_to(event) and rule.check(facts)]
+
+    def evaluate_all(self, facts, earned):
+        """Badge ids earned across every rule, used for backfills."""
+        return [rule.badge_id for rule in self._rules or ()
+                if rule.badge_id not in earned and rule.check(facts)]
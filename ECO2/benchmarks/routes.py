@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Route benchmark for EcoLearn.
+
+Seeds a synthetic dataset into a scratch SQLite database, drives every
+route through the Flask test client and reports latency percentiles,
+queries per request and throughput as JSON. Runs entirely offline. Run
+from the ECO2 directory:
+
+    python benchmarks/routes.py --users 10000 --output results.json
+    python benchmarks/routes.py --users 10000 --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import event, insert
+
+from app import create_app, ensure_user_stats, password_hasher
+from archive import archive_history
+from config import Config
+from database.init_db import init_db
+from db_routing import replicas, sync_sqlite_replicas
+from models import db, User, Lesson, Quiz, Challenge, UserProgress, UserChallenge
+from analytics import rebuild_rollups
+from recommendations import build_recommendations
+from roster import import_roster, synthetic_rows
+
+CATEGORIES = ['climate', 'waste', 'biodiversity', 'conservation', 'transportation']
+DIFFICULTIES = ['beginner', 'intermediate', 'advanced']
+
+
+def insert_rows(model, rows, chunk_size=5000):
+    for start in range(0, len(rows), chunk_size):
+        db.session.execute(insert(model), rows[start:start + chunk_size])
+    db.session.commit()
+
+
+def seed(users, schools, lessons, challenges, density, rng):
+    """Create a synthetic dataset; density is the share of lessons/challenges each student completed."""
+    insert_rows(Lesson, [{
+        'title': f'Lesson {i}',
+        'description': f'Synthetic lesson {i}',
+        'content': '<h2>Lesson</h2>' + '<p>Eco content.</p>' * 20,
+        'category': CATEGORIES[i % len(CATEGORIES)],
+        'difficulty': DIFFICULTIES[i % len(DIFFICULTIES)],
+        'points_reward': 10 + i % 20
+    } for i in range(lessons)])
+    insert_rows(Quiz, [{
+        'lesson_id': lesson_id,
+        'question': f'Question {q} for lesson {lesson_id}?',
+        'options': json.dumps(['A', 'B', 'C', 'D']),
+        'correct_answer': q % 4,
+        'explanation': 'Because.'
+    } for lesson_id in range(1, lessons + 1) for q in range(5)])
+    insert_rows(Challenge, [{
+        'title': f'Challenge {i}',
+        'description': f'Synthetic challenge {i}',
+        'category': CATEGORIES[i % len(CATEGORIES)],
+        'points_reward': 50,
+        'duration_days': 7,
+        'is_active': True
+    } for i in range(challenges)])
+
+    # One teacher per school, the rest are students; all share one hash of 'password' so logins verify it
+    import_roster(synthetic_rows(users, schools=schools, max_points=5000, seed=rng.random(),
+                                 password=password_hasher.hash('password')),
+                  batch_size=5000, keep_points=True)
+
+    now = datetime.utcnow()
+
+    progress_rows = []
+    challenge_rows = []
+    for user_id in range(schools + 1, users + 1):
+        for lesson_id in rng.sample(range(1, lessons + 1), int(lessons * density)):
+            progress_rows.append({
+                'user_id': user_id, 'lesson_id': lesson_id, 'completed': True,
+                'score': rng.randint(0, 5), 'completed_at': now - timedelta(minutes=rng.randint(0, 525600))
+            })
+        for challenge_id in rng.sample(range(1, challenges + 1), int(challenges * density)):
+            challenge_rows.append({
+                'user_id': user_id, 'challenge_id': challenge_id,
+                'status': rng.choice(['in_progress', 'completed']),
+                'started_at': now - timedelta(minutes=rng.randint(0, 525600))
+            })
+    insert_rows(UserProgress, progress_rows)
+    insert_rows(UserChallenge, challenge_rows)
+    # Derived tables the app otherwise maintains as completions arrive
+    rebuild_rollups()
+    build_recommendations()
+
+    return {'users': users, 'schools': schools, 'lessons': lessons, 'challenges': challenges,
+            'progress_rows': len(progress_rows), 'challenge_rows': len(challenge_rows)}
+
+
+def scenarios(users, schools, lessons, challenges, rng):
+    """(name, method, path factory, user factory, body) for every route.
+
+    ``body`` is None, 'json' or 'form' when the path factory also returns a
+    request body, or 'revalidate' to send the ETag of a fresh response.
+    """
+    student = lambda: rng.randint(schools + 1, users)
+    teacher = lambda: rng.randint(1, schools)
+    lesson = lambda: rng.randint(1, lessons)
+    anyone = lambda: None
+
+    def quiz_answers():
+        lesson_id = lesson()
+        first = (lesson_id - 1) * 5 + 1
+        return f'/submit_quiz/{lesson_id}', {'answers': {str(q): rng.randint(0, 3) for q in range(first, first + 5)}}
+
+    def sync_batch():
+        actions = []
+        for index in range(5):
+            path, body = quiz_answers()
+            actions.append({'id': f'{rng.getrandbits(64):x}', 'type': 'quiz', 'lesson_id': int(path.rsplit('/', 1)[1]),
+                            'answers': body['answers'], 'at': f'2026-03-02T09:{index:02d}:00Z'})
+        return '/api/v1/sync', {'actions': actions}
+
+    def quiz_batch():
+        submissions = []
+        for _ in range(5):
+            path, body = quiz_answers()
+            submissions.append({'lesson_id': int(path.rsplit('/', 1)[1]), 'answers': body['answers']})
+        return '/api/submit_quizzes', {'submissions': submissions}
+
+    def login_form():
+        # Synthetic user ids start at 1, usernames at user0
+        return '/login', {'username': f'user{student() - 1}', 'password': 'password'}
+
+    def register_form():
+        name = f'bench{rng.getrandbits(64):x}'
+        return '/register', {'username': name, 'email': f'{name}@example.com', 'password': 'password',
+                             'user_type': 'student', 'school': f'School {rng.randrange(schools)}'}
+
+    return [
+        ('index', 'GET', lambda: '/', anyone, None),
+        ('login', 'POST', login_form, anyone, 'form'),
+        ('register', 'POST', register_form, anyone, 'form'),
+        ('logout', 'GET', lambda: '/logout', student, None),
+        ('lessons', 'GET', lambda: '/lessons', student, None),
+        ('lesson_detail', 'GET', lambda: f'/lesson/{lesson()}', student, None),
+        ('quiz', 'GET', lambda: f'/quiz/{lesson()}', student, None),
+        ('submit_quiz', 'POST', quiz_answers, student, 'json'),
+        ('submit_quizzes', 'POST', quiz_batch, student, 'json'),
+        ('challenges', 'GET', lambda: '/challenges', student, None),
+        ('join_challenge', 'GET', lambda: f'/join_challenge/{rng.randint(1, challenges)}', student, None),
+        ('complete_challenge', 'POST', lambda: f'/complete_challenge/{rng.randint(1, challenges)}', student, None),
+        ('leaderboard', 'GET', lambda: '/leaderboard', student, None),
+        ('rewards', 'GET', lambda: '/rewards', student, None),
+        ('dashboard_student', 'GET', lambda: '/dashboard', student, None),
+        ('dashboard_teacher', 'GET', lambda: '/dashboard', teacher, None),
+        ('api_user_progress', 'GET', lambda: '/api/user_progress', student, None),
+        ('api_user_progress_wait', 'GET', lambda: '/api/user_progress?wait=1', student, 'revalidate'),
+        ('api_my_rank', 'GET', lambda: '/api/my_rank', student, None),
+        ('api_teacher_roster', 'GET', lambda: '/api/teacher/roster', teacher, None),
+        ('api_v1_lessons', 'GET', lambda: '/api/v1/lessons', student, None),
+        ('api_v1_challenges', 'GET', lambda: '/api/v1/challenges', student, None),
+        ('api_v1_badges', 'GET', lambda: '/api/v1/badges', student, None),
+        ('api_v1_progress', 'GET', lambda: '/api/v1/progress', student, None),
+        ('api_v1_history', 'GET', lambda: '/api/v1/history', student, None),
+        ('api_v1_sync', 'POST', sync_batch, student, 'json'),
+        ('api_v1_analytics', 'GET', lambda: '/api/v1/analytics/activity?period=day&start=2025-10-01&end=2026-10-01',
+         teacher, None),
+        ('api_v1_search', 'GET', lambda: f'/api/v1/search?q={rng.choice(CATEGORIES)} lesson', teacher, None),
+        ('search', 'GET', lambda: f'/search?q=eco&category={rng.choice(CATEGORIES)}', teacher, None),
+        ('api_v1_leaderboard', 'GET', lambda: f'/api/v1/leaderboard?school=School {rng.randrange(schools)}', student, None),
+    ]
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+def run_scenario(app, client, counter, scenario, requests, warmup):
+    name, method, path_factory, user_factory, body_kind = scenario
+    latencies = []
+    queries = []
+    statuses = {}
+    started = time.perf_counter()
+    timed = 0.0
+
+    for i in range(warmup + requests):
+        target = path_factory()
+        path, body = target if body_kind in ('json', 'form') else (target, None)
+        user_id = user_factory()
+        with client.session_transaction() as session:
+            session.clear()
+            if user_id is not None:
+                session['user_id'] = user_id
+
+        options = {'json': body} if body_kind == 'json' else {'data': body}
+        if body_kind == 'revalidate':
+            # Untimed: the client already holds the current ETag when it starts waiting
+            options['headers'] = {'If-None-Match': client.get(path.split('?')[0]).headers.get('ETag', '')}
+
+        counter['count'] = 0
+        start = time.perf_counter()
+        response = client.open(path, method=method, **options)
+        elapsed = time.perf_counter() - start
+        if i < warmup:
+            continue
+
+        timed += elapsed
+        latencies.append(elapsed * 1000)
+        queries.append(counter['count'])
+        statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+    return {
+        'route': name,
+        'requests': requests,
+        'p50_ms': round(percentile(latencies, 50), 3),
+        'p95_ms': round(percentile(latencies, 95), 3),
+        'p99_ms': round(percentile(latencies, 99), 3),
+        'mean_ms': round(statistics.mean(latencies), 3),
+        'queries_per_request': round(statistics.mean(queries), 2),
+        'max_queries': max(queries),
+        'throughput_rps': round(requests / timed, 1) if timed else None,
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'statuses': {str(code): count for code, count in sorted(statuses.items())}
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(current, baseline_path):
+    """Print p50/p95/queries deltas against a previous results file."""
+    with open(baseline_path) as f:
+        baseline = {r['route']: r for r in json.load(f)['results']}
+    print(f"{'route':<22}{'p50 ms':>18}{'p95 ms':>18}{'queries':>14}", file=sys.stderr)
+    for result in current['results']:
+        old = baseline.get(result['route'])
+        if old is None:
+            continue
+        print(f"{result['route']:<22}"
+              f"{old['p50_ms']:>8.2f} -> {result['p50_ms']:<7.2f}"
+              f"{old['p95_ms']:>8.2f} -> {result['p95_ms']:<7.2f}"
+              f"{old['queries_per_request']:>6} -> {result['queries_per_request']:<5}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark every EcoLearn route against a synthetic dataset.')
+    parser.add_argument('--users', type=int, default=10000)
+    parser.add_argument('--schools', type=int, default=50)
+    parser.add_argument('--lessons', type=int, default=30)
+    parser.add_argument('--challenges', type=int, default=12)
+    parser.add_argument('--density', type=float, default=0.3, help='Share of lessons/challenges each student has done.')
+    parser.add_argument('--requests', type=int, default=200, help='Timed requests per route.')
+    parser.add_argument('--warmup', type=int, default=10, help='Untimed requests per route before timing.')
+    parser.add_argument('--routes', help='Comma-separated route names to run (default: all).')
+    parser.add_argument('--seed', type=int, default=42, help='Random seed, so runs are comparable.')
+    parser.add_argument('--database', help='SQLite file to use (default: a temporary file).')
+    parser.add_argument('--replicas', type=int, default=0,
+                        help='Serve read-only routes from this many SQLite copies of the seeded database.')
+    parser.add_argument('--archive-days', type=int,
+                        help='Archive completions older than this many days before running the routes.')
+    parser.add_argument('--output', help='Write JSON results to this file instead of stdout.')
+    parser.add_argument('--compare', help='Previous results file to print deltas against.')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    tmp = tempfile.TemporaryDirectory()
+    path = args.database or os.path.join(tmp.name, 'benchmark.db')
+
+    class BenchmarkConfig(Config):
+        SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.abspath(path)
+        # One process, and no session file left behind
+        SESSION_STORE = 'memory'
+        # Time the long-poll's own work, not the idle wait for a change
+        PROGRESS_WAIT_SECONDS = 0
+        SQLALCHEMY_BINDS = {f'replica_{number}': 'sqlite:///' + os.path.join(tmp.name, f'replica_{number}.db')
+                            for number in range(1, args.replicas + 1)}
+
+    app = create_app(BenchmarkConfig)
+    counter = {'count': 0}
+
+    with app.app_context():
+        def count_query(conn, cursor, statement, parameters, context, executemany):
+            counter['count'] += 1
+
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', count_query)
+
+        seeded = time.perf_counter()
+        init_db()
+        if not User.query.first():
+            dataset = seed(args.users, args.schools, args.lessons, args.challenges, args.density, rng)
+        else:
+            dataset = {'users': User.query.count(), 'reused_database': path}
+        if args.archive_days is not None:
+            dataset['archived'] = archive_history(datetime.utcnow() - timedelta(days=args.archive_days),
+                                                  prepare=ensure_user_stats)
+        sync_sqlite_replicas(db.engine, replicas.engines)
+        seed_seconds = time.perf_counter() - seeded
+
+    client = app.test_client()
+    selected = set(args.routes.split(',')) if args.routes else None
+    results = []
+    for scenario in scenarios(args.users, args.schools, args.lessons, args.challenges, rng):
+        if selected and scenario[0] not in selected:
+            continue
+        results.append(run_scenario(app, client, counter, scenario, args.requests, args.warmup))
+        print(f"{scenario[0]}: p50 {results[-1]['p50_ms']} ms, "
+              f"{results[-1]['queries_per_request']} queries", file=sys.stderr)
+
+    report = {
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'dataset': dataset,
+        'seed_seconds': round(seed_seconds, 2),
+        'parameters': {k: v for k, v in vars(args).items() if k not in ('output', 'compare', 'database')},
+        'results': results
+    }
+
+    if args.compare:
+        compare(report, args.compare)
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+    tmp.cleanup()
+
+
+if __name__ == '__main__':
+    main()
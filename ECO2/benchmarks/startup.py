@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark for EcoLearn.
+
+Measures, in fresh interpreter processes, how long it takes to import
+app.py (after Flask and Flask-SQLAlchemy themselves are imported) and to
+serve the first request. Run from the ECO2 directory:
+
+    python benchmarks/startup.py --runs 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = r'''
+import json, sys, time
+sys.path.insert(0, {root!r})
+start = time.perf_counter()
+import flask, flask_sqlalchemy
+dependencies = time.perf_counter()
+import app as module
+imported = time.perf_counter()
+application = module.create_app() if hasattr(module, 'create_app') else module.app
+created = time.perf_counter()
+client = application.test_client()
+response = client.get('/leaderboard')
+first_request = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps({{'dependencies_ms': (dependencies - start) * 1000,
+                  'import_ms': (imported - dependencies) * 1000,
+                  'create_app_ms': (created - imported) * 1000,
+                  'first_request_ms': (first_request - created) * 1000,
+                  'total_ms': (first_request - start) * 1000}}))
+'''
+
+
+def prepare_database(path):
+    # Tables and sample data exist before timing starts, as in a deployed app
+    env = dict(os.environ, DATABASE_URL='sqlite:///' + path)
+    setup = ("import sys; sys.path.insert(0, %r)\n"
+             "import app as module\n"
+             "if hasattr(module, 'create_app'):\n"
+             "    from database.init_db import init_db, init_sample_data\n"
+             "    with module.create_app().app_context():\n"
+             "        init_db(); init_sample_data()\n") % ROOT
+    subprocess.run([sys.executable, '-c', setup], env=env, cwd=ROOT, check=True, capture_output=True)
+
+
+def run(runs):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'startup.db')
+        prepare_database(path)
+        env = dict(os.environ, DATABASE_URL='sqlite:///' + path)
+        samples = []
+        for _ in range(runs):
+            output = subprocess.run([sys.executable, '-c', PROBE.format(root=ROOT)], env=env, cwd=ROOT,
+                                    check=True, capture_output=True, text=True).stdout
+            samples.append(json.loads(output.strip().splitlines()[-1]))
+
+    return {key: round(statistics.median(s[key] for s in samples), 2)
+            for key in ('dependencies_ms', 'import_ms', 'create_app_ms', 'first_request_ms', 'total_ms')}
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=10, help='Fresh processes to time (median is reported).')
+    args = parser.parse_args()
+    print(json.dumps(dict(run(args.runs), runs=args.runs), indent=2))
@@ -1,6 +1,106 @@
+import multiprocessing
 import os
 
 class Config:
     SECRET_KEY = os.environ.get('SECRET_KEY') or 'ecolearn-super-secret-key'
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///ecolearn.db'
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Production server (gunicorn.conf.py): processes and threads per process
+    WEB_WORKERS = int(os.environ.get('WEB_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+    WEB_THREADS = int(os.environ.get('WEB_THREADS', 4))
+    WEB_TIMEOUT = int(os.environ.get('WEB_TIMEOUT', 30))
+
+    # Database connection pool, per worker process
+    DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+    DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', 10))
+    DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+
+    # SQLite only: wait this long for a lock instead of failing with "database is locked"
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL')
+
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': True
+    }
+
+    # Read replicas for read-only views: comma-separated database URLs, each becoming a 'replica_<n>' bind
+    DATABASE_REPLICA_URLS = [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()]
+    SQLALCHEMY_BINDS = {f'replica_{number}': url for number, url in enumerate(DATABASE_REPLICA_URLS, 1)}
+    # How often a replica is health-checked, and with what query
+    REPLICA_HEALTH_CHECK_SECONDS = int(os.environ.get('REPLICA_HEALTH_CHECK_SECONDS', 10))
+    REPLICA_HEALTH_CHECK_QUERY = os.environ.get('REPLICA_HEALTH_CHECK_QUERY', 'SELECT 1')
+    # After a user writes, their reads stay on the primary this long so they see their own changes
+    READ_YOUR_WRITES_SECONDS = int(os.environ.get('READ_YOUR_WRITES_SECONDS', 5))
+
+    # Seconds before the in-process leaderboard is rebuilt from the database. Between rebuilds it catches up
+    # from the points ledger, so this only bounds how long changes made outside the ledger take
+    LEADERBOARD_REFRESH_SECONDS = int(os.environ.get('LEADERBOARD_REFRESH_SECONDS', 3600))
+    # Catch up at most this often, so ranks may lag new points by this many seconds
+    LEADERBOARD_CATCH_UP_SECONDS = float(os.environ.get('LEADERBOARD_CATCH_UP_SECONDS', 2))
+    # Seconds before the in-process search index is rebuilt, picking up edits made by other processes
+    SEARCH_INDEX_REFRESH_SECONDS = int(os.environ.get('SEARCH_INDEX_REFRESH_SECONDS', 300))
+    # Seconds between checks of the shared content version, after which lesson and quiz edits made by
+    # other processes are picked up
+    CONTENT_VERSION_CHECK_SECONDS = int(os.environ.get('CONTENT_VERSION_CHECK_SECONDS', 5))
+
+    # Progress long-polling (/api/user_progress?wait=1): seconds a request waits for a change, kept under
+    # proxy timeouts, and how many requests per process may wait at once, each holding a worker thread
+    PROGRESS_WAIT_SECONDS = int(os.environ.get('PROGRESS_WAIT_SECONDS', 25))
+    PROGRESS_WAIT_MAX_WAITERS = int(os.environ.get('PROGRESS_WAIT_MAX_WAITERS', max(1, WEB_THREADS // 2)))
+
+    # Password hash method and cost (werkzeug format); older hashes are upgraded on login
+    PASSWORD_HASH_METHOD = os.environ.get('PASSWORD_HASH_METHOD', 'pbkdf2:sha256:600000')
+    # Threads per process that run password hashing
+    PASSWORD_HASH_THREADS = int(os.environ.get('PASSWORD_HASH_THREADS', 4))
+
+    # Login attempts: burst size and refill rate per username, and per client address
+    LOGIN_RATE_LIMIT_BURST = int(os.environ.get('LOGIN_RATE_LIMIT_BURST', 10))
+    LOGIN_RATE_LIMIT_PER_MINUTE = int(os.environ.get('LOGIN_RATE_LIMIT_PER_MINUTE', 5))
+    # Generous, since a whole school may log in from one address
+    LOGIN_CLIENT_RATE_LIMIT_BURST = int(os.environ.get('LOGIN_CLIENT_RATE_LIMIT_BURST', 300))
+    LOGIN_CLIENT_RATE_LIMIT_PER_MINUTE = int(os.environ.get('LOGIN_CLIENT_RATE_LIMIT_PER_MINUTE', 300))
+
+    # Users inserted per batch by the teacher roster import endpoint
+    ROSTER_IMPORT_BATCH_SIZE = int(os.environ.get('ROSTER_IMPORT_BATCH_SIZE', 1000))
+
+    # Server-side sessions: 'sqlite' (a file shared by all workers) or 'memory' (single process only)
+    SESSION_STORE = os.environ.get('SESSION_STORE', 'sqlite')
+    SESSION_STORE_PATH = os.environ.get('SESSION_STORE_PATH')
+    SESSION_LIFETIME_SECONDS = int(os.environ.get('SESSION_LIFETIME_SECONDS', 7 * 24 * 3600))
+
+    # Rendered page cache: 'memory' (per process), 'sqlite' (shared file) or 'none'
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND', 'memory')
+    RESPONSE_CACHE_PATH = os.environ.get('RESPONSE_CACHE_PATH')
+    RESPONSE_CACHE_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 300))
+    RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get('RESPONSE_CACHE_MAX_ENTRIES', 1000))
+    # Seconds browsers and proxies may reuse public pages without revalidating
+    RESPONSE_CACHE_MAX_AGE = int(os.environ.get('RESPONSE_CACHE_MAX_AGE', 60))
+
+    # Most queued offline actions accepted in one POST /api/v1/sync
+    SYNC_MAX_ACTIONS = int(os.environ.get('SYNC_MAX_ACTIONS', 100))
+
+    # Completed lessons and challenges older than this many days are moved to the archive (`flask archive-history`)
+    ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+    # Months in which school terms start; archived history is grouped by term
+    ARCHIVE_TERM_START_MONTHS = [int(month) for month in os.environ.get('ARCHIVE_TERM_START_MONTHS', '1,8').split(',')]
+    # Students whose history is archived per transaction
+    ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 500))
+
+    # Background job workers (`flask run-jobs`): threads, idle poll interval, jobs claimed at a time,
+    # and seconds before a job held by a dead worker is retried
+    JOB_WORKER_THREADS = int(os.environ.get('JOB_WORKER_THREADS', 2))
+    JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1))
+    JOB_BATCH_SIZE = int(os.environ.get('JOB_BATCH_SIZE', 10))
+    JOB_LOCK_TIMEOUT_SECONDS = int(os.environ.get('JOB_LOCK_TIMEOUT_SECONDS', 300))
+
+    # Per-request query/template timing, Server-Timing headers and /metrics
+    INSTRUMENTATION_ENABLED = os.environ.get('INSTRUMENTATION_ENABLED', '').lower() in ('1', 'true', 'yes')
+    # Flag requests that run one statement shape more than this many times ('log' or 'raise')
+    N_PLUS_ONE_THRESHOLD = int(os.environ.get('N_PLUS_ONE_THRESHOLD', 10))
+    N_PLUS_ONE_ACTION = os.environ.get('N_PLUS_ONE_ACTION', 'log')
+    # Bearer token for /metrics; without one they only answer requests from localhost
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
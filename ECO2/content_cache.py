@@ -0,0 +1,88 @@
+"""
+Lesson and quiz content cache for EcoLearn.
+
+Lessons and their quizzes rarely change, so each lesson is loaded once,
+with quiz options already decoded from JSON, and kept together with any
+HTML fragments rendered from it. Entries belong to one content
+``version``, kept in the database by ``SharedVersion``: when it changes,
+whichever process made the edit, every cached entry is dropped.
+"""
+
+import threading
+import time
+
+
+class ContentCache:
+    def __init__(self):
+        self.version = None
+        self._entries = {}
+        # Bumped on every invalidation, so content loaded before one is not stored after it
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, lesson_id, loader, version=None):
+        """Return the cached entry for a lesson, loading it on a miss.
+
+        ``loader(lesson_id)`` returns ``(lesson, questions)`` as plain dicts,
+        or None when the lesson does not exist. A new ``version`` drops every
+        cached entry first.
+        """
+        if version is not None and version != self.version:
+            with self._lock:
+                self._entries.clear()
+                self._generation += 1
+                self.version = version
+        entry = self._entries.get(lesson_id)
+        if entry is None:
+            generation = self._generation
+            loaded = loader(lesson_id)
+            if loaded is None:
+                return None
+            lesson, questions = loaded
+            entry = {'lesson': lesson, 'questions': questions, 'fragments': {}}
+            with self._lock:
+                if generation == self._generation:
+                    self._entries[lesson_id] = entry
+        return entry
+
+    def fragment(self, entry, name, render):
+        """Return a pre-rendered fragment for an entry, rendering it once."""
+        html = entry['fragments'].get(name)
+        if html is None:
+            html = render(entry)
+            entry['fragments'][name] = html
+        return html
+
+    def invalidate(self, lesson_id=None):
+        with self._lock:
+            if lesson_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(lesson_id, None)
+            self._generation += 1
+
+
+class SharedVersion:
+    """A version number kept in the database, read at most every ``check_seconds``.
+
+    Writers bump it in the transaction that changes the content, so caches in
+    every process (web workers, job runners, the CLI) drop what they hold
+    within ``check_seconds`` of an edit made by any of them.
+    """
+
+    def __init__(self, check_seconds=5):
+        self.check_seconds = check_seconds
+        self._value = None
+        self._checked_at = 0.0
+
+    def get(self, read):
+        """The version, calling ``read()`` for it when the last check is too old."""
+        now = time.time()
+        if self._value is None or now - self._checked_at >= self.check_seconds:
+            self._value = read()
+            self._checked_at = now
+        return self._value
+
+    def expire(self):
+        """Read the version again on next use, e.g. after this process committed an edit."""
+        self._value = None
@@ -0,0 +1,111 @@
+"""
+Password hashing and login rate limiting for EcoLearn.
+
+Passwords are hashed with werkzeug's salted hashes. The method string sets
+the cost (e.g. ``pbkdf2:sha256:600000`` or ``scrypt:32768:8:1``), and stored
+hashes made with an older method, or legacy plaintext passwords, are
+reported by ``needs_rehash`` so they can be upgraded on the next login.
+Hashing runs in a small thread pool: hashlib releases the GIL, so this
+caps how many hashes run at once per process and lets batch jobs use
+several cores.
+
+``RateLimiter`` is an in-memory token bucket per key (username or client
+address), checked before any hashing so brute-force traffic is turned
+away cheaply.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+import hmac
+import re
+import threading
+import time
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+_HASHED = re.compile(r'^(pbkdf2:\w+:\d+|scrypt:\d+:\d+:\d+)\$[^$]+\$[0-9a-f]+$')
+
+
+def is_hashed(stored):
+    return bool(stored) and _HASHED.match(stored) is not None
+
+
+class PasswordHasher:
+    """Hashes and verifies passwords with a configurable method and thread pool."""
+
+    def __init__(self, method='pbkdf2:sha256:600000', threads=4):
+        self._pool = None
+        self._lock = threading.Lock()
+        self.configure(method, threads)
+
+    def configure(self, method, threads):
+        with self._lock:
+            # Normalise the method (e.g. 'pbkdf2' -> 'pbkdf2:sha256:600000') to compare against stored hashes
+            self.prefix = generate_password_hash('', method).split('$', 1)[0]
+            self.method = method
+            self.threads = threads
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+                self._pool = None
+
+    def _executor(self):
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='password-hash')
+            return self._pool
+
+    def _hash(self, password):
+        return generate_password_hash(password, self.method)
+
+    def hash(self, password):
+        return self._executor().submit(self._hash, password).result()
+
+    def hash_many(self, passwords):
+        return list(self._executor().map(self._hash, passwords))
+
+    def verify(self, stored, password):
+        """Check ``password`` against a stored hash or legacy plaintext value."""
+        if not stored:
+            return False
+        if not is_hashed(stored):
+            return hmac.compare_digest(stored.encode(), password.encode())
+        return self._executor().submit(check_password_hash, stored, password).result()
+
+    def needs_rehash(self, stored):
+        return not is_hashed(stored) or stored.split('$', 1)[0] != self.prefix
+
+
+class RateLimiter:
+    """Token buckets holding up to ``burst`` tokens, refilled at ``per_minute``."""
+
+    def __init__(self, burst=10, per_minute=5, max_keys=100000):
+        self.burst = burst
+        self.per_minute = per_minute
+        self.max_keys = max_keys
+        self._buckets = {}  # key -> (tokens, updated_at)
+        self._lock = threading.Lock()
+
+    def _refill(self, key, now):
+        tokens, updated = self._buckets.get(key, (self.burst, now))
+        return min(self.burst, tokens + (now - updated) * self.per_minute / 60)
+
+    def consume(self, key):
+        """Take a token for ``key``; returns 0 if allowed, else seconds until the next token."""
+        now = time.monotonic()
+        with self._lock:
+            tokens = self._refill(key, now)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                return (1 - tokens) * 60 / self.per_minute
+            self._buckets[key] = (tokens - 1, now)
+            if len(self._buckets) > self.max_keys:
+                self._prune(now)
+            return 0
+
+    def _prune(self, now):
+        # Buckets that have refilled completely behave like new ones
+        for key in [key for key in self._buckets if self._refill(key, now) >= self.burst]:
+            del self._buckets[key]
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
@@ -0,0 +1,142 @@
+"""
+Schema migrations for EcoLearn.
+
+``db.create_all()`` only creates missing tables, so changes to existing
+tables (indexes, constraints) are applied here instead. Each migration
+runs once, in order, and the applied version is recorded in the
+``schema_version`` table.
+"""
+
+from sqlalchemy import DateTime, inspect, text
+
+
+def _dedupe(conn, table, columns):
+    # Keep the newest row for each key so a unique index can be created
+    key = ', '.join(columns)
+    result = conn.execute(text(
+        f"DELETE FROM {table} WHERE id NOT IN (SELECT MAX(id) FROM {table} GROUP BY {key})"))
+    return result.rowcount
+
+
+def add_lookup_indexes(conn):
+    removed = _dedupe(conn, 'user_progress', ['user_id', 'lesson_id'])
+    removed += _dedupe(conn, 'user_challenge', ['user_id', 'challenge_id'])
+    _dedupe(conn, 'user_badge', ['user_id', 'badge_id'])
+    if removed:
+        # Counters are rebuilt from history on next access
+        conn.execute(text("DELETE FROM user_stats"))
+
+    statements = [
+        'CREATE INDEX IF NOT EXISTS ix_user_type_school ON "user" (user_type, school)',
+        'CREATE INDEX IF NOT EXISTS ix_user_type_points ON "user" (user_type, points)',
+        "CREATE INDEX IF NOT EXISTS ix_lesson_category ON lesson (category)",
+        "CREATE INDEX IF NOT EXISTS ix_quiz_lesson_id ON quiz (lesson_id)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_progress_user_lesson ON user_progress (user_id, lesson_id)",
+        "CREATE INDEX IF NOT EXISTS ix_user_progress_user_completed ON user_progress (user_id, completed)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_challenge_user_challenge ON user_challenge (user_id, challenge_id)",
+        "CREATE INDEX IF NOT EXISTS ix_user_challenge_user_status ON user_challenge (user_id, status)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS uq_user_badge_user_badge ON user_badge (user_id, badge_id)",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+
+
+def seed_points_ledger(conn):
+    # Existing totals become opening balances, and past completions get
+    # zero-point entries so resubmitting them does not pay out again
+    conn.execute(text(
+        "INSERT INTO points_event (user_id, amount, reason, idempotency_key, created_at) "
+        "SELECT id, points, 'opening_balance', 'opening:' || id, CURRENT_TIMESTAMP "
+        'FROM "user" WHERE points IS NOT NULL AND points != 0'))
+    conn.execute(text(
+        "INSERT INTO points_event (user_id, amount, reason, source_id, idempotency_key, created_at) "
+        "SELECT user_id, 0, 'lesson', lesson_id, 'lesson:' || user_id || ':' || lesson_id, CURRENT_TIMESTAMP "
+        "FROM user_progress WHERE completed = TRUE"))
+    conn.execute(text(
+        "INSERT INTO points_event (user_id, amount, reason, source_id, idempotency_key, created_at) "
+        "SELECT user_id, 0, 'challenge', challenge_id, 'challenge:' || user_id || ':' || challenge_id, CURRENT_TIMESTAMP "
+        "FROM user_challenge WHERE status = 'completed'"))
+
+
+def add_updated_at(conn):
+    # Tables created by create_all() already have the column
+    for table, since in (('user_progress', 'completed_at'), ('user_challenge', 'COALESCE(completed_at, started_at)')):
+        if 'updated_at' not in {column['name'] for column in inspect(conn).get_columns(table)}:
+            column_type = DateTime().compile(dialect=conn.dialect)
+            conn.execute(text(f"ALTER TABLE {table} ADD COLUMN updated_at {column_type}"))
+        conn.execute(text(f"UPDATE {table} SET updated_at = COALESCE({since}, CURRENT_TIMESTAMP) "
+                          "WHERE updated_at IS NULL"))
+        conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_{table}_user_updated ON {table} (user_id, updated_at)"))
+
+
+def seed_cache_versions(conn):
+    conn.execute(text("INSERT INTO cache_version (name, version) SELECT 'content', 0 "
+                      "WHERE NOT EXISTS (SELECT 1 FROM cache_version WHERE name = 'content')"))
+
+
+def build_user_stats(conn):
+    # Counters for every user that has none yet, so reads never build them on the fly
+    totals = ("SELECT COALESCE(SUM({column}), 0) FROM archived_history a "
+              "WHERE a.user_id = u.id AND a.kind = '{kind}'")
+    conn.execute(text(
+        "INSERT INTO user_stats (user_id, completed_lessons, score_sum, completed_challenges) "
+        "SELECT u.id, "
+        "(SELECT COUNT(*) FROM user_progress p WHERE p.user_id = u.id AND p.completed = TRUE) "
+        f"+ ({totals.format(column='completions', kind='lesson')}), "
+        "(SELECT COALESCE(SUM(p.score), 0) FROM user_progress p WHERE p.user_id = u.id AND p.completed = TRUE) "
+        f"+ ({totals.format(column='score_sum', kind='lesson')}), "
+        "(SELECT COUNT(*) FROM user_challenge c WHERE c.user_id = u.id AND c.status = 'completed') "
+        f"+ ({totals.format(column='completions', kind='challenge')}) "
+        'FROM "user" u WHERE NOT EXISTS (SELECT 1 FROM user_stats s WHERE s.user_id = u.id)'))
+
+
+# (version, description, function) in the order they must be applied
+MIGRATIONS = [
+    (1, 'Indexes and unique constraints for hot lookups', add_lookup_indexes),
+    (2, 'Seed the points ledger from existing totals', seed_points_ledger),
+    (3, 'Track when progress and challenge rows change, for offline sync', add_updated_at),
+    (4, 'Shared version of cached lesson and quiz content', seed_cache_versions),
+    (5, 'Progress counters for existing users', build_user_stats),
+]
+
+
+def current_version(conn):
+    conn.execute(text("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)"))
+    version = conn.execute(text("SELECT MAX(version) FROM schema_version")).scalar()
+    return version or 0
+
+
+def upgrade(engine):
+    """Apply pending migrations, returning the descriptions of those applied."""
+    applied = []
+    with engine.begin() as conn:
+        version = current_version(conn)
+        for number, description, migrate in MIGRATIONS:
+            if number <= version:
+                continue
+            migrate(conn)
+            conn.execute(text("INSERT INTO schema_version (version) VALUES (:version)"), {'version': number})
+            applied.append(f"{number}: {description}")
+    return applied
+
+
+# Hot queries and the index each one is expected to use
+KEY_QUERIES = [
+    ("SELECT * FROM user_progress WHERE user_id = 1 AND lesson_id = 1", 'uq_user_progress_user_lesson'),
+    ("SELECT COUNT(*) FROM user_progress WHERE user_id = 1 AND completed = TRUE", 'ix_user_progress_user_completed'),
+    ("SELECT * FROM user_challenge WHERE user_id = 1 AND challenge_id = 1", 'uq_user_challenge_user_challenge'),
+    ("SELECT COUNT(*) FROM user_challenge WHERE user_id = 1 AND status = 'completed'", 'ix_user_challenge_user_status'),
+    ("""SELECT * FROM "user" WHERE user_type = 'student' AND school = 'A'""", 'ix_user_type_school'),
+    ("""SELECT * FROM "user" WHERE user_type = 'student' ORDER BY points DESC LIMIT 20""", 'ix_user_type_points'),
+    ("SELECT * FROM quiz WHERE lesson_id = 1", 'ix_quiz_lesson_id'),
+]
+
+
+def check_query_plans(engine):
+    """Run EXPLAIN QUERY PLAN on the key queries; returns (query, index, plan, ok) tuples."""
+    results = []
+    with engine.connect() as conn:
+        for query, index in KEY_QUERIES:
+            plan = ' | '.join(row[-1] for row in conn.execute(text(f"EXPLAIN QUERY PLAN {query}")))
+            results.append((query, index, plan, index in plan))
+    return results
@@ -0,0 +1,191 @@
+"""
+Read replica routing for EcoLearn.
+
+Replicas are Flask-SQLAlchemy binds named ``replica_<n>``, configured
+with DATABASE_REPLICA_URLS. Views decorated with ``@read_only`` send their
+SELECTs to one replica, picked round-robin among the healthy ones and
+kept for the whole request. Writes, and every other view, use the
+primary.
+
+A replica is health-checked at most every ``check_seconds`` when it is
+picked. One that fails the check, or raises a connection error, is
+skipped until it passes again. When no replica is healthy, reads fall
+back to the primary.
+
+Users read their own writes. A request that commits changes keeps that
+user's reads on the primary for ``read_your_writes_seconds``, which
+gives replicas time to catch up. Code that fills a cache shared by later
+requests runs under ``primary()``, so replica lag never gets cached.
+"""
+
+from contextlib import contextmanager
+from functools import wraps
+import logging
+import sqlite3
+import threading
+import time
+
+from flask import g, has_request_context, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.exc import SQLAlchemyError
+
+logger = logging.getLogger(__name__)
+
+REPLICA_PREFIX = 'replica_'
+
+
+class ReplicaPool:
+    """Round-robin choice among healthy replica engines."""
+
+    def __init__(self):
+        self.engines = {}  # bind name -> engine
+        self.check_seconds = 10
+        self.check_query = 'SELECT 1'
+        self.read_your_writes_seconds = 5
+        self._names = []
+        self._next = 0
+        self._health = {}  # bind name -> (healthy, checked_at)
+        self._lock = threading.Lock()
+
+    def configure(self, engines, check_seconds, check_query, read_your_writes_seconds):
+        self.engines = engines
+        self.check_seconds = check_seconds
+        self.check_query = check_query
+        self.read_your_writes_seconds = read_your_writes_seconds
+        self._names = sorted(engines)
+        self._health = {}
+
+    def pick(self):
+        """The next healthy replica engine, or None to use the primary."""
+        for _ in range(len(self._names)):
+            with self._lock:
+                name = self._names[self._next % len(self._names)]
+                self._next += 1
+            if self.is_healthy(name):
+                return self.engines[name]
+        return None
+
+    def is_healthy(self, name):
+        status = self._health.get(name)
+        if status is not None and time.time() - status[1] < self.check_seconds:
+            return status[0]
+        try:
+            with self.engines[name].connect() as conn:
+                conn.execute(text(self.check_query))
+            healthy = True
+        except SQLAlchemyError as e:
+            logger.warning("Replica %s failed its health check: %s", name, e)
+            healthy = False
+        if status is not None and status[0] != healthy:
+            logger.warning("Replica %s is %s", name, 'healthy again' if healthy else 'unhealthy')
+        self._health[name] = (healthy, time.time())
+        return healthy
+
+    def mark_failed(self, name):
+        self._health[name] = (False, time.time())
+
+    def status(self):
+        """{bind name: healthy or None if not checked yet}, for diagnostics."""
+        return {name: self._health.get(name, (None,))[0] for name in self._names}
+
+
+replicas = ReplicaPool()
+
+
+def read_only(view):
+    """Let a view read from a replica; its writes still go to the primary."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        g.db_read_only = True
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def primary():
+    """Run the enclosed queries on the primary; also usable as a decorator."""
+    if not has_request_context():
+        yield
+        return
+    depth = g.get('db_primary_depth', 0)
+    g.db_primary_depth = depth + 1
+    try:
+        yield
+    finally:
+        g.db_primary_depth = depth
+
+
+def _replica_for_request():
+    if not replicas.engines or not has_request_context() or not g.get('db_read_only') \
+            or g.get('db_primary_depth'):
+        return None
+    if 'db_replica' not in g:
+        recent_write = session.get('_primary_until', 0) > time.time()
+        g.db_replica = None if recent_write else replicas.pick()
+    return g.db_replica
+
+
+class RoutingSession(Session):
+    """Sends SELECTs in read-only views to a replica, once nothing has been written in the request."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and not self._flushing and getattr(clause, 'is_select', False) \
+                and getattr(clause, '_for_update_arg', None) is None and not self.info.get('wrote'):
+            engine = _replica_for_request()
+            if engine is not None:
+                return engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+@event.listens_for(RoutingSession, 'after_flush')
+def _note_write(db_session, flush_context):
+    # Later reads in this request must see the write, so they use the primary
+    db_session.info['wrote'] = True
+
+
+@event.listens_for(RoutingSession, 'after_commit')
+def _keep_writer_on_primary(db_session):
+    if db_session.info.get('wrote') and replicas.engines and has_request_context() and 'user_id' in session:
+        session['_primary_until'] = time.time() + replicas.read_your_writes_seconds
+
+
+def sync_sqlite_replicas(primary_engine, replica_engines):
+    """Copy a SQLite primary over each SQLite replica file, for local testing; returns the paths written."""
+    if primary_engine.url.get_backend_name() != 'sqlite':
+        raise ValueError("Replica sync only works with a SQLite primary")
+    written = []
+    raw = primary_engine.raw_connection()
+    try:
+        for name, engine in sorted(replica_engines.items()):
+            path = engine.url.database or ''
+            if engine.url.get_backend_name() != 'sqlite' or path in ('', ':memory:'):
+                continue
+            path = path[len('file:'):] if path.startswith('file:') else path
+            target = sqlite3.connect(path)
+            try:
+                raw.driver_connection.backup(target)
+            finally:
+                target.close()
+            written.append(path)
+    finally:
+        raw.close()
+    return written
+
+
+def init_app(app, db):
+    """Set up the replica pool from the ``replica_*`` binds."""
+    with app.app_context():
+        engines = {name: engine for name, engine in db.engines.items()
+                   if name and name.startswith(REPLICA_PREFIX)}
+
+    for name, engine in engines.items():
+        def on_error(context, name=name):
+            # Stop routing to a replica that lost its connection until it passes a health check
+            if context.is_disconnect or isinstance(context.original_exception, sqlite3.OperationalError):
+                replicas.mark_failed(name)
+        event.listen(engine, 'handle_error', on_error)
+
+    replicas.configure(engines, app.config.get('REPLICA_HEALTH_CHECK_SECONDS', 10),
+                       app.config.get('REPLICA_HEALTH_CHECK_QUERY', 'SELECT 1'),
+                       app.config.get('READ_YOUR_WRITES_SECONDS', 5))
@@ -0,0 +1,71 @@
+"""
+Quiz grading for EcoLearn.
+
+Answer keys are loaded once per lesson and kept in memory until the
+lesson or one of its quizzes changes. Edits committed by other processes
+are noticed through the shared content version passed to ``get``.
+"""
+
+import threading
+
+
+class AnswerKeyCache:
+    """Per-lesson answer keys: lesson_id -> (points_reward, {quiz_id: correct_answer})."""
+
+    def __init__(self):
+        self.version = None
+        self._keys = {}
+        # Bumped on every invalidation, so a key loaded before one is not stored after it
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def get(self, lesson_id, loader, version=None):
+        """The lesson's answer key, loading it on a miss; a new ``version`` drops every cached key."""
+        if version is not None and version != self.version:
+            with self._lock:
+                self._keys.clear()
+                self._generation += 1
+                self.version = version
+        key = self._keys.get(lesson_id)
+        if key is None:
+            generation = self._generation
+            key = loader(lesson_id)
+            if key is None:
+                return None
+            with self._lock:
+                if generation == self._generation:
+                    self._keys[lesson_id] = key
+        return key
+
+    def invalidate(self, lesson_id=None):
+        with self._lock:
+            if lesson_id is None:
+                self._keys.clear()
+            else:
+                self._keys.pop(lesson_id, None)
+            self._generation += 1
+
+
+def parse_answers(answers):
+    """Submitted answers as {quiz_id: answer} integers; raises ValueError if any key or value is not one."""
+    if not isinstance(answers, dict):
+        raise ValueError('answers must be an object')
+    parsed = {}
+    for quiz_id, answer in answers.items():
+        if isinstance(answer, bool):
+            raise ValueError('answers must map quiz ids to integers')
+        try:
+            parsed[int(quiz_id)] = int(answer)
+        except (TypeError, ValueError):
+            raise ValueError('answers must map quiz ids to integers')
+    return parsed
+
+
+def grade(correct_answers, answers):
+    """Grade submitted {quiz_id: answer} pairs in one pass, returning (score, total)."""
+    score = 0
+    for quiz_id, answer in answers.items():
+        correct = correct_answers.get(int(quiz_id))
+        if correct is not None and int(answer) == correct:
+            score += 1
+    return score, len(answers)
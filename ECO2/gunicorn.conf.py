@@ -0,0 +1,27 @@
+"""
+Gunicorn settings for EcoLearn, driven by Config in config.py.
+
+Workers are forked processes, each serving WEB_THREADS requests at a
+time. The app is loaded once in the master before forking so workers
+start quickly; each worker then opens its own database connections.
+"""
+
+import os
+
+from config import Config
+
+bind = '0.0.0.0:' + os.environ.get('PORT', '8000')
+workers = Config.WEB_WORKERS
+threads = Config.WEB_THREADS
+worker_class = 'gthread'
+timeout = Config.WEB_TIMEOUT
+preload_app = True
+accesslog = '-'
+
+
+def post_fork(server, worker):
+    # Connections opened in the master must not be shared with forked workers
+    from wsgi import app
+    from models import db
+    with app.app_context():
+        db.engine.dispose()
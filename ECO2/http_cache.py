@@ -0,0 +1,209 @@
+"""
+HTTP caching for EcoLearn.
+
+``ResponseCache`` stores rendered pages under a key built from the route,
+a content version and whatever varies per visitor. Every cached page gets
+a strong ETag, so a repeat visit with ``If-None-Match`` is a 304. Views
+pick the key and this module handles storage, ETags and Cache-Control.
+Two backends are available:
+
+- ``memory``: an LRU with TTL in each worker process (the default)
+- ``sqlite``: a local SQLite file shared by all workers on the host
+
+Content versions are counters kept in each process, so the TTL bounds how
+stale a page can be when another process changed the data.
+
+Static files are fingerprinted: ``url_for('static', ...)`` adds a
+``?v=<content hash>`` argument, and fingerprinted requests are served
+with a far-future, immutable Cache-Control.
+"""
+
+from collections import OrderedDict
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+from flask import Response, request, session
+
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expires, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            if item[0] < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return item[1]
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class SQLiteBackend:
+    """Entries in a local SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path, max_entries=1000, ttl=300):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS response_cache ("
+                         "key TEXT PRIMARY KEY, etag TEXT, mimetype TEXT, body BLOB, expires REAL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key):
+        row = self._connect().execute(
+            "SELECT etag, mimetype, body FROM response_cache WHERE key = ? AND expires >= ?",
+            (key, time.time())).fetchone()
+        return (row[0], row[1], bytes(row[2])) if row else None
+
+    def set(self, key, value):
+        etag, mimetype, body = value
+        with self._connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO response_cache VALUES (?, ?, ?, ?, ?)",
+                         (key, etag, mimetype, body, time.time() + self.ttl))
+            self._writes += 1
+            if self._writes % 100 == 0:
+                # Drop expired entries, then the soonest to expire beyond the size limit
+                conn.execute("DELETE FROM response_cache WHERE expires < ?", (time.time(),))
+                conn.execute("DELETE FROM response_cache WHERE key IN (SELECT key FROM response_cache "
+                             "ORDER BY expires DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def clear(self):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM response_cache")
+
+
+class ResponseCache:
+    def __init__(self):
+        self.backend = None
+        self.max_age = 60
+
+    def configure(self, backend, max_age):
+        self.backend = backend
+        self.max_age = max_age
+
+    def respond(self, key, render):
+        """Return the cached response for ``key``, or call ``render()`` and cache a 200 result."""
+        # Pages showing flash messages are one-off, so they skip caching entirely
+        if session.get('_flashes'):
+            return render()
+
+        entry = self.backend.get(key) if self.backend is not None else None
+        if entry is None:
+            response = render()
+            if not isinstance(response, Response):
+                response = Response(response)
+            if response.status_code != 200 or response.direct_passthrough:
+                return response
+            body = response.get_data()
+            entry = (hashlib.sha256(body).hexdigest()[:32], response.mimetype, body)
+            if self.backend is not None:
+                self.backend.set(key, entry)
+        else:
+            response = Response(entry[2], mimetype=entry[1])
+
+        response.set_etag(entry[0])
+        if 'user_id' not in session:
+            response.headers['Cache-Control'] = f'public, max-age={self.max_age}'
+        else:
+            # Personalised pages are always revalidated, which costs a 304 at most
+            response.headers['Cache-Control'] = 'private, no-cache'
+        return response.make_conditional(request)
+
+    def clear(self):
+        if self.backend is not None:
+            self.backend.clear()
+
+
+response_cache = ResponseCache()
+
+
+def cache_key(*parts):
+    return '|'.join(str(part) for part in (request.full_path,) + parts)
+
+
+class StaticFingerprints:
+    def __init__(self, folder):
+        self.folder = folder
+        self._hashes = {}  # filename -> (mtime, hash)
+        self._lock = threading.Lock()
+
+    def get(self, filename):
+        path = os.path.join(self.folder, filename)
+        try:
+            mtime = os.stat(path).st_mtime
+        except OSError:
+            return None
+        cached = self._hashes.get(filename)
+        if cached and cached[0] == mtime:
+            return cached[1]
+        with open(path, 'rb') as f:
+            digest = hashlib.md5(f.read()).hexdigest()[:12]
+        with self._lock:
+            self._hashes[filename] = (mtime, digest)
+        return digest
+
+
+def init_app(app):
+    """Configure the response cache backend and static file fingerprinting."""
+    kind = app.config.get('RESPONSE_CACHE_BACKEND', 'memory')
+    ttl = app.config.get('RESPONSE_CACHE_TTL', 300)
+    max_entries = app.config.get('RESPONSE_CACHE_MAX_ENTRIES', 1000)
+    if kind == 'memory':
+        backend = MemoryBackend(max_entries, ttl)
+    elif kind == 'sqlite':
+        path = app.config.get('RESPONSE_CACHE_PATH') or os.path.join(app.instance_path, 'response_cache.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        backend = SQLiteBackend(path, max_entries, ttl)
+    elif kind in ('none', ''):
+        backend = None
+    else:
+        raise ValueError(f"Unknown RESPONSE_CACHE_BACKEND: {kind}")
+    response_cache.configure(backend, app.config.get('RESPONSE_CACHE_MAX_AGE', 60))
+
+    fingerprints = StaticFingerprints(app.static_folder)
+
+    @app.url_defaults
+    def fingerprint_static(endpoint, values):
+        if endpoint == 'static' and 'filename' in values and 'v' not in values:
+            digest = fingerprints.get(values['filename'])
+            if digest:
+                values['v'] = digest
+
+    @app.after_request
+    def cache_static(response):
+        # The URL changes whenever the file does, so fingerprinted files never need revalidating
+        if request.endpoint == 'static' and request.args.get('v') and response.status_code in (200, 304):
+            response.headers['Cache-Control'] = f'public, max-age={STATIC_MAX_AGE}, immutable'
+        return response
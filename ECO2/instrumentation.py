@@ -0,0 +1,226 @@
+"""
+Opt-in request instrumentation for EcoLearn.
+
+When ``INSTRUMENTATION_ENABLED`` is set, every request records its query
+count, database time, template render time and slowest statements. The
+totals are reported in a ``Server-Timing`` response header and kept per
+endpoint for the ``/metrics`` (Prometheus text format) and
+``/metrics/slow_statements`` endpoints, which answer requests bearing
+``METRICS_TOKEN`` or, when no token is set, only local ones. A request
+that runs the same
+statement shape more than ``N_PLUS_ONE_THRESHOLD`` times is logged, or
+fails with NPlusOneError when ``N_PLUS_ONE_ACTION`` is ``'raise'`` (useful
+in tests).
+"""
+
+import hmac
+import re
+import threading
+import time
+
+from flask import Response, abort, before_render_template, g, has_request_context, jsonify, request, \
+    template_rendered
+from sqlalchemy import event
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+_IN_LIST = re.compile(r'IN \((?:\?|%\(\w+\)s|:\w+)(?:, (?:\?|%\(\w+\)s|:\w+))*\)')
+_NUMBER = re.compile(r'\b\d+\b')
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_SPACE = re.compile(r'\s+')
+
+LOCAL_ADDRESSES = ('127.0.0.1', '::1')
+
+
+class NPlusOneError(Exception):
+    """Raised when a request repeats one statement shape too many times."""
+
+
+def statement_shape(statement):
+    """Normalize SQL so queries that differ only in literals compare equal."""
+    shape = _SPACE.sub(' ', statement).strip()
+    shape = _STRING.sub('?', shape)
+    shape = _NUMBER.sub('?', shape)
+    return _IN_LIST.sub('IN (?)', shape)
+
+
+def metrics_allowed(token):
+    """Whether this request may read metrics: a matching bearer token, or a local client if none is set."""
+    if not token:
+        return request.remote_addr in LOCAL_ADDRESSES
+    scheme, _, supplied = request.headers.get('Authorization', '').partition(' ')
+    return scheme.lower() == 'bearer' and hmac.compare_digest(supplied.strip().encode(), token.encode())
+
+
+class EndpointStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.duration = 0.0
+        self.db_time = 0.0
+        self.queries = 0
+        self.template_time = 0.0
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.slowest = []  # (seconds, statement), slowest first
+
+
+class Metrics:
+    def __init__(self, keep_slowest=5):
+        self.keep_slowest = keep_slowest
+        self._endpoints = {}
+        self._lock = threading.Lock()
+
+    def record(self, endpoint, status, duration, db_time, queries, template_time, slowest):
+        with self._lock:
+            stats = self._endpoints.setdefault(endpoint, EndpointStats())
+            stats.requests += 1
+            stats.errors += status >= 500
+            stats.duration += duration
+            stats.db_time += db_time
+            stats.queries += queries
+            stats.template_time += template_time
+            for i, bound in enumerate(DURATION_BUCKETS):
+                if duration <= bound:
+                    stats.buckets[i] += 1
+            merged = sorted(stats.slowest + slowest, key=lambda item: item[0], reverse=True)
+            stats.slowest = merged[:self.keep_slowest]
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+    def prometheus(self):
+        lines = []
+
+        def family(name, kind, help_text, values):
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            lines.extend(values)
+
+        with self._lock:
+            items = sorted(self._endpoints.items())
+            label = lambda endpoint: f'endpoint="{endpoint}"'
+
+            family('ecolearn_requests_total', 'counter', 'Requests handled.',
+                   [f'ecolearn_requests_total{{{label(e)}}} {s.requests}' for e, s in items])
+            family('ecolearn_request_errors_total', 'counter', 'Requests that returned a 5xx status.',
+                   [f'ecolearn_request_errors_total{{{label(e)}}} {s.errors}' for e, s in items])
+            family('ecolearn_db_queries_total', 'counter', 'SQL statements executed.',
+                   [f'ecolearn_db_queries_total{{{label(e)}}} {s.queries}' for e, s in items])
+            family('ecolearn_db_seconds_total', 'counter', 'Time spent executing SQL.',
+                   [f'ecolearn_db_seconds_total{{{label(e)}}} {s.db_time:.6f}' for e, s in items])
+            family('ecolearn_template_seconds_total', 'counter', 'Time spent rendering templates.',
+                   [f'ecolearn_template_seconds_total{{{label(e)}}} {s.template_time:.6f}' for e, s in items])
+
+            histogram = []
+            for endpoint, stats in items:
+                for bound, count in zip(DURATION_BUCKETS, stats.buckets):
+                    histogram.append(f'ecolearn_request_duration_seconds_bucket{{{label(endpoint)},le="{bound}"}} {count}')
+                histogram.append(f'ecolearn_request_duration_seconds_bucket{{{label(endpoint)},le="+Inf"}} {stats.requests}')
+                histogram.append(f'ecolearn_request_duration_seconds_sum{{{label(endpoint)}}} {stats.duration:.6f}')
+                histogram.append(f'ecolearn_request_duration_seconds_count{{{label(endpoint)}}} {stats.requests}')
+            family('ecolearn_request_duration_seconds', 'histogram', 'Request duration.', histogram)
+
+        return '\n'.join(lines) + '\n'
+
+    def slow_statements(self):
+        with self._lock:
+            return {endpoint: [{'seconds': round(seconds, 6), 'statement': statement}
+                               for seconds, statement in stats.slowest]
+                    for endpoint, stats in self._endpoints.items()}
+
+
+metrics = Metrics()
+
+
+def init_app(app, db):
+    """Install instrumentation hooks if INSTRUMENTATION_ENABLED is set."""
+    if not app.config.get('INSTRUMENTATION_ENABLED'):
+        return
+
+    threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 10)
+    action = app.config.get('N_PLUS_ONE_ACTION', 'log')
+    token = app.config.get('METRICS_TOKEN')
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'instrument_started' in g:
+            g.instrument_query_started = time.perf_counter()
+
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if not has_request_context():
+            return
+        started = g.pop('instrument_query_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        g.instrument_queries += 1
+        g.instrument_db_time += elapsed
+        g.instrument_statements.append((elapsed, statement))
+
+    with app.app_context():
+        for engine in db.engines.values():
+            event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+            event.listen(engine, 'after_cursor_execute', after_cursor_execute)
+
+    def template_started(sender, template, context, **extra):
+        if 'instrument_started' in g:
+            g.instrument_template_started = time.perf_counter()
+
+    def template_finished(sender, template, context, **extra):
+        started = g.pop('instrument_template_started', None)
+        if started is not None:
+            g.instrument_template_time += time.perf_counter() - started
+
+    before_render_template.connect(template_started, app, weak=False)
+    template_rendered.connect(template_finished, app, weak=False)
+
+    @app.before_request
+    def start_instrumentation():
+        g.instrument_started = time.perf_counter()
+        g.instrument_queries = 0
+        g.instrument_db_time = 0.0
+        g.instrument_template_time = 0.0
+        g.instrument_statements = []
+
+    @app.after_request
+    def finish_instrumentation(response):
+        if 'instrument_started' not in g or request.endpoint in ('metrics', 'slow_statements'):
+            return response
+        duration = time.perf_counter() - g.instrument_started
+        endpoint = request.endpoint or 'unknown'
+
+        shapes = {}
+        for _, statement in g.instrument_statements:
+            shape = statement_shape(statement)
+            shapes[shape] = shapes.get(shape, 0) + 1
+        repeated = {shape: count for shape, count in shapes.items() if count > threshold}
+
+        slowest = sorted(g.instrument_statements, key=lambda item: item[0], reverse=True)[:metrics.keep_slowest]
+        metrics.record(endpoint, response.status_code, duration, g.instrument_db_time, g.instrument_queries,
+                       g.instrument_template_time, slowest)
+
+        response.headers['Server-Timing'] = ', '.join([
+            f'db;dur={g.instrument_db_time * 1000:.2f};desc="{g.instrument_queries} queries"',
+            f'tpl;dur={g.instrument_template_time * 1000:.2f}',
+            f'total;dur={duration * 1000:.2f}'
+        ])
+
+        for shape, count in repeated.items():
+            message = f'Possible N+1 in {endpoint}: statement ran {count} times: {shape}'
+            if action == 'raise':
+                raise NPlusOneError(message)
+            app.logger.warning(message)
+
+        return response
+
+    @app.route('/metrics', endpoint='metrics')
+    def metrics_endpoint():
+        if not metrics_allowed(token):
+            abort(403)
+        return Response(metrics.prometheus(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/metrics/slow_statements')
+    def slow_statements():
+        if not metrics_allowed(token):
+            abort(403)
+        return jsonify(metrics.slow_statements())
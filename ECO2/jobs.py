@@ -0,0 +1,170 @@
+"""
+Background jobs for EcoLearn.
+
+Handlers commit the core fact of a request (progress, points) and
+``enqueue`` follow-up work in the same transaction. The job is stored
+only if that commit succeeds, and the request doesn't wait for the work.
+``flask run-jobs`` workers claim due jobs and run them. A job that raises
+is retried with exponential backoff up to ``max_attempts`` times, then
+marked failed. Jobs with the same ``dedupe_key`` are merged while
+queued (not once a worker has started one). Tests call ``drain()`` to
+run everything that is due, in process.
+
+Successful jobs are deleted, so the table only holds pending and failed
+work.
+"""
+
+from datetime import datetime, timedelta
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import traceback
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, Job
+
+logger = logging.getLogger(__name__)
+
+# name -> function taking the job payload as keyword arguments
+TASKS = {}
+
+
+def task(name):
+    """Register a function as the handler for jobs called ``name``."""
+    def register(func):
+        TASKS[name] = func
+        return func
+    return register
+
+
+def enqueue(name, dedupe_key=None, delay=0, max_attempts=5, **payload):
+    """Add a job to the current transaction; returns False if a queued job has the same dedupe_key."""
+    if name not in TASKS:
+        raise KeyError(f"Unknown job: {name}")
+    values = {
+        'name': name,
+        'payload': json.dumps(payload),
+        'dedupe_key': dedupe_key,
+        'status': 'queued',
+        'attempts': 0,
+        'max_attempts': max_attempts,
+        'run_at': datetime.utcnow() + timedelta(seconds=delay),
+        'created_at': datetime.utcnow()
+    }
+    dialect = db.session.get_bind().dialect.name
+    if dedupe_key and dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(Job).values(**values).on_conflict_do_nothing(index_elements=['dedupe_key'])
+        return db.session.execute(statement).rowcount == 1
+
+    if dedupe_key and Job.query.filter_by(dedupe_key=dedupe_key).first():
+        return False
+    db.session.add(Job(**values))
+    return True
+
+
+def claim(worker, limit=10):
+    """Mark up to ``limit`` due jobs as running by ``worker`` and return their ids."""
+    now = datetime.utcnow()
+    candidates = db.session.query(Job.id).filter(Job.status == 'queued', Job.run_at <= now) \
+        .order_by(Job.run_at, Job.id).limit(limit).all()
+    claimed = []
+    for (job_id,) in candidates:
+        # Only one worker wins the status change, without needing row locks. The dedupe key is
+        # released, so work requested while this job runs queues a fresh job instead of being lost.
+        won = Job.query.filter_by(id=job_id, status='queued').update(
+            {Job.status: 'running', Job.locked_by: worker, Job.locked_at: now, Job.attempts: Job.attempts + 1,
+             Job.dedupe_key: None},
+            synchronize_session=False)
+        if won:
+            claimed.append(job_id)
+    db.session.commit()
+    return claimed
+
+
+def release_stale(lock_timeout):
+    """Requeue jobs whose worker died while running them."""
+    cutoff = datetime.utcnow() - timedelta(seconds=lock_timeout)
+    released = Job.query.filter(Job.status == 'running', Job.locked_at < cutoff).update(
+        {Job.status: 'queued', Job.locked_by: None, Job.locked_at: None}, synchronize_session=False)
+    db.session.commit()
+    return released
+
+
+def run_job(job_id):
+    """Run a claimed job; returns True if it succeeded."""
+    job = db.session.get(Job, job_id)
+    if job is None:
+        return False
+    name, payload, attempts, max_attempts = job.name, json.loads(job.payload), job.attempts, job.max_attempts
+    try:
+        TASKS[name](**payload)
+        # The job's own writes and its removal commit together
+        db.session.delete(job)
+        db.session.commit()
+        return True
+    except Exception as e:
+        db.session.rollback()
+        failed = attempts >= max_attempts
+        logger.warning("Job %s (%s) attempt %s/%s failed: %s", job_id, name, attempts, max_attempts, e)
+        Job.query.filter_by(id=job_id).update({
+            Job.status: 'failed' if failed else 'queued',
+            Job.run_at: datetime.utcnow() + timedelta(seconds=2 ** attempts),
+            Job.locked_by: None,
+            Job.locked_at: None,
+            Job.last_error: traceback.format_exc(limit=5)
+        }, synchronize_session=False)
+        db.session.commit()
+        return False
+
+
+def work(worker, batch_size=10):
+    """Claim and run one batch of due jobs; returns how many were run."""
+    job_ids = claim(worker, batch_size)
+    for job_id in job_ids:
+        run_job(job_id)
+    return len(job_ids)
+
+
+def drain(batch_size=100):
+    """Run due jobs in this process until none are left, e.g. in tests; returns how many ran."""
+    worker = f'drain-{os.getpid()}'
+    ran = 0
+    while True:
+        count = work(worker, batch_size)
+        if not count:
+            return ran
+        ran += count
+
+
+def run_workers(app, threads=2, poll_seconds=1.0, batch_size=10, lock_timeout=300, drain_only=False, stop=None):
+    """Run ``threads`` worker loops until ``stop`` is set, or until the queue is empty with ``drain_only``."""
+    stop = stop or threading.Event()
+
+    def loop(number):
+        worker = f'{socket.gethostname()}-{os.getpid()}-{number}'
+        with app.app_context():
+            while not stop.is_set():
+                if number == 0:
+                    release_stale(lock_timeout)
+                if not work(worker, batch_size):
+                    if drain_only:
+                        return
+                    stop.wait(poll_seconds)
+                db.session.remove()
+
+    workers = [threading.Thread(target=loop, args=(number,), name=f'job-worker-{number}', daemon=True)
+               for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    try:
+        while any(thread.is_alive() for thread in workers):
+            time.sleep(0.2)
+    except KeyboardInterrupt:
+        stop.set()
+        for thread in workers:
+            thread.join()
@@ -0,0 +1,220 @@
+"""
+In-process leaderboard for EcoLearn.
+
+Keeps student and school rankings sorted as points are awarded so the
+leaderboard page and "my rank" lookups never need a full table sort.
+
+Every process keeps its own copy and catches up from the database at
+most every ``catch_up_seconds``. It picks up students registered since
+then and points ledger events it has not applied. That is two indexed
+range scans, usually returning nothing, so every worker ranks the same
+committed points whichever worker awarded them.
+
+Ledger ids are not committed in order: on PostgreSQL a transaction can
+commit a lower id after a higher one was read. Ids skipped over are kept
+as gaps for ``gap_seconds`` and read again by each catch-up, and events
+are applied once by id. The full rebuild every ``refresh_seconds`` only
+corrects changes made outside the ledger, such as ``rebuild-points``.
+"""
+
+from bisect import bisect_left, bisect_right, insort
+import threading
+import time
+
+
+class Leaderboard:
+    """Sorted student and school rankings, updated on the write path."""
+
+    def __init__(self, refresh_seconds=300, catch_up_seconds=2, gap_seconds=60):
+        self.refresh_seconds = refresh_seconds
+        self.catch_up_seconds = catch_up_seconds
+        self.gap_seconds = gap_seconds
+        self.loaded_at = None
+        self.caught_up_at = None
+        # Newest points ledger event and student id reflected in the rankings
+        self.last_event_id = 0
+        self.last_user_id = 0
+        # Ledger ids below last_event_id not seen yet, as id -> time first missed
+        self._gaps = {}
+        # Bumped on every change, so rendered pages can be cached per version
+        self.version = 0
+        self._lock = threading.RLock()
+        self._clear()
+
+    def _clear(self):
+        # user_id -> (username, school, points)
+        self._students = {}
+        # Sorted list of (-points, user_id) so the best student comes first
+        self._ranking = []
+        # school -> sorted list of (-points, user_id)
+        self._school_members = {}
+        # school -> total points, plus a sorted list of (-total, school)
+        self._school_totals = {}
+        self._school_ranking = []
+
+    def invalidate(self):
+        """Force a rebuild on the next read, e.g. after a bulk import."""
+        self.loaded_at = None
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return self.refresh_seconds and time.time() - self.loaded_at > self.refresh_seconds
+
+    def needs_catch_up(self):
+        return self.caught_up_at is None or time.time() - self.caught_up_at >= self.catch_up_seconds
+
+    def catch_up_soon(self):
+        """Catch up on the next read, e.g. after this process awarded points."""
+        self.caught_up_at = None
+
+    def catch_up_after(self):
+        """Ledger id a catch-up reads events after: the oldest open gap, else the last event applied."""
+        with self._lock:
+            return min(self._gaps) - 1 if self._gaps else self.last_event_id
+
+    def load(self, rows, last_event_id=0, gaps=()):
+        """Rebuild from (user_id, username, school, points) rows.
+
+        Their points include ledger events up to ``last_event_id``, except the
+        ``gaps``: ids not committed yet, applied by a later catch-up.
+        """
+        with self._lock:
+            self._clear()
+            self.last_event_id = last_event_id
+            self._gaps = dict.fromkeys(gaps, time.time())
+            for user_id, username, school, points in rows:
+                self._students[user_id] = (username, school or '', points or 0)
+            self._ranking = sorted((-s[2], uid) for uid, s in self._students.items())
+            for uid, (username, school, points) in self._students.items():
+                if school:
+                    self._school_members.setdefault(school, []).append((-points, uid))
+                    self._school_totals[school] = self._school_totals.get(school, 0) + points
+            for members in self._school_members.values():
+                members.sort()
+            self._school_ranking = sorted((-total, school) for school, total in self._school_totals.items())
+            self.last_user_id = max(self._students, default=0)
+            self.loaded_at = time.time()
+            self.version += 1
+
+    def catch_up(self, students, events):
+        """Add new (user_id, username, school) students, then apply (event_id, user_id, amount) ledger events.
+
+        ``events`` are those after ``catch_up_after()`` in id order. Events
+        already applied are skipped, so concurrent catch-ups are safe.
+        """
+        with self._lock:
+            now = time.time()
+            for user_id, username, school in students:
+                self.add_student(user_id, username, school)
+                self.last_user_id = max(self.last_user_id, user_id)
+            for event_id, user_id, amount in events:
+                if event_id <= self.last_event_id:
+                    if self._gaps.pop(event_id, None) is None:
+                        continue
+                else:
+                    # Skipped ids may belong to transactions that have not committed yet
+                    self._gaps.update(dict.fromkeys(range(self.last_event_id + 1, event_id), now))
+                    self.last_event_id = event_id
+                self.add_points(user_id, amount)
+            # A gap still open this long was rolled back
+            self._gaps = {event_id: seen for event_id, seen in self._gaps.items() if now - seen < self.gap_seconds}
+            self.caught_up_at = now
+
+    def add_student(self, user_id, username, school, points=0):
+        with self._lock:
+            if user_id in self._students:
+                return
+            school = school or ''
+            self._students[user_id] = (username, school, points)
+            self.version += 1
+            insort(self._ranking, (-points, user_id))
+            if school:
+                insort(self._school_members.setdefault(school, []), (-points, user_id))
+                self._adjust_school(school, points)
+
+    def add_points(self, user_id, delta):
+        """Move a student up the rankings after they earn points."""
+        with self._lock:
+            if user_id not in self._students or not delta:
+                return
+            username, school, points = self._students[user_id]
+            _move(self._ranking, (-points, user_id), (-(points + delta), user_id))
+            if school:
+                _move(self._school_members[school], (-points, user_id), (-(points + delta), user_id))
+                self._adjust_school(school, delta)
+            self._students[user_id] = (username, school, points + delta)
+            self.version += 1
+
+    def _adjust_school(self, school, delta):
+        total = self._school_totals.get(school)
+        if total is not None:
+            _move(self._school_ranking, (-total, school), (-(total + delta), school))
+        else:
+            total = 0
+            insort(self._school_ranking, (-delta, school))
+        self._school_totals[school] = total + delta
+
+    def top_students(self, limit=20):
+        with self._lock:
+            result = []
+            for _, user_id in self._ranking[:limit]:
+                username, school, points = self._students[user_id]
+                result.append({'id': user_id, 'username': username, 'school': school, 'points': points})
+            return result
+
+    def page(self, after=None, limit=20, school=None):
+        """Students ranked below the ``(points, user_id)`` key ``after``, best first.
+
+        With ``school``, ranks are within that school.
+        """
+        with self._lock:
+            ranking = self._school_members.get(school, []) if school else self._ranking
+            start = 0 if after is None else bisect_right(ranking, (-after[0], after[1]))
+            result = []
+            for neg_points, user_id in ranking[start:start + limit]:
+                username, school_name, points = self._students[user_id]
+                result.append({'id': user_id, 'username': username, 'school': school_name, 'points': points,
+                               'rank': bisect_left(ranking, (neg_points, -1)) + 1})
+            return result
+
+    def top_schools(self, limit=None):
+        with self._lock:
+            ranking = self._school_ranking if limit is None else self._school_ranking[:limit]
+            return [{'school': school, 'total_points': -neg_total,
+                     'students': len(self._school_members.get(school, ()))}
+                    for neg_total, school in ranking]
+
+    def rank(self, user_id):
+        """1-based overall rank of a student, or None if not ranked."""
+        with self._lock:
+            student = self._students.get(user_id)
+            if student is None:
+                return None
+            # Ties share the best rank
+            return bisect_left(self._ranking, (-student[2], -1)) + 1
+
+    def school_rank(self, user_id):
+        """1-based rank of a student within their own school."""
+        with self._lock:
+            student = self._students.get(user_id)
+            if student is None or not student[1]:
+                return None
+            return bisect_left(self._school_members[student[1]], (-student[2], -1)) + 1
+
+    def school_position(self, school):
+        with self._lock:
+            total = self._school_totals.get(school)
+            if total is None:
+                return None
+            return bisect_left(self._school_ranking, (-total, '')) + 1
+
+    def __len__(self):
+        return len(self._students)
+
+
+def _move(ranking, old_key, new_key):
+    index = bisect_left(ranking, old_key)
+    if index < len(ranking) and ranking[index] == old_key:
+        del ranking[index]
+    insort(ranking, new_key)
@@ -0,0 +1,199 @@
+from flask_sqlalchemy import SQLAlchemy
+from datetime import datetime
+
+from db_routing import RoutingSession
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
+
+# Database Models
+class User(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    username = db.Column(db.String(80), unique=True, nullable=False)
+    email = db.Column(db.String(120), unique=True, nullable=False)
+    password = db.Column(db.String(255), nullable=False)  # Salted hash
+    user_type = db.Column(db.String(20), nullable=False)  # 'student' or 'teacher'
+    school = db.Column(db.String(120))
+    points = db.Column(db.Integer, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    # Relationships
+    progress = db.relationship('UserProgress', backref='user', lazy=True)
+    challenges = db.relationship('UserChallenge', backref='user', lazy=True)
+    badges = db.relationship('UserBadge', backref='user', lazy=True)
+
+    __table_args__ = (
+        db.Index('ix_user_type_school', 'user_type', 'school'),
+        db.Index('ix_user_type_points', 'user_type', 'points'),
+    )
+
+class Lesson(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    content = db.Column(db.Text)
+    category = db.Column(db.String(50), index=True)  # climate, waste, biodiversity, etc.
+    difficulty = db.Column(db.String(20))  # beginner, intermediate, advanced
+    points_reward = db.Column(db.Integer, default=10)
+
+    # Relationships
+    quizzes = db.relationship('Quiz', backref='lesson', lazy=True)
+
+class Quiz(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False, index=True)
+    question = db.Column(db.Text, nullable=False)
+    options = db.Column(db.Text)  # JSON string of options
+    correct_answer = db.Column(db.Integer, nullable=False)  # index of correct option
+    explanation = db.Column(db.Text)
+
+class Challenge(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    title = db.Column(db.String(200), nullable=False)
+    description = db.Column(db.Text)
+    category = db.Column(db.String(50))
+    points_reward = db.Column(db.Integer, default=50)
+    duration_days = db.Column(db.Integer, default=7)
+    is_active = db.Column(db.Boolean, default=True)
+
+class UserProgress(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    lesson_id = db.Column(db.Integer, db.ForeignKey('lesson.id'), nullable=False)
+    completed = db.Column(db.Boolean, default=False)
+    score = db.Column(db.Integer, default=0)
+    completed_at = db.Column(db.DateTime)
+    # Server time of the last change, for offline sync deltas
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    lesson = db.relationship('Lesson')
+
+    __table_args__ = (
+        db.Index('uq_user_progress_user_lesson', 'user_id', 'lesson_id', unique=True),
+        db.Index('ix_user_progress_user_completed', 'user_id', 'completed'),
+        db.Index('ix_user_progress_user_updated', 'user_id', 'updated_at'),
+    )
+
+class UserChallenge(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    challenge_id = db.Column(db.Integer, db.ForeignKey('challenge.id'), nullable=False)
+    status = db.Column(db.String(20), default='in_progress')  # in_progress, completed, failed
+    started_at = db.Column(db.DateTime, default=datetime.utcnow)
+    completed_at = db.Column(db.DateTime)
+    # Server time of the last change, for offline sync deltas
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    challenge = db.relationship('Challenge')
+
+    __table_args__ = (
+        db.Index('uq_user_challenge_user_challenge', 'user_id', 'challenge_id', unique=True),
+        db.Index('ix_user_challenge_user_status', 'user_id', 'status'),
+        db.Index('ix_user_challenge_user_updated', 'user_id', 'updated_at'),
+    )
+
+class Badge(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(100), nullable=False)
+    description = db.Column(db.Text)
+    image_url = db.Column(db.String(200))
+    criteria = db.Column(db.String(100))  # points_threshold, challenges_completed, etc.
+
+class UserBadge(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    badge_id = db.Column(db.Integer, db.ForeignKey('badge.id'), nullable=False)
+    earned_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('uq_user_badge_user_badge', 'user_id', 'badge_id', unique=True),
+    )
+
+class UserStats(db.Model):
+    # Denormalized counters, kept in step with UserProgress and UserChallenge
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    completed_lessons = db.Column(db.Integer, default=0, nullable=False)
+    score_sum = db.Column(db.Integer, default=0, nullable=False)
+    completed_challenges = db.Column(db.Integer, default=0, nullable=False)
+
+class PointsEvent(db.Model):
+    # Append-only ledger; User.points is the running total of these amounts
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    amount = db.Column(db.Integer, nullable=False)
+    reason = db.Column(db.String(30), nullable=False)  # lesson, challenge, opening_balance
+    source_id = db.Column(db.Integer)
+    idempotency_key = db.Column(db.String(100), unique=True, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class Job(db.Model):
+    # Background work, claimed and run by `flask run-jobs` workers
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(50), nullable=False)
+    payload = db.Column(db.Text, nullable=False)  # JSON keyword arguments
+    # Set only while queued, so repeated requests for the same work collapse into one job
+    dedupe_key = db.Column(db.String(100), unique=True)
+    status = db.Column(db.String(20), default='queued', nullable=False)  # queued, running, failed
+    attempts = db.Column(db.Integer, default=0, nullable=False)
+    max_attempts = db.Column(db.Integer, default=5, nullable=False)
+    run_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    locked_by = db.Column(db.String(100))
+    locked_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_job_status_run_at', 'status', 'run_at'),
+    )
+
+class ActivityRollup(db.Model):
+    # Completions, quiz scores and points per hour or day; maintained by analytics.py
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(10), nullable=False)  # hour, day
+    school = db.Column(db.String(120), nullable=False, default='')
+    bucket = db.Column(db.DateTime, nullable=False)  # start of the hour or day (UTC)
+    kind = db.Column(db.String(20), nullable=False)  # lesson, challenge
+    category = db.Column(db.String(50), nullable=False, default='')
+    item_id = db.Column(db.Integer, nullable=False)  # lesson or challenge id
+    completions = db.Column(db.Integer, default=0, nullable=False)
+    score_sum = db.Column(db.Integer, default=0, nullable=False)
+    points = db.Column(db.Integer, default=0, nullable=False)
+
+    __table_args__ = (
+        # Leading (period, school, bucket) serves range queries for one school
+        db.Index('uq_activity_rollup_key', 'period', 'school', 'bucket', 'kind', 'category', 'item_id', unique=True),
+    )
+
+class ItemAffinity(db.Model):
+    # Students who completed both items, counted by recommendations.py; item_a == item_b holds an item's total
+    item_a = db.Column(db.String(20), primary_key=True)  # 'L<lesson id>' or 'C<challenge id>'
+    item_b = db.Column(db.String(20), primary_key=True)
+    together = db.Column(db.Integer, nullable=False)
+
+class UserRecommendation(db.Model):
+    # Precomputed next-up items, best first, e.g. 'L12,L5,L7,C3,C1'
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    items = db.Column(db.String(200), nullable=False, default='')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class ArchivedHistory(db.Model):
+    # Completions moved out of UserProgress/UserChallenge by archive.py, per student, term and kind
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    term = db.Column(db.String(7), nullable=False)  # 'YYYY-MM', the month the term starts
+    kind = db.Column(db.String(20), nullable=False)  # lesson, challenge
+    item_ids = db.Column(db.Text, nullable=False, default='')  # sorted and comma-separated, e.g. '3,12,14'
+    completions = db.Column(db.Integer, default=0, nullable=False)
+    score_sum = db.Column(db.Integer, default=0, nullable=False)
+    first_at = db.Column(db.DateTime)
+    last_at = db.Column(db.DateTime)
+    records = db.Column(db.LargeBinary, nullable=False)  # zlib-compressed columns, see archive.encode
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('uq_archived_history_user_term_kind', 'user_id', 'term', 'kind', unique=True),
+    )
+
+class CacheVersion(db.Model):
+    # Bumped in the transaction that changes cached data, so every process can tell its copy is out of date
+    name = db.Column(db.String(50), primary_key=True)  # content
+    version = db.Column(db.Integer, default=0, nullable=False)
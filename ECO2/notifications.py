@@ -0,0 +1,53 @@
+"""
+Progress change notifications for EcoLearn.
+
+Write paths call ``notify(user_id)`` after committing, which wakes any
+long-poll request waiting on that user in this process. Each waiting
+request holds a worker thread, so at most ``max_waiters`` wait at once;
+the rest are answered straight away and the client polls again later.
+
+Notifications only reach the process that made the change. With several
+worker processes a waiting request sees another worker's change when its
+wait ends, because it re-reads the database before answering.
+
+Counters are kept for the ``max_users`` most recently notified users. A
+waiter whose counter is dropped sees it change and re-reads early, which
+is harmless.
+"""
+
+from collections import OrderedDict
+import threading
+
+
+class ProgressNotifier:
+    def __init__(self, max_waiters=2, max_users=10000):
+        self.max_waiters = max_waiters
+        self.max_users = max_users
+        self._waiting = 0
+        self._condition = threading.Condition()
+        self._counters = OrderedDict()
+
+    def notify(self, user_id):
+        with self._condition:
+            self._counters[user_id] = self._counters.pop(user_id, 0) + 1
+            while len(self._counters) > self.max_users:
+                self._counters.popitem(last=False)
+            self._condition.notify_all()
+
+    def counter(self, user_id):
+        return self._counters.get(user_id, 0)
+
+    def wait(self, user_id, seen, timeout):
+        """Block until user_id changes past ``seen`` or timeout; returns the current counter.
+
+        Returns None without waiting when ``max_waiters`` requests are already waiting.
+        """
+        with self._condition:
+            if self._waiting >= self.max_waiters:
+                return None
+            self._waiting += 1
+            try:
+                self._condition.wait_for(lambda: self._counters.get(user_id, 0) != seen, timeout)
+            finally:
+                self._waiting -= 1
+            return self._counters.get(user_id, 0)
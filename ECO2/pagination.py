@@ -0,0 +1,84 @@
+"""
+Keyset pagination and sparse fields for the EcoLearn JSON API.
+
+Pages are addressed by an opaque cursor holding the sort key of the last
+row returned, so fetching page N costs the same as page 1 (no OFFSET
+scans). Clients choose the fields they need with ``?fields=a,b``, and
+only those columns are selected from the database.
+"""
+
+import base64
+import json
+
+from flask import Response
+
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+class ApiError(ValueError):
+    """A bad request parameter; reported to the client as a 400."""
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(json.dumps(key, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise ApiError('Invalid cursor')
+
+
+def parse_limit(value):
+    if value is None:
+        return DEFAULT_LIMIT
+    try:
+        limit = int(value)
+    except ValueError:
+        raise ApiError('limit must be an integer')
+    return max(1, min(limit, MAX_LIMIT))
+
+
+def parse_fields(value, available, default):
+    """Validate ``?fields=`` against ``available`` and return the chosen names in order."""
+    if not value:
+        return list(default)
+    fields = [name.strip() for name in value.split(',') if name.strip()]
+    unknown = [name for name in fields if name not in available]
+    if unknown:
+        raise ApiError(f"Unknown fields: {', '.join(unknown)}. Available: {', '.join(available)}")
+    return list(dict.fromkeys(fields))
+
+
+def keyset_page(session, columns, fields, key, cursor, limit, filters=(), join=None, descending=False):
+    """Select ``fields`` from ``columns`` ordered by the integer column ``key``.
+
+    Returns (rows as dicts, next cursor or None).
+    """
+    after = decode_cursor(cursor)
+    if after is not None and not isinstance(after, int):
+        raise ApiError('Invalid cursor')
+
+    query = session.query(key.label('_key'), *[columns[name].label(name) for name in fields])
+    if join is not None:
+        query = query.join(join)
+    for condition in filters:
+        query = query.filter(condition)
+    if after is not None:
+        query = query.filter(key < after if descending else key > after)
+    rows = query.order_by(key.desc() if descending else key).limit(limit + 1).all()
+
+    next_cursor = encode_cursor(rows[limit - 1]._key) if len(rows) > limit else None
+    return [{name: serialize(getattr(row, name)) for name in fields} for row in rows[:limit]], next_cursor
+
+
+def serialize(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else value
+
+
+def compact_json(payload, status=200):
+    return Response(json.dumps(payload, separators=(',', ':')), status=status, mimetype='application/json')
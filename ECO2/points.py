@@ -0,0 +1,73 @@
+"""
+Points ledger for EcoLearn.
+
+Every award is an append-only PointsEvent with an idempotency key, so
+retrying or resubmitting the same completion never pays out twice.
+User.points is a running total maintained with an atomic SQL increment
+and can always be rebuilt from the ledger.
+"""
+
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import db, User, PointsEvent
+
+
+def _insert_event(values):
+    # INSERT ... ON CONFLICT DO NOTHING where supported, so duplicates cost no extra query
+    dialect = db.session.get_bind().dialect.name
+    if dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(PointsEvent).values(**values).on_conflict_do_nothing(index_elements=['idempotency_key'])
+        return db.session.execute(statement).rowcount == 1
+
+    if PointsEvent.query.filter_by(idempotency_key=values['idempotency_key']).first():
+        return False
+    db.session.add(PointsEvent(**values))
+    db.session.flush()
+    return True
+
+
+def award_points(user, amount, key, reason, source_id=None, at=None):
+    """Record an award and add it to the user's total; returns the points actually awarded.
+
+    ``at`` is when the points were earned (default now), e.g. the client's
+    time for an offline completion. Returns 0 if ``key`` has already been
+    used. The caller commits.
+    """
+    recorded = _insert_event({
+        'user_id': user.id,
+        'amount': amount,
+        'reason': reason,
+        'source_id': source_id,
+        'idempotency_key': key,
+        'created_at': at or datetime.utcnow()
+    })
+    if not recorded:
+        return 0
+
+    User.query.filter_by(id=user.id).update({User.points: User.points + amount})
+    return amount
+
+
+def lesson_key(user_id, lesson_id):
+    return f'lesson:{user_id}:{lesson_id}'
+
+
+def challenge_key(user_id, challenge_id):
+    return f'challenge:{user_id}:{challenge_id}'
+
+
+def rebuild_points(user_id=None):
+    """Reset User.points to the ledger totals, for one user or everyone; returns rows updated."""
+    total = db.session.query(db.func.coalesce(db.func.sum(PointsEvent.amount), 0)) \
+        .filter(PointsEvent.user_id == User.id).scalar_subquery()
+    users = User.query
+    if user_id is not None:
+        users = users.filter_by(id=user_id)
+    # A NULL balance must be repaired too, and NULL != total is never true
+    updated = users.filter(User.points.is_distinct_from(total)) \
+        .update({User.points: total}, synchronize_session=False)
+    db.session.commit()
+    return updated
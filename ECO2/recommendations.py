@@ -0,0 +1,213 @@
+"""
+Personalized "next up" lessons and challenges for EcoLearn.
+
+An item (lesson or challenge) is recommended when students who did what
+this student did also did that item (co-completion). Scores lean toward
+the student's favourite categories and their next step in difficulty.
+Popularity breaks ties and covers students who have not completed
+anything yet.
+
+``build_recommendations`` runs offline (``flask build-recommendations``).
+It reads every completion once and keeps a bitset per item of the
+students who completed it. The co-completion count of two items is then
+the popcount of the two bitsets ANDed together, computed a machine word
+at a time. Counts are saved in ItemAffinity. Each student's list is saved
+in UserRecommendation as a short string such as ``L12,L5,C3``.
+``refresh_user`` rescores one student from the saved counts. It runs as
+a background job whenever the student completes or joins something.
+"""
+
+from collections import Counter
+from datetime import datetime
+import math
+
+from sqlalchemy import or_
+
+from models import db, ArchivedHistory, Challenge, ItemAffinity, Lesson, User, UserChallenge, UserProgress, UserRecommendation
+
+DIFFICULTIES = ('beginner', 'intermediate', 'advanced')
+
+# How many of each kind a student is shown
+LESSON_SLOTS = 3
+CHALLENGE_SLOTS = 2
+
+# Weights of the score terms; co-completion similarity is between 0 and the number of items done
+CATEGORY_WEIGHT = 1.0
+DIFFICULTY_WEIGHT = 0.5
+POPULARITY_WEIGHT = 0.2
+
+
+def item_key(kind, item_id):
+    return f"{'L' if kind == 'lesson' else 'C'}{item_id}"
+
+
+def parse_items(value):
+    """[(kind, id), ...] from a stored list such as 'L12,L5,C3'."""
+    items = []
+    for key in (value or '').split(','):
+        if key[1:].isdigit():
+            items.append(('lesson' if key[0] == 'L' else 'challenge', int(key[1:])))
+    return items
+
+
+def load_catalog():
+    """item key -> (kind, category, difficulty rank or None) for every lesson and active challenge."""
+    catalog = {}
+    for lesson_id, category, difficulty in db.session.query(Lesson.id, Lesson.category, Lesson.difficulty):
+        rank = DIFFICULTIES.index(difficulty) if difficulty in DIFFICULTIES else None
+        catalog[item_key('lesson', lesson_id)] = ('lesson', category, rank)
+    for challenge_id, category in db.session.query(Challenge.id, Challenge.category).filter(Challenge.is_active == True):
+        catalog[item_key('challenge', challenge_id)] = ('challenge', category, None)
+    return catalog
+
+
+def _activity(user_ids=None):
+    """Completed lessons, and joined or completed challenges, as (user_id, item key, completed) rows.
+
+    Archived completions count too.
+    """
+    lessons = db.session.query(UserProgress.user_id, UserProgress.lesson_id).filter(UserProgress.completed == True)
+    challenges = db.session.query(UserChallenge.user_id, UserChallenge.challenge_id, UserChallenge.status)
+    archived = db.session.query(ArchivedHistory.user_id, ArchivedHistory.kind, ArchivedHistory.item_ids)
+    if user_ids is not None:
+        lessons = lessons.filter(UserProgress.user_id.in_(user_ids))
+        challenges = challenges.filter(UserChallenge.user_id.in_(user_ids))
+        archived = archived.filter(ArchivedHistory.user_id.in_(user_ids))
+    for user_id, lesson_id in lessons.yield_per(10000):
+        yield user_id, item_key('lesson', lesson_id), True
+    for user_id, challenge_id, status in challenges.yield_per(10000):
+        yield user_id, item_key('challenge', challenge_id), status == 'completed'
+    for user_id, kind, item_ids in archived.yield_per(10000):
+        for item_id in item_ids.split(','):
+            if item_id:
+                yield user_id, item_key(kind, int(item_id)), True
+
+
+def rank(catalog, done, seen, affinity, counts):
+    """Return the stored list for a student, best first.
+
+    ``done`` holds the keys of completed items and ``seen`` the items not to
+    recommend again (completed, or challenges already joined). ``affinity``
+    maps each done item to {other item: students who did both}, and
+    ``counts`` maps items to how many students completed them.
+    """
+    categories = Counter(catalog[key][1] for key in done if key in catalog)
+    levels = {}
+    for key in done:
+        kind, category, difficulty = catalog.get(key, (None, None, None))
+        if difficulty is not None:
+            levels[category] = max(levels.get(category, -1), difficulty)
+    most_popular = math.log1p(max(counts.values(), default=0)) or 1
+
+    scored = []
+    for key, (kind, category, difficulty) in catalog.items():
+        if key in seen:
+            continue
+        count = counts.get(key, 0)
+        score = 0.0
+        if count:
+            # Cosine similarity of who completed this item and each item the student did
+            for other in done:
+                together = affinity.get(other, {}).get(key)
+                if together:
+                    score += together / math.sqrt(count * counts[other])
+        if done:
+            score += CATEGORY_WEIGHT * categories[category] / len(done)
+        if difficulty is not None:
+            # The next level up in this category, or the level already reached
+            target = levels.get(category, -1) + 1
+            score += DIFFICULTY_WEIGHT * (1 if difficulty == target else 0.5 if difficulty == target - 1 else 0)
+        score += POPULARITY_WEIGHT * math.log1p(count) / most_popular
+        scored.append((-score, key))
+
+    scored.sort()
+    lessons = [key for _, key in scored if key[0] == 'L'][:LESSON_SLOTS]
+    challenges = [key for _, key in scored if key[0] == 'C'][:CHALLENGE_SLOTS]
+    return ','.join(lessons + challenges)
+
+
+def _bitset(positions, size):
+    bits = bytearray((size + 7) // 8)
+    for position in positions:
+        bits[position >> 3] |= 1 << (position & 7)
+    return int.from_bytes(bits, 'little')
+
+
+def build_recommendations(chunk_size=5000):
+    """Recount co-completions across all students and rebuild every student's list.
+
+    Returns (item pairs stored, students updated). The caller should call
+    ``sessions.forget_all_users`` so cached lists are reloaded.
+    """
+    catalog = load_catalog()
+    students = [user_id for (user_id,) in db.session.query(User.id).filter_by(user_type='student').order_by(User.id)]
+    position = {user_id: index for index, user_id in enumerate(students)}
+
+    completed_by = {}  # item key -> bit positions of the students who completed it
+    done = {}  # user_id -> set of completed item keys
+    seen = {}  # user_id -> set of item keys not to recommend
+    for user_id, key, completed in _activity():
+        if user_id not in position:
+            continue
+        seen.setdefault(user_id, set()).add(key)
+        if completed:
+            done.setdefault(user_id, set()).add(key)
+            completed_by.setdefault(key, []).append(position[user_id])
+
+    bitsets = {key: _bitset(positions, len(students)) for key, positions in completed_by.items()}
+    counts = {key: len(positions) for key, positions in completed_by.items()}
+    keys = sorted(bitsets)
+    affinity = {key: {} for key in keys}
+    for index, first in enumerate(keys):
+        bits = bitsets[first]
+        for second in keys[index + 1:]:
+            together = (bits & bitsets[second]).bit_count()
+            if together:
+                affinity[first][second] = together
+                affinity[second][first] = together
+
+    ItemAffinity.query.delete(synchronize_session=False)
+    rows = [{'item_a': key, 'item_b': key, 'together': counts[key]} for key in keys]
+    rows += [{'item_a': first, 'item_b': second, 'together': together}
+             for first, others in affinity.items() for second, together in others.items()]
+    for offset in range(0, len(rows), chunk_size):
+        db.session.execute(db.insert(ItemAffinity), rows[offset:offset + chunk_size])
+
+    UserRecommendation.query.delete(synchronize_session=False)
+    now = datetime.utcnow()
+    for offset in range(0, len(students), chunk_size):
+        db.session.execute(db.insert(UserRecommendation), [{
+            'user_id': user_id,
+            'items': rank(catalog, done.get(user_id, set()), seen.get(user_id, set()), affinity, counts),
+            'updated_at': now
+        } for user_id in students[offset:offset + chunk_size]])
+    db.session.commit()
+    return len(rows), len(students)
+
+
+def refresh_user(user_id, catalog=None):
+    """Rescore one student from the stored co-completion counts; the caller commits."""
+    catalog = catalog if catalog is not None else load_catalog()
+    done, seen = set(), set()
+    for _, key, completed in _activity([user_id]):
+        seen.add(key)
+        if completed:
+            done.add(key)
+
+    affinity, counts = {}, {}
+    rows = db.session.query(ItemAffinity.item_a, ItemAffinity.item_b, ItemAffinity.together) \
+        .filter(or_(ItemAffinity.item_a == ItemAffinity.item_b, ItemAffinity.item_a.in_(done)))
+    for first, second, together in rows:
+        if first == second:
+            counts[first] = together
+        else:
+            affinity.setdefault(first, {})[second] = together
+
+    items = rank(catalog, done, seen, affinity, counts)
+    recommendation = db.session.get(UserRecommendation, user_id)
+    if recommendation is None:
+        db.session.add(UserRecommendation(user_id=user_id, items=items, updated_at=datetime.utcnow()))
+    else:
+        recommendation.items = items
+        recommendation.updated_at = datetime.utcnow()
+    return items
@@ -0,0 +1,157 @@
+"""
+Bulk roster import for EcoLearn.
+
+Rosters are streamed from CSV or JSON Lines. Duplicates are checked
+against username/email sets loaded once up front, and new users are
+written with multi-row inserts in large batches. The same pipeline loads
+synthetic rosters for testing.
+
+CSV files need a header row; recognised columns are username, email,
+password, user_type and school. Passwords may be plaintext (hashed during
+import) or existing hashes.
+"""
+
+import csv
+from datetime import datetime
+import io
+import json
+import random
+
+from sqlalchemy import insert
+
+from credentials import is_hashed
+from models import db, PointsEvent, User, UserStats
+
+USER_TYPES = ('student', 'teacher')
+MAX_REPORTED_ERRORS = 100
+
+
+def read_rows(stream, fmt):
+    """Yield roster rows as dicts from a text stream in 'csv' or 'jsonl' format."""
+    if fmt == 'csv':
+        yield from csv.DictReader(stream)
+    elif fmt == 'jsonl':
+        for line in stream:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+    else:
+        raise ValueError(f"Unsupported roster format: {fmt}")
+
+
+def detect_format(filename):
+    return 'jsonl' if filename and filename.lower().endswith(('.jsonl', '.ndjson')) else 'csv'
+
+
+def text_stream(binary):
+    return io.TextIOWrapper(binary, encoding='utf-8-sig', newline='')
+
+
+def synthetic_rows(count, schools=10, teachers_per_school=1, max_points=0, seed=None, prefix='user',
+                   password='password'):
+    """Yield ``count`` generated users spread across ``schools`` schools."""
+    rng = random.Random(seed)
+    teachers = schools * teachers_per_school
+    for i in range(count):
+        is_teacher = i < teachers
+        yield {
+            'username': f'{prefix}{i}',
+            'email': f'{prefix}{i}@example.com',
+            'password': password,
+            'user_type': 'teacher' if is_teacher else 'student',
+            'school': f'School {i % schools}',
+            'points': 0 if is_teacher or not max_points else rng.randint(0, max_points)
+        }
+
+
+def import_roster(rows, school=None, user_type=None, batch_size=1000, progress=None, keep_points=False,
+                  hash_passwords=None):
+    """Insert new users from ``rows`` in batches and return a summary report.
+
+    ``school`` and ``user_type`` override the values in every row (a teacher
+    importing a class). Row ``points`` are only used with ``keep_points``,
+    for synthetic data, and are recorded as opening balances in the points
+    ledger. ``hash_passwords(list)`` hashes each batch's plaintext passwords;
+    values that are already hashes are stored as they are.
+    ``progress(report)`` is called after each batch.
+
+    Each batch is committed. If the file cannot be read past some row, the
+    rows before it are still imported and the report gets an ``error``.
+    """
+    usernames = {name for (name,) in db.session.query(User.username)}
+    emails = {email.lower() for (email,) in db.session.query(User.email)}
+    report = {'processed': 0, 'inserted': 0, 'skipped': 0, 'errors': []}
+    batch = []
+
+    def skip(line, message):
+        report['skipped'] += 1
+        if len(report['errors']) < MAX_REPORTED_ERRORS:
+            report['errors'].append({'row': line, 'error': message})
+
+    def flush():
+        if batch:
+            if hash_passwords:
+                plain = [row for row in batch if not is_hashed(row['password'])]
+                for row, hashed in zip(plain, hash_passwords([row['password'] for row in plain])):
+                    row['password'] = hashed
+            db.session.execute(insert(User), batch)
+            ids = dict(db.session.query(User.username, User.id).filter(
+                User.username.in_([row['username'] for row in batch])))
+            # New users start with empty progress counters, so reads never have to build them
+            db.session.execute(insert(UserStats), [{'user_id': user_id} for user_id in ids.values()])
+            opening = {row['username']: row['points'] for row in batch if row['points']}
+            if opening:
+                # Opening balances keep User.points equal to the ledger total
+                now = datetime.utcnow()
+                db.session.execute(insert(PointsEvent), [
+                    {'user_id': ids[username], 'amount': amount, 'reason': 'opening_balance',
+                     'idempotency_key': f'opening:{ids[username]}', 'created_at': now}
+                    for username, amount in opening.items()])
+            db.session.commit()
+            report['inserted'] += len(batch)
+            batch.clear()
+            if progress:
+                progress(report)
+
+    try:
+        for line, row in enumerate(rows, start=1):
+            report['processed'] += 1
+            if not isinstance(row, dict):
+                skip(line, 'expected an object')
+                continue
+            username = (row.get('username') or '').strip()
+            email = (row.get('email') or '').strip()
+            password = row.get('password') or ''
+            kind = user_type or (row.get('user_type') or 'student').strip().lower()
+
+            if not username or not email or not password:
+                skip(line, 'username, email and password are required')
+                continue
+            if kind not in USER_TYPES:
+                skip(line, f'unknown user_type {kind!r}')
+                continue
+            if username in usernames:
+                skip(line, f'username {username!r} already exists')
+                continue
+            if email.lower() in emails:
+                skip(line, f'email {email!r} already registered')
+                continue
+
+            usernames.add(username)
+            emails.add(email.lower())
+            batch.append({
+                'username': username,
+                'email': email,
+                'password': password,
+                'user_type': kind,
+                'school': school if school is not None else (row.get('school') or '').strip(),
+                'points': int(row.get('points') or 0) if keep_points else 0
+            })
+            if len(batch) >= batch_size:
+                flush()
+
+    except (ValueError, csv.Error) as e:
+        report['error'] = f"Could not read row {report['processed'] + 1}: {e}"
+
+    flush()
+    return report
@@ -0,0 +1,274 @@
+"""
+Full-text search for EcoLearn.
+
+An in-process inverted index over lessons (title, description, the lesson
+body with its HTML stripped, and the lesson's quiz questions) and active
+challenges. Hits must contain every query word, with the last word also
+matching as a prefix so search-as-you-type works. They are ranked with
+BM25, where a word in a title counts more than one in a description or
+body.
+
+The index is built from the database on first use. After that, lessons
+and challenges changed by committed transactions are marked dirty and
+reindexed before the next search. Like the leaderboard, the whole index is
+rebuilt every ``refresh_seconds`` to pick up changes made by other
+processes.
+"""
+
+from bisect import bisect_left, insort
+from html.parser import HTMLParser
+import math
+import re
+import threading
+import time
+
+KINDS = ('lesson', 'challenge')
+
+# How much one occurrence of a word counts, per field
+FIELD_WEIGHTS = {'title': 5, 'description': 2, 'body': 1, 'questions': 1}
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# Most words a trailing prefix may expand to
+MAX_PREFIX_TERMS = 50
+SNIPPET_LENGTH = 160
+
+_WORD = re.compile(r'\w+', re.UNICODE)
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower()) if text else []
+
+
+class _TextExtractor(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip:
+            self._skip -= 1
+
+    def handle_data(self, data):
+        if not self._skip:
+            self.parts.append(data)
+
+
+def strip_html(html):
+    """Visible text of an HTML fragment, with entities decoded and whitespace collapsed."""
+    if not html:
+        return ''
+    extractor = _TextExtractor()
+    extractor.feed(html)
+    extractor.close()
+    return ' '.join(' '.join(extractor.parts).split())
+
+
+class SearchIndex:
+    """Inverted index of lessons and challenges, ranked with BM25."""
+
+    def __init__(self, refresh_seconds=300):
+        self.refresh_seconds = refresh_seconds
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        # (kind, id) pairs changed since they were indexed
+        self._dirty = set()
+        self._clear()
+
+    def _clear(self):
+        # (kind, id) -> stored fields, indexed terms and weighted length
+        self._docs = {}
+        # term -> {(kind, id): weighted term frequency}
+        self._postings = {}
+        # Sorted vocabulary for prefix lookups; may hold terms whose postings are gone
+        self._terms = []
+        self._total_length = 0
+
+    def invalidate(self):
+        """Force a rebuild on the next read, e.g. after a bulk import."""
+        self.loaded_at = None
+
+    def is_stale(self):
+        if self.loaded_at is None:
+            return True
+        return self.refresh_seconds and time.time() - self.loaded_at > self.refresh_seconds
+
+    def mark_dirty(self, keys):
+        with self._lock:
+            self._dirty.update(keys)
+
+    def take_dirty(self):
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+            return dirty
+
+    def load(self, documents):
+        """Rebuild from (kind, id, document) triples; see ``update`` for the document fields.
+
+        Call ``take_dirty`` before reading the documents, so changes committed
+        while they are read are reindexed afterwards.
+        """
+        with self._lock:
+            self._clear()
+            for kind, item_id, document in documents:
+                self._add((kind, item_id), document, sort_terms=False)
+            self._terms = sorted(self._postings)
+            self.loaded_at = time.time()
+
+    def update(self, kind, item_id, document):
+        """Reindex one item; a ``document`` of None removes it.
+
+        A document is a dict with ``title``, ``category`` and ``difficulty``,
+        plus the plain text of each field in FIELD_WEIGHTS.
+        """
+        with self._lock:
+            self._remove((kind, item_id))
+            if document is not None:
+                self._add((kind, item_id), document)
+
+    def _add(self, key, document, sort_terms=True):
+        frequencies = {}
+        length = 0
+        for field, weight in FIELD_WEIGHTS.items():
+            words = tokenize(document.get(field))
+            length += weight * len(words)
+            for word in words:
+                frequencies[word] = frequencies.get(word, 0) + weight
+
+        for term, frequency in frequencies.items():
+            postings = self._postings.get(term)
+            if postings is None:
+                postings = self._postings[term] = {}
+                if sort_terms:
+                    insort(self._terms, term)
+            postings[key] = frequency
+        self._docs[key] = {
+            'title': document.get('title'),
+            'category': document.get('category'),
+            'difficulty': document.get('difficulty'),
+            'description': document.get('description') or '',
+            'body': document.get('body') or '',
+            'terms': tuple(frequencies),
+            'length': length
+        }
+        self._total_length += length
+
+    def _remove(self, key):
+        doc = self._docs.pop(key, None)
+        if doc is None:
+            return
+        for term in doc['terms']:
+            postings = self._postings.get(term)
+            if postings is not None:
+                postings.pop(key, None)
+                if not postings:
+                    del self._postings[term]
+        self._total_length -= doc['length']
+
+    def _expand(self, prefix):
+        terms = []
+        position = bisect_left(self._terms, prefix)
+        while position < len(self._terms) and self._terms[position].startswith(prefix):
+            if self._terms[position] in self._postings:
+                terms.append(self._terms[position])
+                if len(terms) >= MAX_PREFIX_TERMS:
+                    break
+            position += 1
+        return terms
+
+    def search(self, query, kind=None, category=None, difficulty=None):
+        """Return every hit for ``query`` as (score, kind, id), best first."""
+        tokens = tokenize(query)
+        if not tokens:
+            return []
+        words = list(dict.fromkeys(tokens))
+        # The word being typed matches as a prefix unless the query ends with a space
+        prefix = tokens[-1] if query[-1:].isalnum() else None
+
+        with self._lock:
+            count = len(self._docs)
+            if not count:
+                return []
+            average_length = self._total_length / count
+
+            # Per word, the postings of every term it matches
+            matches = []
+            for word in words:
+                terms = self._expand(word) if word == prefix else [word] if word in self._postings else []
+                if not terms:
+                    return []
+                matches.append([(term, self._postings[term]) for term in terms])
+
+            # Intersect starting from the rarest word
+            matches.sort(key=lambda postings: sum(len(p) for _, p in postings))
+            candidates = set().union(*(p.keys() for _, p in matches[0]))
+            for postings in matches[1:]:
+                candidates.intersection_update(set().union(*(p.keys() for _, p in postings)))
+                if not candidates:
+                    return []
+
+            hits = []
+            for key in candidates:
+                doc = self._docs[key]
+                if (kind and key[0] != kind) or (category and doc['category'] != category) \
+                        or (difficulty and doc['difficulty'] != difficulty):
+                    continue
+                norm = K1 * (1 - B + B * doc['length'] / average_length)
+                score = 0.0
+                for postings in matches:
+                    # A prefix scores as its best-matching completion
+                    best = 0.0
+                    for _, term_postings in postings:
+                        frequency = term_postings.get(key)
+                        if frequency:
+                            idf = math.log(1 + (count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+                            best = max(best, idf * frequency * (K1 + 1) / (frequency + norm))
+                    score += best
+                hits.append((round(score, 6), key[0], key[1]))
+
+        hits.sort(key=lambda hit: (-hit[0], hit[1], hit[2]))
+        return hits
+
+    def values(self, field):
+        """Distinct non-empty values of ``category`` or ``difficulty``, for filter menus."""
+        with self._lock:
+            return sorted({doc[field] for doc in self._docs.values() if doc[field]})
+
+    def describe(self, kind, item_id, query=''):
+        """Title, category, difficulty and a snippet around the first query word for a hit."""
+        doc = self._docs.get((kind, item_id))
+        if doc is None:
+            return None
+        return {
+            'title': doc['title'],
+            'category': doc['category'],
+            'difficulty': doc['difficulty'],
+            'snippet': snippet(doc['description'], doc['body'], tokenize(query))
+        }
+
+
+def snippet(description, body, words, length=SNIPPET_LENGTH):
+    """About ``length`` characters around the first of ``words`` in the description, else the body."""
+    for text in (description, body):
+        lowered = text.lower()
+        positions = [position for position in (lowered.find(word) for word in words) if position >= 0]
+        if positions:
+            break
+    else:
+        text = description or body
+    if len(text) <= length:
+        return text
+    start = max(0, min(positions) - length // 4) if positions else 0
+    if start:
+        # Begin on a word boundary
+        space = text.find(' ', start)
+        start = space + 1 if 0 <= space < start + 20 else start
+    end = start + length
+    return ('…' if start else '') + text[start:end].strip() + ('…' if end < len(text) else '')
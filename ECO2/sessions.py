@@ -0,0 +1,316 @@
+"""
+Server-side sessions for EcoLearn.
+
+The session cookie only holds a random session id. The session data, plus
+a snapshot of the logged-in user (id, username, type, school, points and
+recommended items), lives in a store:
+
+- ``sqlite``: a local SQLite file shared by all workers on the host (the default)
+- ``memory``: a dict in the process, for single-process development only
+
+Handlers read the snapshot instead of reloading the user on each request.
+Call ``forget_user`` after changing any snapshot field, and the snapshot
+is reloaded on the user's next request in every session. Forgetting also
+bumps the user's snapshot generation, read before a snapshot is loaded;
+a snapshot is only stored if the generation is unchanged, so a request
+that loaded it before the change cannot write it back. Because
+sessions live on the server, they can be revoked: ``revoke_user`` ends
+all of a user's sessions.
+"""
+
+import os
+import secrets
+import sqlite3
+import threading
+import time
+
+from flask import current_app, has_request_context, session
+from flask.json.tag import TaggedJSONSerializer
+from flask.sessions import SessionInterface, SessionMixin
+from werkzeug.datastructures import CallbackDict
+
+SNAPSHOT_FIELDS = ('id', 'username', 'user_type', 'school', 'points', 'recommended')
+
+serializer = TaggedJSONSerializer()
+
+
+class UserSnapshot:
+    """The current user's commonly used fields, cached in their session."""
+
+    __slots__ = SNAPSHOT_FIELDS
+
+    def __init__(self, **fields):
+        for name in SNAPSHOT_FIELDS:
+            setattr(self, name, fields.get(name))
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in SNAPSHOT_FIELDS}
+
+
+class MemorySessionStore:
+    def __init__(self, lifetime):
+        self.lifetime = lifetime
+        self._sessions = {}  # sid -> (expires, user_id, data, snapshot)
+        self._generations = {}  # user_id -> generation, with None for every user
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def generation(self, user_id):
+        return self._generations.get(None, 0) + self._generations.get(user_id, 0)
+
+    def load(self, sid):
+        """Return (data, snapshot, expires) for a live session, or None."""
+        record = self._sessions.get(sid)
+        if record is None or record[0] < time.time():
+            return None
+        return record[2], record[3], record[0]
+
+    def save(self, sid, user_id, data):
+        """Store the session data, keeping any snapshot already stored."""
+        with self._lock:
+            snapshot = self._sessions[sid][3] if sid in self._sessions else None
+            self._sessions[sid] = (time.time() + self.lifetime, user_id, data, snapshot)
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                now = time.time()
+                for expired in [key for key, record in self._sessions.items() if record[0] < now]:
+                    del self._sessions[expired]
+
+    def save_snapshot(self, sid, snapshot, generation=None):
+        """Store a snapshot loaded at ``generation``, unless the user was forgotten since."""
+        with self._lock:
+            record = self._sessions.get(sid)
+            if record is None:
+                return
+            if snapshot is not None and generation is not None and generation != self.generation(record[1]):
+                return
+            self._sessions[sid] = record[:3] + (snapshot,)
+
+    def touch(self, sid):
+        with self._lock:
+            record = self._sessions.get(sid)
+            if record is not None:
+                self._sessions[sid] = (time.time() + self.lifetime,) + record[1:]
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+    def clear_snapshots(self, user_id=None):
+        with self._lock:
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            for sid, record in self._sessions.items():
+                if user_id is None or record[1] == user_id:
+                    self._sessions[sid] = record[:3] + (None,)
+
+    def delete_user(self, user_id):
+        with self._lock:
+            sids = [sid for sid, record in self._sessions.items() if record[1] == user_id]
+            for sid in sids:
+                del self._sessions[sid]
+            return len(sids)
+
+
+class SQLiteSessionStore:
+    """Sessions in a local SQLite file, shared by every worker process on the host."""
+
+    def __init__(self, path, lifetime):
+        self.path = path
+        self.lifetime = lifetime
+        self._local = threading.local()
+        self._writes = 0
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS sessions ("
+                         "sid TEXT PRIMARY KEY, user_id INTEGER, data TEXT, snapshot TEXT, expires REAL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_sessions_user_id ON sessions (user_id)")
+            # user_id 0 counts forgetting every user
+            conn.execute("CREATE TABLE IF NOT EXISTS snapshot_generations ("
+                         "user_id INTEGER PRIMARY KEY, generation INTEGER NOT NULL)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def load(self, sid):
+        row = self._connect().execute(
+            "SELECT data, snapshot, expires FROM sessions WHERE sid = ? AND expires >= ?",
+            (sid, time.time())).fetchone()
+        return row
+
+    def generation(self, user_id):
+        return self._connect().execute(
+            "SELECT COALESCE(SUM(generation), 0) FROM snapshot_generations WHERE user_id IN (0, ?)",
+            (user_id,)).fetchone()[0]
+
+    def save(self, sid, user_id, data):
+        """Store the session data, keeping any snapshot already stored."""
+        with self._connect() as conn:
+            conn.execute("INSERT INTO sessions (sid, user_id, data, snapshot, expires) VALUES (?, ?, ?, NULL, ?) "
+                         "ON CONFLICT (sid) DO UPDATE SET user_id = excluded.user_id, data = excluded.data, "
+                         "expires = excluded.expires",
+                         (sid, user_id, data, time.time() + self.lifetime))
+            self._writes += 1
+            if self._writes % 1000 == 0:
+                conn.execute("DELETE FROM sessions WHERE expires < ?", (time.time(),))
+
+    def save_snapshot(self, sid, snapshot, generation=None):
+        """Store a snapshot loaded at ``generation``, unless the user was forgotten since."""
+        with self._connect() as conn:
+            if snapshot is None or generation is None:
+                conn.execute("UPDATE sessions SET snapshot = ? WHERE sid = ?", (snapshot, sid))
+            else:
+                conn.execute("UPDATE sessions SET snapshot = ? WHERE sid = ? AND ? = ("
+                             "SELECT COALESCE(SUM(generation), 0) FROM snapshot_generations "
+                             "WHERE user_id IN (0, sessions.user_id))", (snapshot, sid, generation))
+
+    def touch(self, sid):
+        with self._connect() as conn:
+            conn.execute("UPDATE sessions SET expires = ? WHERE sid = ?", (time.time() + self.lifetime, sid))
+
+    def delete(self, sid):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM sessions WHERE sid = ?", (sid,))
+
+    def clear_snapshots(self, user_id=None):
+        with self._connect() as conn:
+            conn.execute("INSERT INTO snapshot_generations VALUES (?, 1) "
+                         "ON CONFLICT (user_id) DO UPDATE SET generation = generation + 1", (user_id or 0,))
+            if user_id is None:
+                conn.execute("UPDATE sessions SET snapshot = NULL")
+            else:
+                conn.execute("UPDATE sessions SET snapshot = NULL WHERE user_id = ?", (user_id,))
+
+    def delete_user(self, user_id):
+        with self._connect() as conn:
+            return conn.execute("DELETE FROM sessions WHERE user_id = ?", (user_id,)).rowcount
+
+
+class ServerSession(CallbackDict, SessionMixin):
+    def __init__(self, sid, data=None, snapshot=None, expires=None, new=False):
+        def on_update(self):
+            self.modified = True
+            self.accessed = True
+
+        super().__init__(data, on_update)
+        self.sid = sid
+        self.expires = expires
+        self.new = new
+        self.modified = False
+        self.old_sid = None
+        self._snapshot = snapshot
+        self.snapshot_changed = False
+        # Store generation the snapshot was loaded at, see ``snapshot_generation``
+        self.snapshot_generation = None
+
+    @property
+    def user_snapshot(self):
+        self.accessed = True
+        return self._snapshot
+
+    @user_snapshot.setter
+    def user_snapshot(self, snapshot):
+        self._snapshot = snapshot
+        self.snapshot_changed = True
+
+    def clear(self):
+        # The snapshot belongs to the user being logged out
+        super().clear()
+        if self._snapshot is not None:
+            self.user_snapshot = None
+
+    def rotate(self):
+        """Move the session to a new id, e.g. on login, so an old id cannot be reused."""
+        if not self.new:
+            self.old_sid = self.sid
+        self.sid = secrets.token_urlsafe(32)
+        self.new = True
+        self.modified = True
+
+
+class ServerSessionInterface(SessionInterface):
+    def __init__(self, store):
+        self.store = store
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        record = self.store.load(sid) if sid else None
+        if record is None:
+            return ServerSession(secrets.token_urlsafe(32), new=True)
+        data, snapshot, expires = record
+        snapshot = UserSnapshot(**serializer.loads(snapshot)) if snapshot else None
+        return ServerSession(sid, serializer.loads(data), snapshot, expires)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+
+        if session.accessed:
+            response.vary.add('Cookie')
+        if session.old_sid:
+            self.store.delete(session.old_sid)
+
+        if not session:
+            if not session.new:
+                self.store.delete(session.sid)
+            if session.modified:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+
+        snapshot = session.user_snapshot
+        snapshot = serializer.dumps(snapshot.to_dict()) if snapshot else None
+        if session.modified or session.new:
+            self.store.save(session.sid, session.get('user_id'), serializer.dumps(dict(session)))
+        if session.snapshot_changed:
+            self.store.save_snapshot(session.sid, snapshot, session.snapshot_generation)
+        elif not (session.modified or session.new) and session.expires - time.time() < self.store.lifetime / 2:
+            # Sliding expiry, written at most once per half lifetime
+            self.store.touch(session.sid)
+
+        if session.new:
+            response.set_cookie(name, session.sid, expires=self.get_expiration_time(app, session),
+                                httponly=self.get_cookie_httponly(app), domain=domain, path=path,
+                                secure=self.get_cookie_secure(app), samesite=self.get_cookie_samesite(app))
+
+
+def forget_user(user_id):
+    """Drop the cached snapshot of ``user_id`` from all their sessions, after it changed."""
+    current_app.session_interface.store.clear_snapshots(user_id)
+    if has_request_context() and session.get('user_id') == user_id:
+        # Reloaded next time; this request's stale copy must not be written back
+        session._snapshot = None
+        session.snapshot_changed = False
+
+
+def snapshot_generation(user_id):
+    """Read before loading ``user_id``'s snapshot and pass to the session, so a stale one is never stored."""
+    return current_app.session_interface.store.generation(user_id)
+
+
+def forget_all_users():
+    current_app.session_interface.store.clear_snapshots()
+
+
+def revoke_user(user_id):
+    """End every session of ``user_id``; returns how many were removed."""
+    return current_app.session_interface.store.delete_user(user_id)
+
+
+def init_app(app):
+    """Replace the signed-cookie session with the configured server-side store."""
+    kind = app.config.get('SESSION_STORE', 'sqlite')
+    lifetime = app.config.get('SESSION_LIFETIME_SECONDS', 7 * 24 * 3600)
+    if kind == 'memory':
+        store = MemorySessionStore(lifetime)
+    elif kind == 'sqlite':
+        path = app.config.get('SESSION_STORE_PATH') or os.path.join(app.instance_path, 'sessions.db')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        store = SQLiteSessionStore(path, lifetime)
+    else:
+        raise ValueError(f"Unknown SESSION_STORE: {kind}")
+    app.session_interface = ServerSessionInterface(store)
@@ -27,9 +27,15 @@ function joinChallenge(challengeId, button) {
     button.disabled = true;
     button.innerHTML = '<span class="loading"></span> Joining...';
 
-    fetch(`/join_challenge/${challengeId}`)
-        .then(response => response.json())
-        .then(data => {
+    EcoLearn.sync.submit({ type: 'join', challenge_id: parseInt(challengeId, 10) }, () => {
+        EcoLearn.showNotification('You are offline. You will join this challenge when you reconnect.', 'warning');
+    })
+        .then(result => {
+            const data = {
+                success: result.status === 'applied',
+                message: result.status === 'applied' ? 'Challenge joined successfully!'
+                    : result.status === 'duplicate' ? 'Already joined this challenge' : result.message
+            };
             if (data.success) {
                 // Update button and show success
                 button.closest('.challenge-actions').innerHTML = `
@@ -61,12 +67,6 @@ function joinChallenge(challengeId, button) {
                 button.disabled = false;
                 button.innerHTML = 'Join Challenge';
             }
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            EcoLearn.showNotification('Network error. Please try again.', 'error');
-            button.disabled = false;
-            button.innerHTML = 'Join Challenge';
         });
 }
 
@@ -78,11 +78,16 @@ function completeChallenge(challengeId, button) {
     button.disabled = true;
     button.innerHTML = '<span class="loading"></span> Completing...';
 
-    fetch(`/complete_challenge/${challengeId}`, {
-        method: 'POST'
+    EcoLearn.sync.submit({ type: 'complete', challenge_id: parseInt(challengeId, 10) }, () => {
+        EcoLearn.showNotification('You are offline. This challenge will be marked complete when you reconnect.', 'warning');
     })
-    .then(response => response.json())
-    .then(data => {
+    .then(result => {
+        // A duplicate or stale completion means it is already done, with no new points
+        const data = {
+            success: result.status !== 'error',
+            message: result.status === 'error' ? result.message : 'Challenge completed!',
+            points_earned: result.points_earned || 0
+        };
         if (data.success) {
             // Update challenge card
             const challengeCard = button.closest('.challenge-card');
@@ -109,12 +114,6 @@ function completeChallenge(challengeId, button) {
             button.disabled = false;
             button.innerHTML = 'Mark Complete';
         }
-    })
-    .catch(error => {
-        console.error('Error:', error);
-        EcoLearn.showNotification('Network error. Please try again.', 'error');
-        button.disabled = false;
-        button.innerHTML = 'Mark Complete';
     });
 }
 
@@ -1,11 +1,5 @@
 // Dashboard JavaScript
 
-document.addEventListener('DOMContentLoaded', function() {
-    initializeDashboardCharts();
-    initializeProgressAnimations();
-    updateLiveStats();
-});
-
 function initializeDashboardCharts() {
     // Simple progress chart using CSS (could be enhanced with Chart.js if needed)
     const progressBars = document.querySelectorAll('.progress-fill');
@@ -47,18 +41,38 @@ function animateNumber(element, start, end, duration) {
     requestAnimationFrame(update);
 }
 
+const LIVE_STATS_INTERVAL_MS = 30000;
+
 function updateLiveStats() {
-    // Update user progress stats every 30 seconds
-    setInterval(() => {
-        fetch('/api/user_progress')
-            .then(response => response.json())
-            .then(data => {
-                updateProgressDisplay(data);
+    // Long polling: the server holds the request until progress changes, or answers 304 when it
+    // times out or is too busy to wait. Either way the database is read at most once per interval.
+    let etag = null;
+
+    function check() {
+        const started = Date.now();
+        const headers = etag ? { 'If-None-Match': etag } : {};
+        fetch('/api/user_progress?wait=1', { headers: headers, cache: 'no-store' })
+            .then(response => {
+                if (response.status === 304) {
+                    setTimeout(check, Math.max(0, LIVE_STATS_INTERVAL_MS - (Date.now() - started)));
+                    return;
+                }
+                if (!response.ok) {
+                    throw new Error(`Progress request failed with status ${response.status}`);
+                }
+                etag = response.headers.get('ETag');
+                return response.json().then(data => {
+                    updateProgressDisplay(data);
+                    setTimeout(check, 0);
+                });
             })
             .catch(error => {
                 console.error('Error updating live stats:', error);
+                setTimeout(check, LIVE_STATS_INTERVAL_MS);
             });
-    }, 30000);
+    }
+
+    check();
 }
 
 function updateProgressDisplay(data) {
@@ -112,29 +112,22 @@ document.addEventListener('DOMContentLoaded', function() {
         submitBtn.disabled = true;
         submitBtn.innerHTML = '<span class="loading"></span> Submitting...';
 
-        // Submit quiz
-        fetch(`/submit_quiz/${lessonId}`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ answers: answers })
+        // Queue the submission; it is sent now, or as soon as the connection is back
+        EcoLearn.sync.submit({ type: 'quiz', lesson_id: parseInt(lessonId, 10), answers: answers }, () => {
+            EcoLearn.showNotification('You are offline. Your answers are saved and will be sent when you reconnect.', 'warning');
+            submitBtn.innerHTML = 'Saved, waiting for connection...';
         })
-        .then(response => response.json())
-        .then(data => {
-            if (data.success) {
-                showResults(data);
+        .then(result => {
+            if (result.status === 'applied') {
+                showResults(result);
+            } else if (result.status === 'stale') {
+                EcoLearn.showNotification('A newer attempt at this quiz is already saved.', 'warning');
+                submitBtn.innerHTML = 'Submitted';
             } else {
-                EcoLearn.showNotification('Error submitting quiz. Please try again.', 'error');
+                EcoLearn.showNotification(result.message || 'Error submitting quiz. Please try again.', 'error');
                 submitBtn.disabled = false;
                 submitBtn.innerHTML = 'Submit Quiz';
             }
-        })
-        .catch(error => {
-            console.error('Error:', error);
-            EcoLearn.showNotification('Network error. Please check your connection and try again.', 'error');
-            submitBtn.disabled = false;
-            submitBtn.innerHTML = 'Submit Quiz';
         });
     }
 
@@ -0,0 +1,158 @@
+// Offline sync queue
+//
+// Quiz submissions and challenge joins/completions are queued in localStorage
+// and uploaded in batches to /api/v1/sync. Nothing is lost when the connection
+// drops: the queue is flushed again when the browser comes back online, on the
+// next page load, and every RETRY_MS while actions are waiting. Resending an
+// action is harmless, the server reports it as a duplicate. A batch the server
+// rejects outright (a 4xx) is not retried: its actions are reported as errors,
+// and dropped unless the session has expired.
+
+(function() {
+    const userId = document.body.dataset.userId;
+    if (!userId) return;
+
+    const QUEUE_KEY = `ecolearn-sync-queue-${userId}`;
+    const TOKEN_KEY = `ecolearn-sync-token-${userId}`;
+    const BATCH_SIZE = 50;
+    const FLUSH_DELAY_MS = 300;
+    const RETRY_MS = 30000;
+
+    // Callbacks of actions queued by this page, by action id
+    const pending = {};
+    let flushTimer = null;
+    let flushing = false;
+
+    function loadQueue() {
+        try {
+            return JSON.parse(localStorage.getItem(QUEUE_KEY)) || [];
+        } catch (e) {
+            return [];
+        }
+    }
+
+    function saveQueue(queue) {
+        localStorage.setItem(QUEUE_KEY, JSON.stringify(queue));
+    }
+
+    function newId() {
+        if (window.crypto && crypto.randomUUID) return crypto.randomUUID();
+        return Date.now().toString(36) + Math.random().toString(36).slice(2);
+    }
+
+    // Queue an action such as {type: 'quiz', lesson_id: 3, answers: {...}}.
+    // Returns a promise for the server's result for it; onOffline is called
+    // if it could not be sent right away.
+    function submit(action, onOffline) {
+        const entry = Object.assign({ id: newId(), at: new Date().toISOString() }, action);
+        const queue = loadQueue();
+        queue.push(entry);
+        saveQueue(queue);
+
+        const result = new Promise(resolve => {
+            pending[entry.id] = { resolve, onOffline };
+        });
+        scheduleFlush(FLUSH_DELAY_MS);
+        return result;
+    }
+
+    function scheduleFlush(delay) {
+        clearTimeout(flushTimer);
+        flushTimer = setTimeout(flush, delay);
+    }
+
+    function flush() {
+        const queue = loadQueue();
+        if (flushing || !queue.length) return Promise.resolve();
+        if (!navigator.onLine) {
+            offline(queue);
+            scheduleFlush(RETRY_MS);
+            return Promise.resolve();
+        }
+
+        flushing = true;
+        const batch = queue.slice(0, BATCH_SIZE);
+        const since = localStorage.getItem(TOKEN_KEY);
+        return fetch('/api/v1/sync', {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ since: since, actions: batch })
+        })
+        .then(response => {
+            if (response.ok) return response.json().then(applied);
+            flushing = false;
+            if (response.status === 400 && since) {
+                // The sync token was not accepted; retry once as a full sync
+                localStorage.removeItem(TOKEN_KEY);
+                scheduleFlush(0);
+            } else if (response.status === 401) {
+                // The session expired: keep the queue for the next page load after logging in
+                settle(batch, 'Your session has expired. Please log in again to save your progress.');
+            } else if (response.status >= 400 && response.status < 500 && response.status !== 409) {
+                // Resending the same batch would be rejected again, so drop it
+                return response.json().catch(() => ({})).then(data => {
+                    dropFromQueue(batch);
+                    settle(batch, data.error || 'This could not be saved.');
+                    if (loadQueue().length) scheduleFlush(0);
+                });
+            } else {
+                throw new Error(`Sync failed with status ${response.status}`);
+            }
+        })
+        .catch(error => {
+            console.error('Sync error:', error);
+            flushing = false;
+            offline(loadQueue());
+            scheduleFlush(RETRY_MS);
+        });
+
+        function applied(data) {
+            // Every action in the batch has a result, errors included, so drop them all
+            dropFromQueue(batch);
+            localStorage.setItem(TOKEN_KEY, data.token);
+            data.results.forEach(resolve);
+            document.dispatchEvent(new CustomEvent('ecolearn:synced', { detail: data }));
+
+            flushing = false;
+            if (loadQueue().length) scheduleFlush(0);
+        }
+    }
+
+    function dropFromQueue(batch) {
+        const sent = new Set(batch.map(entry => entry.id));
+        saveQueue(loadQueue().filter(entry => !sent.has(entry.id)));
+    }
+
+    function resolve(result) {
+        const callbacks = pending[result.id];
+        if (callbacks) {
+            delete pending[result.id];
+            callbacks.resolve(result);
+        }
+    }
+
+    // Report a batch the server would not take as errors to the pages waiting on it
+    function settle(batch, message) {
+        batch.forEach(entry => resolve({ id: entry.id, status: 'error', message: message }));
+    }
+
+    function offline(queue) {
+        queue.forEach(entry => {
+            const callbacks = pending[entry.id];
+            if (callbacks && callbacks.onOffline) {
+                callbacks.onOffline(queue.length);
+                callbacks.onOffline = null;
+            }
+        });
+    }
+
+    window.addEventListener('online', () => scheduleFlush(0));
+    document.addEventListener('DOMContentLoaded', () => scheduleFlush(0));
+
+    window.EcoLearn = window.EcoLearn || {};
+    window.EcoLearn.sync = {
+        submit,
+        flush,
+        queued: () => loadQueue().length
+    };
+})();
@@ -0,0 +1,122 @@
+"""
+Offline sync for EcoLearn.
+
+The browser queues quiz submissions and challenge joins and completions
+(static/js/sync.js) and uploads them in batches to ``POST /api/v1/sync``,
+so a dropped classroom connection loses nothing and a busy page sends one
+request instead of one per action. Each action carries a client-generated
+id and the time it happened. The server applies a batch in one
+transaction, then returns a result per action and what changed for the
+student since the client's last sync token.
+
+Resending is harmless. An action no newer than what the server already
+has for that lesson or challenge is reported as ``duplicate`` (the same
+time) or ``stale`` (older) and not applied, so a client that lost a
+response can resend its queue. Changes are found by the rows' server-side
+``updated_at``, not the client's clock, so actions uploaded late from
+another device are still picked up by everyone's next sync.
+"""
+
+from datetime import datetime, timedelta, timezone
+
+from grading import parse_answers
+from models import db, UserBadge, UserChallenge, UserProgress
+from pagination import ApiError, decode_cursor, encode_cursor, serialize
+import archive
+
+ACTION_TYPES = ('quiz', 'join', 'complete')
+
+# Changes this close before a token are sent again, covering clock differences between web hosts
+TOKEN_OVERLAP = timedelta(seconds=5)
+
+
+def make_token(moment):
+    return encode_cursor(moment.isoformat())
+
+
+def read_token(token):
+    """The time a sync token was issued, or None for a first (full) sync."""
+    value = decode_cursor(token)
+    if value is None:
+        return None
+    try:
+        return datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        raise ApiError('Invalid sync token')
+
+
+def parse_time(value, now):
+    """A client timestamp as naive UTC, no later than ``now``; None if it is missing or malformed."""
+    try:
+        moment = datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        return None
+    if moment.tzinfo is not None:
+        moment = moment.astimezone(timezone.utc).replace(tzinfo=None)
+    return min(moment, now)
+
+
+def parse_actions(actions, max_actions, now):
+    """Normalize uploaded actions; a malformed action gets an ``error`` instead of failing the batch.
+
+    Each action becomes a dict with ``id``, ``type``, ``item_id`` (the lesson
+    or challenge), ``answers`` (quizzes only) and ``at``.
+    """
+    if not isinstance(actions, list):
+        raise ApiError('actions must be a list')
+    if len(actions) > max_actions:
+        raise ApiError(f'At most {max_actions} actions per sync')
+
+    parsed = []
+    for action in actions:
+        if not isinstance(action, dict):
+            raise ApiError('Each action must be an object')
+        kind = action.get('type')
+        item = action.get('lesson_id') if kind == 'quiz' else action.get('challenge_id')
+        entry = {'id': action.get('id'), 'type': kind, 'item_id': item, 'answers': action.get('answers') or {},
+                 'at': parse_time(action.get('at'), now)}
+        if not isinstance(entry['id'], str) or not entry['id']:
+            entry['error'] = 'id is required'
+        elif kind not in ACTION_TYPES:
+            entry['error'] = f"type must be one of {', '.join(ACTION_TYPES)}"
+        elif isinstance(item, bool) or not isinstance(item, int):
+            entry['error'] = ('lesson_id' if kind == 'quiz' else 'challenge_id') + ' must be an integer'
+        elif entry['at'] is None:
+            entry['error'] = 'at must be an ISO 8601 timestamp'
+        elif kind == 'quiz':
+            try:
+                entry['answers'] = parse_answers(entry['answers'])
+            except ValueError as e:
+                entry['error'] = str(e)
+        parsed.append(entry)
+    return parsed
+
+
+def changes(user_id, since=None):
+    """A student's lessons, challenges and badges changed since ``since`` (None: everything)."""
+    lessons = db.session.query(UserProgress.lesson_id, UserProgress.score, UserProgress.completed_at) \
+        .filter(UserProgress.user_id == user_id, UserProgress.completed == True)
+    challenges = db.session.query(UserChallenge.challenge_id, UserChallenge.status, UserChallenge.started_at,
+                                  UserChallenge.completed_at).filter(UserChallenge.user_id == user_id)
+    badges = db.session.query(UserBadge.badge_id).filter(UserBadge.user_id == user_id)
+    if since is not None:
+        since -= TOKEN_OVERLAP
+        lessons = lessons.filter(UserProgress.updated_at >= since)
+        challenges = challenges.filter(UserChallenge.updated_at >= since)
+        badges = badges.filter(UserBadge.earned_at >= since)
+
+    delta = {
+        'lessons': [{'id': lesson_id, 'score': score, 'completed_at': serialize(completed_at)}
+                    for lesson_id, score, completed_at in lessons],
+        'challenges': [{'id': challenge_id, 'status': status, 'started_at': serialize(started_at),
+                        'completed_at': serialize(completed_at)}
+                       for challenge_id, status, started_at, completed_at in challenges],
+        'badges': [badge_id for (badge_id,) in badges]
+    }
+    if since is None:
+        # Archived completions never change, so only a full sync lists them
+        archived = archive.archived_items(user_id)
+        delta['lessons'] += [{'id': lesson_id, 'archived': True} for lesson_id in sorted(archived['lesson'])]
+        delta['challenges'] += [{'id': challenge_id, 'status': 'completed', 'archived': True}
+                                for challenge_id in sorted(archived['challenge'])]
+    return delta
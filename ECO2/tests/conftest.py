@@ -0,0 +1,82 @@
+from contextlib import contextmanager
+import itertools
+import os
+import sys
+
+import pytest
+from sqlalchemy import event
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app import create_app
+from config import Config
+from database.init_db import init_db, init_sample_data
+from models import db, User, UserStats
+
+_names = itertools.count(1)
+
+
+@pytest.fixture(scope='session')
+def app(tmp_path_factory):
+    """One app and sample database for the run; caches are module-level, so tests share them."""
+    path = tmp_path_factory.mktemp('db') / 'ecolearn.db'
+
+    class TestConfig(Config):
+        TESTING = True
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{path}'
+        SQLALCHEMY_BINDS = {}
+        SESSION_STORE = 'memory'
+        PROGRESS_WAIT_SECONDS = 0
+
+    app = create_app(TestConfig)
+    with app.app_context():
+        init_db()
+        init_sample_data()
+    return app
+
+
+@pytest.fixture
+def make_user(app):
+    """Create a user and return its id; each call gets a fresh username."""
+    def make(user_type='student', school='Test School', points=0):
+        number = next(_names)
+        with app.app_context():
+            user = User(username=f'test{number}', email=f'test{number}@example.com', password='password',
+                        user_type=user_type, school=school, points=points)
+            db.session.add(user)
+            db.session.flush()
+            db.session.add(UserStats(user_id=user.id))
+            db.session.commit()
+            return user.id
+    return make
+
+
+@pytest.fixture
+def login(app):
+    """Return a test client logged in as ``user_id``."""
+    def log_in(user_id):
+        client = app.test_client()
+        with client.session_transaction() as session:
+            session['user_id'] = user_id
+        return client
+    return log_in
+
+
+@pytest.fixture
+def statements(app):
+    """``with statements() as executed:`` collects the SQL run on the primary inside the block."""
+    @contextmanager
+    def collect():
+        executed = []
+
+        def record(conn, cursor, statement, parameters, context, executemany):
+            executed.append(statement)
+
+        with app.app_context():
+            engine = db.engine
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield executed
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+    return collect
@@ -0,0 +1,31 @@
+from datetime import datetime, timedelta
+
+from analytics import rebuild_rollups
+from models import ActivityRollup
+
+
+def rollups(school):
+    rows = ActivityRollup.query.filter_by(school=school)
+    return {(r.period, r.bucket, r.kind, r.category, r.item_id): (r.completions, r.score_sum, r.points)
+            for r in rows if r.completions or r.score_sum or r.points}
+
+
+def test_rebuild_matches_incremental_for_offline_completions(app, make_user, login):
+    school = 'Offline School'
+    client = login(make_user(school=school))
+    # Completed offline two days ago, uploaded now
+    at = (datetime.utcnow() - timedelta(days=2)).replace(microsecond=0).isoformat() + 'Z'
+    actions = [
+        {'id': 'q1', 'type': 'quiz', 'lesson_id': 1, 'answers': {'1': 1}, 'at': at},
+        {'id': 'j1', 'type': 'join', 'challenge_id': 1, 'at': at},
+        {'id': 'c1', 'type': 'complete', 'challenge_id': 1, 'at': at}
+    ]
+    response = client.post('/api/v1/sync', json={'actions': actions})
+    assert [r['status'] for r in response.json['results']] == ['applied'] * 3
+
+    with app.app_context():
+        incremental = rollups(school)
+        assert {bucket.date() for _, bucket, *_ in incremental} == {datetime.fromisoformat(at[:-1]).date()}
+        assert sum(points for _, _, points in incremental.values()) > 0
+        rebuild_rollups()
+        assert rollups(school) == incremental
@@ -0,0 +1,52 @@
+from app import get_leaderboard, ranking
+from leaderboard import Leaderboard
+from models import db, PointsEvent, User
+
+
+def points(board):
+    return {student['username']: student['points'] for student in board.top_students(limit=100000)}
+
+
+def test_event_committed_out_of_order_is_applied_once():
+    board = Leaderboard(catch_up_seconds=0)
+    board.load([(1, 'a', 'S', 0), (2, 'b', 'S', 0)], last_event_id=10)
+    # Event 11 is still in flight when 12 is read
+    board.catch_up([], [(12, 1, 5)])
+    assert points(board) == {'a': 5, 'b': 0}
+    assert board.catch_up_after() == 10
+
+    board.catch_up([], [(11, 2, 7), (12, 1, 5)])
+    board.catch_up([], [(11, 2, 7), (12, 1, 5)])
+    assert points(board) == {'a': 5, 'b': 7}
+    assert board.catch_up_after() == 12
+
+
+def test_gap_expires():
+    board = Leaderboard(catch_up_seconds=0, gap_seconds=0)
+    board.load([(1, 'a', 'S', 0)], last_event_id=10)
+    board.catch_up([], [(12, 1, 5)])
+    assert board.catch_up_after() == 12
+
+
+def test_load_leaves_uncommitted_ids_to_the_catch_up(app, make_user):
+    user_id = make_user()
+    with app.app_context():
+        username = db.session.get(User, user_id).username
+        last = db.session.query(db.func.max(PointsEvent.id)).scalar() or 0
+
+        def commit_event(event_id, amount):
+            db.session.add(PointsEvent(id=event_id, user_id=user_id, amount=amount, reason='test',
+                                       idempotency_key=f'test:{event_id}'))
+            User.query.filter_by(id=user_id).update({User.points: User.points + amount})
+            db.session.commit()
+
+        # last + 1 is taken by a transaction that commits after the leaderboard loads
+        commit_event(last + 2, 10)
+        ranking.invalidate()
+        assert points(get_leaderboard())[username] == 10
+
+        commit_event(last + 1, 3)
+        ranking.catch_up_soon()
+        assert points(get_leaderboard())[username] == 13
+        ranking.invalidate()
+        assert points(get_leaderboard())[username] == 13
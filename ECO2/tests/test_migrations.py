@@ -0,0 +1,30 @@
+from sqlalchemy import create_engine, text
+
+from database.migrations import MIGRATIONS, check_query_plans, upgrade
+from models import db
+
+
+def test_migrations_upgrade_existing_database(tmp_path):
+    engine = create_engine(f'sqlite:///{tmp_path / "old.db"}')
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # Back to the schema before migrations: no lookup indexes and no updated_at columns
+        indexes = conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index' AND sql IS NOT NULL"))
+        for name in indexes.scalars().all():
+            conn.execute(text(f'DROP INDEX "{name}"'))
+        for table in ('user_progress', 'user_challenge'):
+            conn.execute(text(f'ALTER TABLE {table} DROP COLUMN updated_at'))
+        conn.execute(text('INSERT INTO "user" (id, username, email, password, user_type, school, points) '
+                          "VALUES (1, 'old', 'old@example.com', 'x', 'student', 'A', 30)"))
+        conn.execute(text('INSERT INTO user_progress (user_id, lesson_id, completed, score, completed_at) '
+                          'VALUES (1, 1, TRUE, 2, CURRENT_TIMESTAMP)'))
+
+    assert len(upgrade(engine)) == len(MIGRATIONS)
+    assert upgrade(engine) == []
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT amount FROM points_event WHERE reason = 'opening_balance'")).scalar() == 30
+        assert conn.execute(text('SELECT completed_lessons, score_sum FROM user_stats')).one() == (1, 2)
+        assert conn.execute(text('SELECT COUNT(*) FROM user_progress WHERE updated_at IS NULL')).scalar() == 0
+
+    failed = [(query, plan) for query, index, plan, ok in check_query_plans(engine) if not ok]
+    assert failed == []
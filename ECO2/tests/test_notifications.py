@@ -0,0 +1,23 @@
+from models import db, User
+from notifications import ProgressNotifier
+
+
+def test_notifier_keeps_recent_users_only():
+    notifier = ProgressNotifier(max_users=2)
+    for user_id in (1, 2, 1, 3):
+        notifier.notify(user_id)
+    assert (notifier.counter(1), notifier.counter(2), notifier.counter(3)) == (2, 0, 1)
+
+
+def test_long_poll_sees_change_from_another_worker(app, make_user, login):
+    user_id = make_user(points=10)
+    client = login(user_id)
+    etag = client.get('/api/user_progress').headers['ETag']
+
+    # Written by another process: no notification reaches this one
+    with app.app_context():
+        db.session.get(User, user_id).points = 25
+        db.session.commit()
+
+    response = client.get('/api/user_progress?wait=1', headers={'If-None-Match': etag})
+    assert response.status_code == 200 and response.json['points'] == 25
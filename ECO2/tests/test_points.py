@@ -0,0 +1,18 @@
+from sqlalchemy import text
+
+from models import db, User
+from points import rebuild_points
+
+
+def test_rebuild_repairs_null_balance(app, make_user, login):
+    user_id = make_user()
+    login(user_id).post('/submit_quiz/1', json={'answers': {'1': 1}})
+    with app.app_context():
+        earned = db.session.get(User, user_id).points
+        db.session.execute(text('UPDATE "user" SET points = NULL WHERE id = :id'), {'id': user_id})
+        db.session.commit()
+
+        assert rebuild_points(user_id) == 1
+        db.session.expire_all()
+        assert earned and db.session.get(User, user_id).points == earned
+        assert rebuild_points(user_id) == 0
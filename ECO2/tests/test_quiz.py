@@ -0,0 +1,51 @@
+from datetime import datetime
+
+import archive
+from models import db, User, UserProgress
+
+
+def insert_progress_first(monkeypatch, name):
+    """Make ``archive.<name>`` commit the user's lesson 1 progress from another connection, once."""
+    original = getattr(archive, name)
+
+    def other_request_commits_first(user_id, *args):
+        with db.engine.begin() as connection:
+            connection.execute(db.insert(UserProgress).values(
+                user_id=user_id, lesson_id=1, completed=True, score=0, completed_at=datetime.utcnow()))
+        monkeypatch.setattr(archive, name, original)
+        return original(user_id, *args)
+
+    monkeypatch.setattr(archive, name, other_request_commits_first)
+
+
+def test_submit_quiz_awards_points_once(app, make_user, login):
+    user_id = make_user()
+    client = login(user_id)
+    first = client.post('/submit_quiz/1', json={'answers': {'1': 1}}).json
+    again = client.post('/submit_quiz/1', json={'answers': {'1': 1}}).json
+    assert first['success'] and first['points_earned'] > 0
+    assert again['success'] and again['points_earned'] == 0
+
+
+def test_concurrent_double_submit_is_a_retake(app, make_user, login, monkeypatch):
+    user_id = make_user()
+    client = login(user_id)
+    insert_progress_first(monkeypatch, 'restore')
+
+    response = client.post('/submit_quiz/1', json={'answers': {'1': 1}})
+    assert response.status_code == 200 and response.json['success']
+    with app.app_context():
+        rows = UserProgress.query.filter_by(user_id=user_id, lesson_id=1).all()
+        assert len(rows) == 1 and rows[0].score == response.json['score']
+
+
+def test_concurrent_batch_submit_is_a_retake(app, make_user, login, monkeypatch):
+    user_id = make_user()
+    client = login(user_id)
+    insert_progress_first(monkeypatch, 'archived_items')
+
+    response = client.post('/api/submit_quizzes', json={'submissions': [{'lesson_id': 1, 'answers': {'1': 1}}]})
+    assert response.status_code == 200 and response.json['results'][0]['success']
+    with app.app_context():
+        assert UserProgress.query.filter_by(user_id=user_id, lesson_id=1).count() == 1
+        assert db.session.get(User, user_id).points == response.json['points_earned']
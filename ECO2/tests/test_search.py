@@ -0,0 +1,17 @@
+import app as eco
+
+
+def test_search_skips_items_deleted_after_the_search(make_user, login, monkeypatch):
+    search_hits = eco.search_hits
+
+    def with_deleted_hit(args):
+        index, hits = search_hits(args)
+        # An item deleted between the search and describing its hits
+        return index, [(1000.0, 'lesson', 999999)] + hits
+    monkeypatch.setattr(eco, 'search_hits', with_deleted_hit)
+
+    client = login(make_user())
+    response = client.get('/api/v1/search?q=energy')
+    assert response.status_code == 200
+    assert response.json['data'] and all(result['id'] != 999999 for result in response.json['data'])
+    assert client.get('/search?q=energy').status_code == 200
@@ -0,0 +1,47 @@
+import pytest
+
+from sessions import MemorySessionStore, SQLiteSessionStore
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemorySessionStore(3600)
+    return SQLiteSessionStore(str(tmp_path / 'sessions.db'), 3600)
+
+
+def snapshot(store, sid):
+    return store.load(sid)[1]
+
+
+def test_snapshot_loaded_before_forget_is_not_stored(store):
+    store.save('a', 1, '{}')
+    store.save('b', 1, '{}')
+    # Session a reloads the user, then session b changes them and forgets every snapshot
+    generation = store.generation(1)
+    store.clear_snapshots(1)
+    store.save_snapshot('a', 'stale', generation)
+    assert snapshot(store, 'a') is None
+
+    store.save_snapshot('a', 'fresh', store.generation(1))
+    assert snapshot(store, 'a') == 'fresh'
+
+
+def test_forgetting_everyone_also_counts(store):
+    store.save('a', 1, '{}')
+    generation = store.generation(1)
+    store.clear_snapshots()
+    store.save_snapshot('a', 'stale', generation)
+    assert snapshot(store, 'a') is None
+
+
+def test_saving_data_keeps_the_stored_snapshot(store):
+    store.save('a', 1, '{}')
+    store.save_snapshot('a', 'current', store.generation(1))
+    store.save('a', 1, '{"x": 1}')
+    assert store.load('a')[:2] == ('{"x": 1}', 'current')
+    # Another user's changes do not block this one
+    generation = store.generation(1)
+    store.clear_snapshots(2)
+    store.save_snapshot('a', 'newer', generation)
+    assert snapshot(store, 'a') == 'newer'
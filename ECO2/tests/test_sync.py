@@ -0,0 +1,38 @@
+from datetime import datetime
+
+import archive
+from models import db, UserProgress
+
+
+def quiz_action(at='2026-03-02T09:00:00Z'):
+    return {'id': 'a1', 'type': 'quiz', 'lesson_id': 1, 'answers': {'1': 1}, 'at': at}
+
+
+def test_sync_applies_quiz(make_user, login):
+    client = login(make_user())
+    response = client.post('/api/v1/sync', json={'actions': [quiz_action()]})
+    assert response.status_code == 200
+    assert response.json['results'][0]['status'] == 'applied'
+
+
+def test_concurrent_duplicate_sync_is_a_conflict(app, make_user, login, monkeypatch):
+    user_id = make_user()
+    client = login(user_id)
+    archived_items = archive.archived_items
+
+    def other_tab_commits_first(user_id):
+        # The same queued action lands from another request after this one has read the user's progress
+        with db.engine.begin() as connection:
+            connection.execute(db.insert(UserProgress).values(
+                user_id=user_id, lesson_id=1, completed=True, score=1, completed_at=datetime(2026, 3, 2, 9)))
+        monkeypatch.setattr(archive, 'archived_items', archived_items)
+        return archived_items(user_id)
+
+    monkeypatch.setattr(archive, 'archived_items', other_tab_commits_first)
+    response = client.post('/api/v1/sync', json={'actions': [quiz_action()]})
+    assert response.status_code == 409
+
+    # The client resends the batch and learns it was already applied
+    response = client.post('/api/v1/sync', json={'actions': [quiz_action()]})
+    assert response.status_code == 200
+    assert response.json['results'][0]['status'] == 'duplicate'